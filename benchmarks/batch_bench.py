@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Wall time of a batch of commands: one 'iris run' each vs. 'iris run -j N'.
+
+Generates a batch of independent commands that each wait a little (a
+health check, a network call) and print a few lines, every fifth one
+failing. The batch is run the way scripts do today, one 'iris run' per
+command, and then as one 'iris run -j N --file' for each N. Each run gets
+its own HOME and is checked afterwards: 'recorded' counts the commands
+its traces hold once with the right exit code. Separate 'iris run's name
+their traces by the second they started in, so runs within one second
+overwrite each other's trace.
+
+    python benchmarks/batch_bench.py --commands 40 --jobs 1,4,16
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IRIS = os.path.join(ROOT, "iris.py")
+sys.path.insert(0, ROOT)
+
+
+def make_commands(count, sleep, lines):
+    commands = []
+    for i in range(1, count + 1):
+        code = 1 if i % 5 == 0 else 0
+        commands.append(f"sleep {sleep}; for n in $(seq {lines}); do echo step {i} line $n; done; exit {code}")
+    return commands
+
+
+def _env(home):
+    return dict(os.environ, HOME=home, IRIS_STORAGE="trace")
+
+
+def run_each(commands, home):
+    started = time.perf_counter()
+    for command in commands:
+        subprocess.run([sys.executable, IRIS, "run", "/bin/sh", "-c", command], cwd=home, env=_env(home),
+                       stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def run_batch(commands, home, jobs):
+    batch_file = os.path.join(home, "commands.txt")
+    with open(batch_file, "w") as f:
+        f.write("\n".join(commands) + "\n")
+    started = time.perf_counter()
+    subprocess.run([sys.executable, IRIS, "run", "-j", str(jobs), "--file", batch_file], cwd=home,
+                   env=_env(home), stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def check(home, commands):
+    """How many commands the traces in home hold once with the right exit code."""
+    from storage import open_session
+    recorded = []
+    for trace in glob.glob(os.path.join(home, "*.trace")):
+        for event in open_session(trace).events():
+            # One 'iris run' per command records the argv it was given.
+            command = event["command"]
+            if command.startswith("/bin/sh -c "):
+                command = command[len("/bin/sh -c "):]
+            recorded.append((command, event["exit_code"]))
+    expected = [(command, 1 if i % 5 == 0 else 0) for i, command in enumerate(commands, 1)]
+    return sum(recorded.count(pair) == 1 for pair in expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=40, help="Commands in the batch")
+    parser.add_argument("--sleep", type=float, default=0.1, help="Seconds each command waits")
+    parser.add_argument("--lines", type=int, default=20, help="Lines each command prints")
+    parser.add_argument("--jobs", default="1,2,4,8,16", help="Comma-separated worker counts to try")
+    args = parser.parse_args()
+
+    commands = make_commands(args.commands, args.sleep, args.lines)
+    print(f"{args.commands} commands, {args.sleep}s wait and {args.lines} lines each\n")
+    print(f"{'mode':<22}{'wall s':>9}{'commands/s':>12}{'speedup':>9}  recorded")
+    baseline = None
+    runs = [("iris run per command", None)] + [(f"iris run -j {jobs}", int(jobs)) for jobs in args.jobs.split(",")]
+    for name, jobs in runs:
+        with tempfile.TemporaryDirectory() as home:
+            if jobs is None:
+                wall = run_each(commands, home)
+            else:
+                wall = run_batch(commands, home, jobs)
+            recorded = check(home, commands)
+        if baseline is None:
+            baseline = wall
+        print(f"{name:<22}{wall:>9.2f}{len(commands) / wall:>12.1f}{baseline / wall:>8.1f}x  {recorded}/{len(commands)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Load generator for the iris daemon ingest path.
+
+Starts a daemon against a throwaway ~/.iris, attaches N simulated terminals
+as separate processes over long-lived connections, and reports ingest
+throughput (events/sec) and end-to-end ingest latency percentiles.
+
+    python benchmarks/daemon_load.py --clients 12 --events 5000 --batch 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The daemon resolves ~/.iris at import time, so point HOME somewhere safe first.
+_home = tempfile.mkdtemp(prefix="iris-bench-")
+os.environ["HOME"] = _home
+
+import daemon  # noqa: E402
+
+
+class BenchDaemon(daemon.IrisDaemon):
+    """Daemon that timestamps each event the moment it is ingested."""
+
+    def __init__(self, transport):
+        super().__init__(transport)
+        self.trace_file = os.path.join(_home, "bench.trace")
+        self.latencies = []
+        self.first_ingest = None
+        self.last_ingest = None
+
+    def _ingest(self, event):
+        now = time.time()
+        self.latencies.append(now - event.get("sent_at", now))
+        if self.first_ingest is None:
+            self.first_ingest = now
+        self.last_ingest = now
+        super()._ingest(event)
+
+
+def _client(n_events, batch, payload):
+    client = daemon.DaemonClient(batch_size=batch)
+    output = "x" * payload
+    for i in range(n_events):
+        client.send({
+            "type": "command",
+            "timestamp": "2026-01-01T00:00:00",
+            "command": f"echo {i}",
+            "output": output,
+            "exit_code": 0,
+            "duration_ms": 1,
+            "sent_at": time.time(),
+        })
+    client.flush()
+    client.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=12, help="Simulated terminals")
+    parser.add_argument("--events", type=int, default=2000, help="Events per terminal")
+    parser.add_argument("--batch", type=int, default=1, help="Client batch size")
+    parser.add_argument("--payload", type=int, default=256, help="Output bytes per event")
+    parser.add_argument("--transport", choices=["tcp", "unix"], default="tcp")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    bench = BenchDaemon(args.transport)
+    server = threading.Thread(target=bench.start, daemon=True)
+    devnull = open(os.devnull, "w")
+    real_stdout, sys.stdout = sys.stdout, devnull
+    server.start()
+    while not os.path.exists(daemon.DAEMON_PORT_FILE):
+        time.sleep(0.01)
+
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_client, args=(args.events, args.batch, args.payload))
+             for _ in range(args.clients)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    expected = args.clients * args.events
+    deadline = time.time() + 30
+    while len(bench.events) < expected and time.time() < deadline:
+        time.sleep(0.01)
+
+    with open(daemon.STOP_SIGNAL, "w") as f:
+        f.write("stop")
+    server.join(timeout=10)
+    sys.stdout = real_stdout
+    devnull.close()
+
+    elapsed = max(1e-9, (bench.last_ingest or 0) - (bench.first_ingest or 0))
+    lat_ms = [x * 1000 for x in bench.latencies]
+    print(f"transport={args.transport} clients={args.clients} batch={args.batch} payload={args.payload}B")
+    print(f"ingested {len(bench.latencies)}/{expected} events in {elapsed:.3f}s")
+    print(f"throughput: {len(bench.latencies) / elapsed:,.0f} events/sec")
+    print(f"latency p50: {percentile(lat_ms, 50):.2f} ms  p99: {percentile(lat_ms, 99):.2f} ms  "
+          f"max: {max(lat_ms) if lat_ms else 0:.2f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "transport": args.transport, "clients": args.clients, "batch": args.batch,
+                "payload": args.payload, "ingested": len(bench.latencies), "expected": expected,
+                "events_per_sec": round(len(bench.latencies) / elapsed),
+                "latency_p50_ms": round(percentile(lat_ms, 50), 3),
+                "latency_p99_ms": round(percentile(lat_ms, 99), 3),
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
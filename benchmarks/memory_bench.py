@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Memory held by a daemon session: a list of event dicts vs. EventStore.
+
+Builds a synthetic multi-terminal session (100k events by default) the way
+the daemon receives it: one JSON line per event from a handful of hosts
+and terminals, decoded with json.loads so no strings are shared between
+events. The events are then kept both ways and compared on:
+
+  * memory:  bytes allocated for the session (tracemalloc), per event
+  * ingest:  time to decode and keep each event
+  * compact: time EventStore.compact() spends compressing each event,
+             which the daemon does on its checkpoint thread
+  * save:    time to write the whole session as a trace
+
+    python benchmarks/memory_bench.py --events 100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from synth import SessionGenerator  # noqa: E402
+from eventstore import EventStore  # noqa: E402
+
+
+def session_lines(count, seed, output_kb, spread):
+    """JSON lines as terminals would send them to the daemon."""
+    rng = random.Random(seed)
+    hosts = [f"web-{i:02d}.prod.example.com" for i in range(8)]
+    lines = []
+    for event in SessionGenerator(seed, output_kb=output_kb, spread=spread).events(count):
+        host = rng.randrange(len(hosts))
+        event["timing"] = [[0, 0]] + [[rng.randint(1, 5000), rng.randint(1, 4096)] for _ in range(rng.randint(0, 6))]
+        if rng.random() < 0.3:
+            event["resources"] = {"first_output_ms": rng.randint(1, 500), "user_ms": rng.randint(0, 900),
+                                  "sys_ms": rng.randint(0, 90), "max_rss_kb": rng.randint(2000, 90000)}
+        event["host"] = hosts[host]
+        event["terminal"] = f"pts/{host * 3 + rng.randrange(3)}"
+        lines.append(json.dumps(event).encode('utf-8'))
+    return lines
+
+
+def keep(lines, events):
+    for line in lines:
+        events.append(json.loads(line))
+    return events
+
+
+def compact(events):
+    if isinstance(events, EventStore):
+        events.compact()
+
+
+def measure(lines, make):
+    tracemalloc.start()
+    events = keep(lines, make())
+    compact(events)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del events
+    started = time.perf_counter()
+    events = keep(lines, make())
+    ingest = time.perf_counter() - started
+    compact(events)
+    compacting = time.perf_counter() - started - ingest
+    return current, ingest, compacting, events
+
+
+def save(events, directory):
+    from storage import TraceWriter
+    started = time.perf_counter()
+    writer = TraceWriter(os.path.join(directory, "session.trace"), "bench", datetime.datetime(2026, 1, 1),
+                         hostname="bench", buffered=True)
+    for event in events:
+        writer.append(event)
+    writer.close(datetime.datetime(2026, 1, 2))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000, help="Events in the session")
+    parser.add_argument("--output-kb", type=float, default=0.5, help="Median output size per command")
+    parser.add_argument("--spread", type=float, default=1.0, help="Log-normal sigma of output sizes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    lines = session_lines(args.events, args.seed, args.output_kb, args.spread)
+    wire_mb = sum(len(line) for line in lines) / (1024 * 1024)
+    print(f"{args.events:,} events, {wire_mb:.1f} MB as JSON lines\n")
+    print(f"{'representation':<16}{'memory MB':>11}{'bytes/event':>13}{'ingest us/event':>17}"
+          f"{'compact us/event':>18}{'save s':>9}")
+
+    results = {}
+    reference = None
+    with tempfile.TemporaryDirectory() as directory:
+        for name, make in (("dicts", list), ("EventStore", lambda: EventStore(compact_every=None))):
+            memory, ingest, compacting, events = measure(lines, make)
+            saved = save(events, directory)
+            if reference is None:
+                reference = events
+            else:
+                step = max(1, len(events) // 1000)
+                assert all(events[i] == reference[i] for i in range(0, len(events), step)), "events differ"
+            per_event = 1e6 / len(lines)
+            results[name] = {"memory_bytes": memory, "ingest_us_per_event": round(ingest * per_event, 2),
+                             "compact_us_per_event": round(compacting * per_event, 2), "save_seconds": round(saved, 3)}
+            print(f"{name:<16}{memory / (1024 * 1024):>11.1f}{memory / len(lines):>13,.0f}"
+                  f"{ingest * per_event:>17.1f}{compacting * per_event:>18.1f}{saved:>9.2f}")
+    ratio = results["dicts"]["memory_bytes"] / results["EventStore"]["memory_bytes"]
+    print(f"\nEventStore holds the session in {1 / ratio:.0%} of the memory ({ratio:.1f}x smaller).")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
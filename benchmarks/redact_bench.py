@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Redaction throughput on synthetic log corpora.
+
+Compares the compiled single-pass engine in redact.py against applying each
+pattern in SENSITIVE_PATTERNS with re.sub in turn, checks that both produce
+identical output, and reports MB/s for each corpus.
+
+    python benchmarks/redact_bench.py --size-mb 8
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from redact import RedactionEngine, SENSITIVE_PATTERNS, SENSITIVE_LITERALS  # noqa: E402
+
+LOG_LINES = [
+    "2026-02-24 14:30:{s:02d} INFO  request handled path=/api/v1/items status=200 in {n}ms",
+    "2026-02-24 14:30:{s:02d} DEBUG cache miss for key item:{n} falling back to database",
+    "2026-02-24 14:30:{s:02d} WARN  slow query took {n}ms on replica-2",
+    "[{n}/5000] Compiling src/module_{n}.c",
+    "  File \"/srv/app/worker.py\", line {n}, in handle",
+]
+SECRET_LINES = [
+    "export API_KEY={hex}",
+    "Authorization: Bearer {hex}",
+    "db password={word}{n}",
+    "token: {hex}",
+    "commit {hex}",
+]
+
+
+def make_corpus(size_bytes, secret_ratio, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size_bytes:
+        n = rng.randint(1, 99999)
+        if rng.random() < secret_ratio:
+            hexs = "%040x" % rng.getrandbits(160)
+            line = rng.choice(SECRET_LINES).format(hex=hexs, word="hunter", n=n)
+        else:
+            line = rng.choice(LOG_LINES).format(s=n % 60, n=n)
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+
+def legacy_redact(text):
+    for pattern in SENSITIVE_PATTERNS:
+        text = re.sub(pattern, '[REDACTED]', text)
+    return text
+
+
+def bench(fn, text, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=4.0, help="Size of each corpus in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is kept)")
+    args = parser.parse_args()
+
+    engine = RedactionEngine(SENSITIVE_PATTERNS, SENSITIVE_LITERALS)
+    size = int(args.size_mb * 1024 * 1024)
+    corpora = [
+        ("clean logs", make_corpus(size, 0.0)),
+        ("1 secret / 10k lines", make_corpus(size, 0.0001)),
+        ("1 secret / 100 lines", make_corpus(size, 0.01)),
+        ("1 secret / 5 lines", make_corpus(size, 0.2)),
+    ]
+
+    print(f"{'corpus':<24}{'legacy MB/s':>14}{'engine MB/s':>14}{'speedup':>10}")
+    for name, text in corpora:
+        mb = len(text) / (1024 * 1024)
+        t_old, out_old = bench(legacy_redact, text, args.repeat)
+        t_new, out_new = bench(engine.redact, text, args.repeat)
+        if out_old != out_new:
+            print(f"{name}: OUTPUT MISMATCH")
+            sys.exit(1)
+        print(f"{name:<24}{mb / t_old:>14.1f}{mb / t_new:>14.1f}{t_old / t_new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
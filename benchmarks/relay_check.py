@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""End-to-end check of daemon relaying and 'iris merge' with local processes.
+
+Starts two relay daemons (iris start --upstream) and, a moment later, the
+upstream daemon they forward to (iris start --listen), each as its own
+process with its own ~/.iris. Sender processes feed every relay events
+whose timestamps interleave and arrive slightly out of order, half of
+them before the upstream is up. Once everything is stopped it checks that:
+
+  * each relay saved all of its own events,
+  * the upstream trace holds every event once (or more, as delivery is
+    at least once), tagged with the host, session and id it came from,
+  * 'iris merge' of the relay traces is complete, renumbered and in
+    timestamp order.
+
+    python benchmarks/relay_check.py --events 500
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import datetime
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IRIS = os.path.join(ROOT, "iris.py")
+sys.path.insert(0, ROOT)
+
+BASE_TIME = datetime.datetime(2026, 3, 1, 9, 0, 0)
+
+
+def _env(home):
+    return dict(os.environ, HOME=home, IRIS_RELAY_RETRY="0.2", IRIS_STORAGE="trace")
+
+
+def _start(home, *args):
+    os.makedirs(home, exist_ok=True)
+    log = open(os.path.join(home, "daemon.log"), "w")
+    proc = subprocess.Popen([sys.executable, IRIS, "start", *args], cwd=home, env=_env(home),
+                            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+    port_file = os.path.join(home, ".iris", "daemon.port")
+    deadline = time.time() + 10
+    while not os.path.exists(port_file):
+        if time.time() > deadline or proc.poll() is not None:
+            raise RuntimeError(f"daemon in {home} did not start; see {log.name}")
+        time.sleep(0.05)
+    return proc
+
+
+def _stop(home, proc):
+    subprocess.run([sys.executable, IRIS, "stop"], env=_env(home), stdout=subprocess.DEVNULL, check=True)
+    proc.wait(timeout=30)
+
+
+def _status(address):
+    from client import connect_daemon
+    sock = connect_daemon(5.0, address)
+    try:
+        sock.sendall(b'{"type": "control", "command": "status"}\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+    finally:
+        sock.close()
+
+
+def _send(home, relay, first, count, total_relays):
+    """Send events first..first+count-1 of this relay through a child process attached to it."""
+    code = f"""
+import sys, random, datetime
+sys.path.insert(0, {ROOT!r})
+import client
+base = datetime.datetime.fromisoformat({BASE_TIME.isoformat()!r})
+rng = random.Random({relay * 7919 + first})
+order = list(range({first}, {first + count}))
+# Neighbouring commands finish close together and are reported slightly out of order.
+for i in range(0, len(order) - 1, 2):
+    if rng.random() < 0.5:
+        order[i], order[i + 1] = order[i + 1], order[i]
+c = client.DaemonClient()
+for n in order:
+    ts = base + datetime.timedelta(seconds=n * {total_relays} + {relay})
+    c.send({{"type": "command", "timestamp": ts.isoformat(), "command": f"step {{n}} on relay {relay}",
+             "output": "ok", "exit_code": 0, "duration_ms": 1, "host": "host{relay}", "terminal": "pts/{relay}"}})
+c.flush()
+c.close()
+"""
+    subprocess.run([sys.executable, "-c", code], env=_env(home), check=True)
+
+
+def _events(path):
+    from storage import open_session
+    return list(open_session(path).events())
+
+
+def _trace(home):
+    traces = [name for name in os.listdir(home) if name.endswith(".trace")]
+    if len(traces) != 1:
+        raise RuntimeError(f"expected one trace in {home}, found {traces}")
+    return os.path.join(home, traces[0])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200, help="Events sent through each relay")
+    parser.add_argument("--relays", type=int, default=2, help="Relaying daemons")
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(ok, what):
+        print(f"{'ok  ' if ok else 'FAIL'}  {what}")
+        if not ok:
+            failures.append(what)
+
+    root = tempfile.mkdtemp(prefix="iris-relay-")
+    up_home = os.path.join(root, "upstream")
+    address = f"127.0.0.1:{_free_port()}"
+    relay_homes = [os.path.join(root, f"relay{i}") for i in range(args.relays)]
+    half = args.events // 2
+
+    relays = []
+    for home in relay_homes:
+        relays.append(_start(home, "--upstream", address))
+        # Daemon session ids are per second; keep the relays' apart.
+        time.sleep(1.1)
+    for i, home in enumerate(relay_homes):
+        _send(home, i, 0, half, args.relays)
+    upstream = _start(up_home, "--listen", address)
+    for i, home in enumerate(relay_homes):
+        _send(home, i, half, args.events - half, args.relays)
+
+    expected = args.events * args.relays
+    deadline = time.time() + 30
+    while _status(address)["events"] < expected and time.time() < deadline:
+        time.sleep(0.1)
+    for home, proc in zip(relay_homes, relays):
+        _stop(home, proc)
+    _stop(up_home, upstream)
+
+    for i, home in enumerate(relay_homes):
+        check(len(_events(_trace(home))) == args.events, f"relay{i} saved its {args.events} events")
+
+    received = _events(_trace(up_home))
+    origins = {(e.get("session"), e.get("source_id")) for e in received}
+    check(len(origins) == expected, f"upstream received all {expected} events ({len(received)} with duplicates)")
+    check(all(e.get("host") and e.get("session") and e.get("source_id") for e in received),
+          "relayed events are tagged with host, session and source id")
+    check(len({e.get("session") for e in received}) == args.relays, "one session per relay")
+
+    merged_file = os.path.join(root, "merged.trace")
+    subprocess.run([sys.executable, IRIS, "merge", *[_trace(h) for h in relay_homes], "--output", merged_file],
+                   env=_env(root), check=True)
+    merged = _events(merged_file)
+    stamps = [e["timestamp"] for e in merged]
+    check(len(merged) == expected, f"merge holds all {expected} events")
+    check([e["id"] for e in merged] == list(range(1, expected + 1)), "merged ids run 1..n")
+    check(stamps == sorted(stamps), "merged events are in timestamp order")
+    check(all(e.get("host") and e.get("terminal") and e.get("session") for e in merged),
+          "merged events are tagged with host, terminal and session")
+
+    print(f"\nTraces left in {root}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Check that 'iris run' records the peak memory of the command, not of iris.
+
+A process spawned from iris starts out counted at iris's own peak RSS, and
+that survives exec. Each case runs one command with iris itself holding
+some ballast and checks the max_rss_kb recorded for it:
+
+  * a large iris running 'true' must not record iris's memory as the command's,
+  * a small iris running a command that allocates must record that allocation,
+  * a large iris running a larger command must record the command's peak.
+
+    python benchmarks/resources_check.py --ballast-mb 300
+"""
+import os
+import sys
+import glob
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Runs one command through runner.run_single_command with ballast_mb of
+# touched memory held by iris.
+RUN = """
+import sys
+sys.path.insert(0, {root!r})
+ballast = b"x" * ({ballast_mb} << 20)
+import runner
+runner.run_single_command({argv!r})
+"""
+
+
+def allocating(mb):
+    return [sys.executable, "-c", f"data = b'x' * ({mb} << 20)"]
+
+
+def recorded_rss(ballast_mb, argv):
+    """max_rss_kb of the one event recorded for argv (None if left out)."""
+    from storage import open_session
+    with tempfile.TemporaryDirectory() as home:
+        code = RUN.format(root=ROOT, ballast_mb=ballast_mb, argv=argv)
+        subprocess.run([sys.executable, "-c", code], cwd=home, stdout=subprocess.DEVNULL, check=True,
+                       env=dict(os.environ, HOME=home, IRIS_STORAGE="trace"))
+        trace, = glob.glob(os.path.join(home, "*.trace"))
+        event, = open_session(trace).events()
+        return event["resources"].get("max_rss_kb")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballast-mb", type=int, default=300, help="Memory iris holds in the large cases")
+    args = parser.parse_args()
+    big = args.ballast_mb
+
+    cases = [
+        (f"{big} MB iris runs true", big, ["true"], lambda kb: kb is None or kb < 32 * 1024),
+        ("small iris runs a 64 MB command", 0, allocating(64), lambda kb: kb is not None and kb >= 64 * 1024),
+        (f"{big} MB iris runs a {big + 100} MB command", big, allocating(big + 100),
+         lambda kb: kb is not None and kb >= (big + 100) * 1024),
+    ]
+    failed = 0
+    for name, ballast_mb, argv, ok in cases:
+        kb = recorded_rss(ballast_mb, argv)
+        passed = ok(kb)
+        failed += not passed
+        shown = "not recorded" if kb is None else f"{kb / 1024:.1f} MB"
+        print(f"{'ok  ' if passed else 'FAIL'} {name}: {shown}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
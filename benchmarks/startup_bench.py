@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Import-time budget check for the iris CLI.
+
+Runs each subcommand under `python -X importtime`, sums the import time of
+its top-level modules minus what a bare interpreter imports, and fails if
+the median over several runs exceeds the budget or if a subcommand imports
+a module it should never need (e.g. argparse or the daemon for `iris run`).
+
+    python benchmarks/startup_bench.py --runs 9
+    python benchmarks/startup_bench.py --budget-scale 1.5   # slower machines
+"""
+import os
+import sys
+import json
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IRIS = os.path.join(ROOT, "iris.py")
+
+# name -> (iris arguments, budget in ms of imports above a bare interpreter,
+# modules that must not be imported). "{trace}" is replaced with a small
+# generated trace.
+SCENARIOS = {
+    "run": (["run", sys.executable, "-c", "pass"], 25.0,
+            {"argparse", "subprocess", "threading", "daemon", "summary", "export",
+             "index", "search", "replay", "html", "tempfile", "hashlib"}),
+    "stop": (["stop"], 20.0, {"storage", "daemon", "runner", "threading"}),
+    "summary": (["summary", "{trace}"], 30.0, {"daemon", "runner", "export", "index", "socket", "threading"}),
+    "help": (["--help"], 20.0, {"storage", "daemon", "runner", "socket"}),
+}
+
+
+def import_times(args, env, cwd):
+    """Return {top-level module: cumulative us} for one run of the command."""
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args, env=env, cwd=cwd,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        # Nested imports are indented by two spaces per level.
+        if not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def all_modules(args, env, cwd):
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args, env=env, cwd=cwd,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return {line.split("|")[-1].strip() for line in proc.stderr.splitlines()
+            if line.startswith("import time:") and "imported package" not in line}
+
+
+def make_trace(workdir):
+    sys.path.insert(0, ROOT)
+    from storage import save_session
+    now = datetime.datetime(2026, 1, 1, 12, 0, 0)
+    events = [{"id": i, "type": "command", "timestamp": now.isoformat(), "command": f"echo {i}",
+               "output": str(i), "exit_code": 0, "duration_ms": i} for i in range(1, 51)]
+    path = os.path.join(workdir, "bench.trace")
+    save_session(path, "bench", now, now, events)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7, help="Runs per scenario (the median is checked)")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every budget by this factor")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="iris-startup-bench-")
+    env = dict(os.environ, HOME=workdir, USERPROFILE=workdir)
+    trace = make_trace(workdir)
+
+    baseline = statistics.median(
+        sum(import_times(["-c", "pass"], env, workdir).values()) for _ in range(args.runs))
+
+    failed = False
+    results = {}
+    print(f"{'scenario':<10}{'import ms':>11}{'budget ms':>11}  status")
+    for name, (iris_args, budget, forbidden) in SCENARIOS.items():
+        cmd = [IRIS] + [a.replace("{trace}", trace) for a in iris_args]
+        totals = [sum(import_times(cmd, env, workdir).values()) for _ in range(args.runs)]
+        ms = max(0.0, statistics.median(totals) - baseline) / 1000.0
+        budget *= args.budget_scale
+        leaked = sorted(forbidden & all_modules(cmd, env, workdir))
+        status = "ok"
+        if ms > budget:
+            status = "OVER BUDGET"
+        if leaked:
+            status = f"imports {', '.join(leaked)}"
+        failed = failed or status != "ok"
+        results[name] = {"import_ms": round(ms, 2), "budget_ms": budget, "unexpected_modules": leaked}
+        print(f"{name:<10}{ms:>11.1f}{budget:>11.1f}  {status}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"baseline_ms": round(baseline / 1000.0, 2), "scenarios": results}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Benchmark suite: micro benchmarks for event building and redaction, macro
+benchmarks for save/load/search/summary on synthetic traces, and daemon
+ingest with simulated terminals.
+
+Results are written as JSON (with the git commit they were measured at) so
+runs can be compared across commits:
+
+    python benchmarks/suite.py --sizes 10,100 --json results-new.json
+    python benchmarks/suite.py --sizes 10,100 --compare results-old.json
+    python benchmarks/suite.py --only micro
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from synth import SessionGenerator, write_trace  # noqa: E402
+
+
+def best_of(fn, repeat):
+    """Run fn repeat times; return (best seconds, last result)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def micro(args):
+    from redact import build_event, redact, strip_ansi
+
+    results = {}
+    for label, params in (("typical", {}),
+                          ("ansi-heavy", {"ansi_density": 0.8}),
+                          ("secret-heavy", {"secret_density": 0.2})):
+        raw = list(SessionGenerator(seed=args.seed, **params).raw_commands(args.micro_commands))
+        mb = sum(len(out) for _, out, _ in raw) / (1024 * 1024)
+
+        def build():
+            events = []
+            for typed, out, duration in raw:
+                events.append(build_event(events, typed, out, duration, "2026-01-01T00:00:00"))
+            return events
+
+        texts = [strip_ansi(out) for _, out, _ in raw]
+        t_build, _ = best_of(build, args.repeat)
+        t_redact, _ = best_of(lambda: [redact(t) for t in texts], args.repeat)
+        t_ansi, _ = best_of(lambda: [strip_ansi(out) for _, out, _ in raw], args.repeat)
+        results[label] = {
+            "commands": len(raw),
+            "mb": round(mb, 2),
+            "build_event_per_sec": round(len(raw) / t_build),
+            "build_event_mb_per_sec": round(mb / t_build, 1),
+            "redact_mb_per_sec": round(mb / t_redact, 1),
+            "strip_ansi_mb_per_sec": round(mb / t_ansi, 1),
+        }
+    return results
+
+
+def macro(args, workdir):
+    from storage import open_session, load_session, save_session
+    from search import search_session
+    from summary import summarize_session
+
+    results = {}
+    for size_mb in args.sizes:
+        path = os.path.join(workdir, f"synthetic-{size_mb}mb.trace")
+        start = time.perf_counter()
+        count = write_trace(path, int(size_mb * 1024 * 1024), args.seed)
+        generated = time.perf_counter() - start
+        mb = os.path.getsize(path) / (1024 * 1024)
+        quiet = contextlib.redirect_stdout(io.StringIO())
+        row = {"events": count, "mb": round(mb, 1), "generate_s": round(generated, 3)}
+
+        # Full materialization is only measured where it fits comfortably in memory.
+        if mb <= args.max_load_mb:
+            t, session = best_of(lambda: load_session(path), 1)
+            row["load_s"] = round(t, 3)
+            out = os.path.join(workdir, "resaved.trace")
+            t, _ = best_of(lambda: save_session(out, "s", *_bounds(session), session["events"]), 1)
+            row["save_s"] = round(t, 3)
+            del session
+            os.remove(out)
+
+        t, n = best_of(lambda: sum(1 for _ in open_session(path).events()), 1)
+        row["iterate_s"] = round(t, 3)
+        row["iterate_mb_per_sec"] = round(mb / t, 1)
+        with quiet:
+            t, _ = best_of(lambda: search_session(path, "Traceback"), 1)
+        row["search_s"] = round(t, 3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            t, _ = best_of(lambda: summarize_session(path), 1)
+        row["summary_s"] = round(t, 3)
+        results[f"{size_mb}mb"] = row
+        os.remove(path)
+    return results
+
+
+def _bounds(session):
+    import datetime
+    return (datetime.datetime.fromisoformat(session["start_time"]),
+            datetime.datetime.fromisoformat(session["end_time"]))
+
+
+def daemon(args):
+    results = {}
+    for clients in args.terminals:
+        out = tempfile.mktemp(suffix=".json")
+        subprocess.run([sys.executable, os.path.join(HERE, "daemon_load.py"), "--clients", str(clients),
+                        "--events", str(args.daemon_events), "--json", out],
+                       stdout=subprocess.DEVNULL, check=True)
+        with open(out) as f:
+            results[f"{clients}-terminals"] = json.load(f)
+        os.remove(out)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old, new, prefix=""):
+    """Print numeric results side by side with the change in percent."""
+    for key, value in new.items():
+        name = f"{prefix}{key}"
+        before = old.get(key) if isinstance(old, dict) else None
+        if isinstance(value, dict):
+            compare(before or {}, value, name + ".")
+        elif isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+            change = 100.0 * (value - before) / before
+            print(f"  {name:<56}{before:>12}{value:>12}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", choices=["micro", "macro", "daemon"], action="append",
+                        help="Run only these groups (repeatable)")
+    parser.add_argument("--sizes", default="10", help="Comma-separated trace sizes in MB for macro benchmarks")
+    parser.add_argument("--max-load-mb", type=float, default=512, help="Largest trace to fully load and re-save")
+    parser.add_argument("--micro-commands", type=int, default=2000, help="Commands per micro benchmark corpus")
+    parser.add_argument("--terminals", default="4,16", help="Comma-separated simulated terminal counts")
+    parser.add_argument("--daemon-events", type=int, default=2000, help="Events per simulated terminal")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per micro measurement (best is kept)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+    args.sizes = [float(s) if '.' in s else int(s) for s in args.sizes.split(",")]
+    args.terminals = [int(n) for n in args.terminals.split(",")]
+    groups = args.only or ["micro", "macro", "daemon"]
+
+    workdir = tempfile.mkdtemp(prefix="iris-suite-")
+    results = {}
+    try:
+        if "micro" in groups:
+            results["micro"] = micro(args)
+        if "macro" in groups:
+            results["macro"] = macro(args, workdir)
+        if "daemon" in groups:
+            results["daemon"] = daemon(args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {old.get('commit')}):")
+        compare(old.get("results", {}), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Deterministic synthetic sessions for benchmarks.
+
+The same seed and parameters always give the same commands, outputs and
+timings. Raw outputs (with ANSI codes, CRLFs and secrets, as a recorder
+sees them) feed the event-builder and redaction benchmarks; clean event
+dicts can be written straight to traces of a target size.
+
+    python benchmarks/synth.py /tmp/big.trace --size-mb 500 --seed 7
+"""
+import os
+import sys
+import math
+import random
+import argparse
+import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COMMANDS = [
+    "ls -la", "git status", "git diff --stat", "make -j8", "pytest -x tests/", "npm run build",
+    "cargo build --release", "docker ps", "kubectl get pods -n prod", "tail -n 200 app.log",
+    "grep -rn TODO src/", "python manage.py migrate", "curl -s https://api.example.com/health",
+]
+LINES = [
+    "2026-02-24 14:30:{s:02d} INFO  request handled path=/api/v1/items status=200 in {n}ms",
+    "2026-02-24 14:30:{s:02d} DEBUG cache miss for key item:{n} falling back to database",
+    "[{n}/5000] Compiling src/module_{n}.c",
+    "  File \"/srv/app/worker.py\", line {n}, in handle",
+    "test_module_{n}.py::test_case PASSED",
+    "drwxr-xr-x  2 dev dev 4096 Feb 24 14:30 build_{n}",
+]
+ERROR_LINES = [
+    "Traceback (most recent call last):",
+    "error: could not compile `iris` due to {n} previous errors",
+    "FAILED tests/test_api.py::test_status - AssertionError",
+]
+SECRET_LINES = [
+    "export API_KEY={hex}",
+    "Authorization: Bearer {hex}",
+    "db password={word}{n}",
+    "token: {hex}",
+]
+ANSI_CODES = ["\x1b[32m", "\x1b[1;31m", "\x1b[0m", "\x1b[2K", "\x1b[33m"]
+
+
+class SessionGenerator:
+    """Generates commands with outputs whose size follows a log-normal distribution.
+
+    output_kb is the median output size; spread is the log-normal sigma
+    (0 makes every output the same size). ansi_density is the chance that a
+    line carries colour codes, secret_density the chance it holds a secret,
+    and error_rate the chance a command fails.
+    """
+
+    def __init__(self, seed=1, output_kb=2.0, spread=1.5, ansi_density=0.1,
+                 secret_density=0.001, error_rate=0.05):
+        self.rng = random.Random(seed)
+        self.output_chars = output_kb * 1024
+        self.spread = spread
+        self.ansi_density = ansi_density
+        self.secret_density = secret_density
+        self.error_rate = error_rate
+
+    def _line(self):
+        rng = self.rng
+        n = rng.randint(1, 99999)
+        if rng.random() < self.secret_density:
+            line = rng.choice(SECRET_LINES).format(hex="%040x" % rng.getrandbits(160), word="hunter", n=n)
+        else:
+            line = rng.choice(LINES).format(s=n % 60, n=n)
+        if rng.random() < self.ansi_density:
+            line = rng.choice(ANSI_CODES) + line + "\x1b[0m"
+        return line
+
+    def output(self, failed=False):
+        """One raw output (CRLF line endings, ANSI codes), ending with the next prompt."""
+        target = self.output_chars * math.exp(self.rng.gauss(0, self.spread)) if self.spread else self.output_chars
+        lines = []
+        size = 0
+        while size < target:
+            line = self._line()
+            lines.append(line)
+            size += len(line) + 2
+        if failed:
+            lines.append(self.rng.choice(ERROR_LINES).format(n=self.rng.randint(1, 9)))
+        return "\r\n" + "\r\n".join(lines) + "\r\n$ "
+
+    def raw_commands(self, count):
+        """Yield (typed input, raw output, duration_ms) like a recorder captures them."""
+        for _ in range(count):
+            failed = self.rng.random() < self.error_rate
+            yield (self.rng.choice(COMMANDS) + "\r", self.output(failed),
+                   int(self.rng.lognormvariate(5, 2)))
+
+    def events(self, count=None, start=None):
+        """Yield clean event dicts (what build_event would produce, minus the redaction pass)."""
+        from redact import strip_ansi
+
+        now = start or datetime.datetime(2026, 1, 1, 9, 0, 0)
+        i = 0
+        while count is None or i < count:
+            i += 1
+            failed = self.rng.random() < self.error_rate
+            raw = self.output(failed)
+            output = strip_ansi(raw).replace('\r\n', '\n').strip().rsplit('\n', 1)[0]
+            duration = int(self.rng.lognormvariate(5, 2))
+            now += datetime.timedelta(milliseconds=duration + self.rng.randint(200, 5000))
+            yield {
+                "id": i,
+                "type": "command",
+                "timestamp": now.isoformat(),
+                "command": self.rng.choice(COMMANDS),
+                "output": output,
+                "exit_code": 1 if failed else 0,
+                "duration_ms": duration,
+            }
+
+
+def write_trace(path, size_bytes, seed=1, **params):
+    """Write a streamed trace of about size_bytes; returns the number of events."""
+    from storage import TraceWriter
+
+    start = datetime.datetime(2026, 1, 1, 9, 0, 0)
+    writer = TraceWriter(path, f"synthetic-{seed}", start, hostname="bench-host", buffered=True)
+    count = 0
+    last = start
+    try:
+        for event in SessionGenerator(seed, **params).events(start=start):
+            writer.append(event)
+            count += 1
+            last = datetime.datetime.fromisoformat(event["timestamp"])
+            if count % 32 == 0 and os.path.getsize(path) >= size_bytes:
+                break
+    finally:
+        writer.close(last)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="Trace file to write")
+    parser.add_argument("--size-mb", type=float, default=10.0, help="Approximate trace size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output-kb", type=float, default=2.0, help="Median output size per command")
+    parser.add_argument("--spread", type=float, default=1.5, help="Log-normal sigma of output sizes")
+    parser.add_argument("--ansi-density", type=float, default=0.1, help="Fraction of lines with ANSI codes")
+    parser.add_argument("--secret-density", type=float, default=0.001, help="Fraction of lines with secrets")
+    args = parser.parse_args()
+
+    count = write_trace(args.output, int(args.size_mb * 1024 * 1024), args.seed, output_kb=args.output_kb,
+                        spread=args.spread, ansi_density=args.ansi_density, secret_density=args.secret_density)
+    print(f"Wrote {count} events ({os.path.getsize(args.output) / (1024 * 1024):.1f} MB) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
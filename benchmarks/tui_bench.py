@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Capture throughput and trace size for full-screen (TUI) sessions.
+
+Feeds seeded synthetic terminal streams that mimic vim, less and htop, plus
+plain command output as a control, through capture.OutputCapture in
+PTY-sized reads and builds the event a recorder would store. Each stream
+is measured three ways:
+
+  * raw:      screen model off (IRIS_SCREEN_MODEL=0), the redraw stream is
+              stripped of escape codes and kept as output
+  * model:    screen model on, snapshots every IRIS_SCREEN_INTERVAL seconds
+              (at full speed that is just the final screen)
+  * each-read: screen model on, a snapshot attempted after every read, the
+              most snapshot work a session can cause
+
+    python benchmarks/tui_bench.py --mb 8
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import capture  # noqa: E402
+from capture import OutputCapture, attach_timing  # noqa: E402
+from redact import build_event  # noqa: E402
+
+ROWS, COLS = 24, 80
+READ_SIZE = 4096
+WORDS = ["def", "return", "self", "value", "import", "config", "for", "in", "if", "None",
+         "request", "index", "buffer", "write", "error", "count", "items", "print"]
+ENTER, EXIT = "\x1b[?1049h\x1b[22;0;0t\x1b[?1h\x1b=", "\x1b[?1l\x1b>\x1b[?1049l\x1b[23;0;0t"
+
+
+def _line(rng, width):
+    words = []
+    while sum(len(w) + 1 for w in words) < width:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:width]
+
+
+def vim_stream(rng, size):
+    """Opening a file, moving around, typing and scrolling, with status line updates."""
+    lines = [_line(rng, rng.randint(0, 70)) for _ in range(2000)]
+    top = 0
+    parts = [ENTER, "\x1b[H\x1b[2J"]
+    parts += [f"\x1b[{i + 1};1H\x1b[38;5;130m{i + 1:>4} \x1b[m{lines[i]}" for i in range(ROWS - 1)]
+    total = 0
+    while total < size:
+        action = rng.random()
+        if action < 0.5:
+            # Typing: insert a character and redraw the rest of the line.
+            row = rng.randint(1, ROWS - 1)
+            col = rng.randint(6, 60)
+            chunk = f"\x1b[{row};{col}H\x1b[1@{rng.choice('abcdefghij ')}"
+        elif action < 0.8:
+            # Scrolling one line inside the scroll region.
+            top += 1
+            line = lines[(top + ROWS) % len(lines)]
+            chunk = (f"\x1b[1;{ROWS - 1}r\x1b[{ROWS - 1};1H\n\x1b[r\x1b[{ROWS - 1};1H"
+                     f"\x1b[38;5;130m{top + ROWS - 1:>4} \x1b[m\x1b[K{line}")
+        else:
+            chunk = ""
+        chunk += (f"\x1b[{ROWS};1H\x1b[K-- INSERT --\x1b[{ROWS};{COLS - 18}H"
+                  f"{rng.randint(1, 2000)},{rng.randint(1, 80)}\x1b[{ROWS};{COLS - 4}HTop"
+                  f"\x1b[{rng.randint(1, ROWS - 1)};{rng.randint(6, 70)}H")
+        parts.append(chunk)
+        total += len(chunk)
+    parts.append(f"\x1b[{ROWS};1H\x1b[K:wq\r" + EXIT)
+    return "".join(parts)
+
+
+def less_stream(rng, size):
+    """Paging through a log a screen at a time, then line by line with reverse scrolls."""
+    parts = [ENTER]
+    n = 0
+    total = 0
+    while total < size:
+        if rng.random() < 0.5:
+            body = "".join(f"2024-05-01 12:{n % 60:02d}:{i % 60:02d} INFO {_line(rng, 50)}\r\n"
+                           for i in range(ROWS - 1))
+            chunk = f"\x1b[H\x1b[2J{body}\x1b[7m:\x1b[27m\x1b[K"
+            n += ROWS - 1
+        else:
+            chunk = f"\r\x1b[K2024-05-01 12:{n % 60:02d}:00 WARN {_line(rng, 50)}\r\n:\x1b[K"
+            if rng.random() < 0.3:
+                chunk += f"\x1b[H\x1bM2024-05-01 11:59:59 INFO {_line(rng, 50)}\x1b[{ROWS};1H\r\x1b[K:"
+            n += 1
+        parts.append(chunk)
+        total += len(chunk)
+    parts.append("\r\x1b[K" + EXIT)
+    return "".join(parts)
+
+
+def htop_stream(rng, size):
+    """Dashboard frames: meters and a process table redrawn cell by cell in colour."""
+    parts = [ENTER, "\x1b[H\x1b[2J"]
+    total = 0
+    while total < size:
+        frame = ["\x1b[H"]
+        for cpu in range(4):
+            bar = "|" * rng.randint(0, 30)
+            frame.append(f"\x1b[{cpu + 1};3H\x1b[1m{cpu}\x1b[m[\x1b[32m{bar:<30}\x1b[m{rng.random() * 100:5.1f}%]")
+        frame.append(f"\x1b[6;3HTasks: \x1b[1m{rng.randint(80, 120)}\x1b[m, load average: "
+                     f"{rng.random() * 4:.2f} {rng.random() * 4:.2f}\x1b[K")
+        for row in range(8, ROWS):
+            frame.append(f"\x1b[{row};1H\x1b[{'30;46' if row == 8 else '37'}m{rng.randint(1, 99999):>6} user "
+                         f"{rng.randint(0, 39):>3} {rng.random() * 100:5.1f} {rng.random() * 10:4.1f} "
+                         f"{rng.choice(WORDS)}/{rng.choice(WORDS)}\x1b[K\x1b[m")
+        frame.append(f"\x1b[{ROWS};1H\x1b[30;46mF1\x1b[mHelp \x1b[30;46mF10\x1b[mQuit\x1b[K")
+        chunk = "".join(frame)
+        parts.append(chunk)
+        total += len(chunk)
+    parts.append(EXIT)
+    return "".join(parts)
+
+
+def plain_stream(rng, size):
+    """Ordinary coloured command output (a build log); no full-screen program."""
+    parts = []
+    total = 0
+    while total < size:
+        chunk = f"\x1b[32m[ok]\x1b[0m compiling {rng.choice(WORDS)}/{_line(rng, 60)}.py\r\n"
+        parts.append(chunk)
+        total += len(chunk)
+    return "".join(parts)
+
+
+STREAMS = {"vim": vim_stream, "less": less_stream, "htop": htop_stream, "plain": plain_stream}
+
+
+def capture_session(data, mode, blobs):
+    capture.SCREEN_MODEL = mode != "raw"
+    capture.SCREEN_SNAPSHOT_INTERVAL = 0.0 if mode == "each-read" else float(os.environ.get("IRIS_SCREEN_INTERVAL", 5.0))
+    started = time.perf_counter()
+    start_time = time.time()
+    output = OutputCapture(blobs, screen_size=(ROWS, COLS))
+    for i in range(0, len(data), READ_SIZE):
+        output.feed(data[i:i + READ_SIZE])
+    event = build_event([], "tui-program\r", output.result(), 1000, "2024-05-01T12:00:00")
+    attach_timing(event, output, start_time)
+    seconds = time.perf_counter() - started
+    return seconds, event
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=8.0, help="Size of each synthetic stream in MB")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the streams")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    size = int(args.mb * 1024 * 1024)
+    results = {}
+    with tempfile.TemporaryDirectory() as blobs:
+        print(f"{'stream':<8}{'mode':<11}{'MB/s':>8}{'stored KB':>12}{'screens':>9}{'output chars':>14}")
+        for name, make in STREAMS.items():
+            data = make(random.Random(args.seed), size).encode()
+            mb = len(data) / (1024 * 1024)
+            for mode in ("raw", "model", "each-read"):
+                seconds, event = capture_session(data, mode, blobs)
+                # A large output spills to a blob next to the trace; count it too.
+                blob = event.get("output_blob")
+                stored = len(json.dumps(event, ensure_ascii=False).encode()) + (blob["chars"] if blob else 0)
+                chars = blob["chars"] if blob else len(event["output"])
+                screens = len(event.get("screens", []))
+                results[f"{name}/{mode}"] = {"mb_per_sec": round(mb / seconds, 2), "stored_bytes": stored,
+                                             "screens": screens, "output_chars": chars, "stream_mb": round(mb, 2)}
+                print(f"{name:<8}{mode:<11}{mb / seconds:>8.1f}{stored / 1024:>12.1f}{screens:>9}{chars:>14,}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
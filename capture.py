@@ -0,0 +1,325 @@
+import os
+import time
+import codecs
+import metrics
+from redact import strip_ansi, redact, guess_exit_code
+from screen import DEFAULT_SIZE, Screen, find_alt_enter, alt_prefix_at_end
+
+# Characters of output kept in memory per command. Past this, the output is
+# cleaned and streamed to a content-addressed blob next to the trace, and
+# the event only keeps head/tail excerpts.
+MAX_EVENT_OUTPUT = int(os.environ.get("IRIS_MAX_EVENT_OUTPUT", 1024 * 1024))
+EXCERPT_CHARS = 4096
+# Spilled output is cleaned in blocks of at least this many characters,
+# cut at line breaks.
+BLOCK_CHARS = 256 * 1024
+
+# Output arrival times are kept as at most MAX_TIMING_POINTS points per
+# command. Chunks arriving within TIMING_COALESCE_MS of the last point
+# extend it; when the points run out, neighbours are merged and the window
+# doubles, so long-running commands degrade to coarser timing.
+MAX_TIMING_POINTS = 256
+TIMING_COALESCE_MS = 40
+
+# Output sent while a full-screen program (vim, less, top) has the alternate
+# screen is played into a screen model instead of being kept (screen.py).
+# The screen is snapshotted every SCREEN_SNAPSHOT_INTERVAL seconds while it
+# changes and when the program leaves it; past MAX_SCREEN_SNAPSHOTS every
+# other snapshot is dropped and the interval doubles.
+SCREEN_MODEL = os.environ.get("IRIS_SCREEN_MODEL", "1") != "0"
+SCREEN_SNAPSHOT_INTERVAL = float(os.environ.get("IRIS_SCREEN_INTERVAL", 5.0))
+MAX_SCREEN_SNAPSHOTS = 32
+
+
+class SpilledOutput:
+    """A finished command output that lives in a blob file."""
+
+    def __init__(self, head, tail, sha256, chars, has_error):
+        self.head = head
+        self.tail = tail
+        self.sha256 = sha256
+        self.chars = chars
+        self.has_error = has_error
+
+    def excerpt(self):
+        if self.chars <= len(self.head):
+            return self.head
+        omitted = self.chars - len(self.head) - len(self.tail)
+        return f"{self.head}\n[... {omitted} characters omitted, full output in blob {self.sha256[:12]} ...]\n{self.tail}"
+
+    def blob_ref(self):
+        return {"sha256": self.sha256, "chars": self.chars}
+
+
+class _BlobWriter:
+    """Cleans output the way build_event does and streams it to a blob file.
+
+    build_event strips ANSI codes, normalizes line endings, drops the final
+    line (the next prompt), strips surrounding whitespace and redacts. Here
+    the same is done block by block: the last line break and any trailing
+    whitespace are held back until more output shows they are not the end.
+    """
+
+    def __init__(self, blob_dir):
+        # Only needed once an output spills, so not imported up front.
+        import hashlib
+        import tempfile
+        os.makedirs(blob_dir, exist_ok=True)
+        self.blob_dir = blob_dir
+        fd, self.tmp_path = tempfile.mkstemp(dir=blob_dir, prefix=".partial-")
+        self.f = os.fdopen(fd, 'w', encoding='utf-8', newline='')
+        self.hash = hashlib.sha256()
+        self.pending = []
+        self.pending_len = 0
+        self.carry = ""
+        self.held = ""
+        self.started = False
+        self.head = ""
+        self.tail = ""
+        self.chars = 0
+        self.has_error = False
+
+    def feed(self, text):
+        self.pending.append(text)
+        self.pending_len += len(text)
+        if self.pending_len < BLOCK_CHARS:
+            return
+        data = "".join(self.pending)
+        # Cut after the last line break that cannot be the first half of \r\n.
+        cut = max(data.rfind('\n'), data.rfind('\r', 0, len(data) - 1))
+        if cut == -1:
+            cut = len(data) - 1
+        self.pending = [data[cut + 1:]]
+        self.pending_len = len(self.pending[0])
+        self._process(data[:cut + 1], final=False)
+
+    def _process(self, block, final):
+        started = metrics.clock()
+        text = self.carry + strip_ansi(block)
+        metrics.elapsed("strip_ansi", started)
+        self.carry = ""
+        if not final and text.endswith('\r'):
+            # Could pair with a \n at the start of the next block.
+            self.carry = '\r'
+            text = text[:-1]
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if final:
+            # Everything after the last line break is the prompt line.
+            text = text[:text.rfind('\n') + 1] if '\n' in text else ""
+        started = metrics.clock()
+        text = redact(text)
+        metrics.elapsed("redact", started)
+        if not self.has_error and guess_exit_code(text):
+            self.has_error = True
+
+        text = self.held + text
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        body = text.rstrip()
+        self.held = text[len(body):]
+        if body:
+            self._write(body)
+
+    def _write(self, text):
+        if len(self.head) < EXCERPT_CHARS:
+            self.head += text[:EXCERPT_CHARS - len(self.head)]
+        self.tail = (self.tail + text)[-EXCERPT_CHARS:]
+        self.chars += len(text)
+        self.f.write(text)
+        self.hash.update(text.encode('utf-8'))
+
+    def finish(self):
+        self._process("".join(self.pending), final=True)
+        self.f.close()
+        digest = self.hash.hexdigest()
+        path = os.path.join(self.blob_dir, digest)
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, path)
+        return SpilledOutput(self.head, self.tail, digest, self.chars, self.has_error)
+
+    def discard(self):
+        try:
+            self.f.close()
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class OutputCapture:
+    """Collects one command's output with bounded memory.
+
+    Output stays in memory until it passes the per-event cap, then it is
+    streamed to a blob in blob_dir. result() returns either the raw text or
+    a SpilledOutput, both of which build_event accepts. Full-screen output
+    is left out of both and kept as screen snapshots of screen_size
+    (rows, columns) instead. Output timing and snapshots are stamped with
+    clock(), which a recorder processing output after it arrived sets to
+    report the arrival time.
+    """
+
+    def __init__(self, blob_dir, limit=None, screen_size=None, clock=time.time):
+        self.blob_dir = blob_dir
+        self.clock = clock
+        self.limit = MAX_EVENT_OUTPUT if limit is None else limit
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.parts = []
+        self.size = 0
+        self.blob = None
+        self.raw_chars = 0
+        self.points = []
+        self.coalesce = TIMING_COALESCE_MS / 1000.0
+        self.screen_size = (screen_size or DEFAULT_SIZE) if SCREEN_MODEL else None
+        self.screen = None
+        self.held = ""
+        self.snapshots = []
+        self.snapshot_interval = SCREEN_SNAPSHOT_INTERVAL
+        self.snapshot_time = 0.0
+
+    def feed(self, data):
+        """Add raw bytes; multi-byte characters split across calls are kept intact."""
+        self.feed_text(self.decoder.decode(data))
+
+    def feed_text(self, text):
+        if self.held:
+            text = self.held + text
+            self.held = ""
+        if self.screen is not None:
+            text = self._feed_screen(text)
+        if not text:
+            return
+        if self.screen_size is not None:
+            match = find_alt_enter(text)
+            if match:
+                self._append(text[:match.start()])
+                self.screen = Screen(*self.screen_size)
+                self.snapshot_time = self.clock()
+                self.feed_text(text[match.end():])
+                return
+            # Hold back what may be the start of a switch cut off by this read.
+            held = alt_prefix_at_end(text)
+            if held:
+                self.held = text[-held:]
+                text = text[:-held]
+        self._append(text)
+
+    def _append(self, text):
+        if not text:
+            return
+        self._mark(len(text))
+        if self.blob is not None:
+            self.blob.feed(text)
+            return
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size > self.limit:
+            self.blob = _BlobWriter(self.blob_dir)
+            self.blob.feed("".join(self.parts))
+            self.parts = []
+
+    def _feed_screen(self, text):
+        """Play text into the screen; returns what follows its end, if it ended."""
+        started = metrics.clock()
+        rest = self.screen.feed(text)
+        now = self.clock()
+        if rest is not None:
+            self._snapshot(now)
+            self.screen = None
+        elif now - self.snapshot_time >= self.snapshot_interval:
+            self._snapshot(now)
+        metrics.elapsed("screen_model", started)
+        return rest
+
+    def _snapshot(self, now):
+        self.snapshot_time = now
+        if not self.screen.changed:
+            return
+        text = self.screen.snapshot()
+        snapshots = self.snapshots
+        if not text or (snapshots and snapshots[-1][1] == text):
+            return
+        snapshots.append([now, text])
+        metrics.count("screen_snapshots")
+        if len(snapshots) > MAX_SCREEN_SNAPSHOTS:
+            self.snapshots = snapshots[::2]
+            self.snapshot_interval *= 2
+
+    def _mark(self, chars):
+        now = self.clock()
+        self.raw_chars += chars
+        points = self.points
+        if points and now - points[-1][0] < self.coalesce:
+            points[-1][1] = self.raw_chars
+            return
+        points.append([now, self.raw_chars])
+        if len(points) >= MAX_TIMING_POINTS:
+            self.points = [[a[0], b[1]] for a, b in zip(points[::2], points[1::2])]
+            if len(points) % 2:
+                self.points.append(points[-1])
+            self.coalesce *= 2
+
+    def timing(self, start_time, clean_chars):
+        """Output arrival points as [ms since start_time, offset into the recorded output].
+
+        The recorded output is cleaned (ANSI codes stripped, prompt dropped,
+        secrets redacted), so raw offsets are scaled onto its length; the
+        result places each chunk approximately, which is all replay needs.
+        """
+        if not self.raw_chars or not clean_chars:
+            return []
+        scale = clean_chars / self.raw_chars
+        timing = []
+        for t, offset in self.points:
+            point = [max(0, int((t - start_time) * 1000)), min(clean_chars, int(offset * scale))]
+            if timing and point[1] <= timing[-1][1]:
+                continue
+            timing.append(point)
+        if timing:
+            timing[-1][1] = clean_chars
+        return timing
+
+    def result(self):
+        self.feed_text(self.decoder.decode(b"", final=True))
+        if self.held:
+            self._append(self.held)
+            self.held = ""
+        if self.screen is not None:
+            # The program is still running (or never switched back).
+            self._snapshot(self.clock())
+        if self.blob is not None:
+            spilled = self.blob.finish()
+            self.blob = None
+            return spilled
+        return "".join(self.parts)
+
+    def reset(self):
+        if self.blob is not None:
+            self.blob.discard()
+            self.blob = None
+        self.decoder.reset()
+        self.parts = []
+        self.size = 0
+        self.raw_chars = 0
+        self.points = []
+        self.coalesce = TIMING_COALESCE_MS / 1000.0
+        self.screen = None
+        self.held = ""
+        self.snapshots = []
+        self.snapshot_interval = SCREEN_SNAPSHOT_INTERVAL
+
+    def screens(self, start_time):
+        """Screen snapshots as [ms since start_time, redacted screen text]."""
+        return [[max(0, int((t - start_time) * 1000)), redact(text)] for t, text in self.snapshots]
+
+
+def attach_timing(event, capture, start_time):
+    """Store capture's output timing and full-screen snapshots on a built event for replay."""
+    blob = event.get("output_blob")
+    timing = capture.timing(start_time, blob["chars"] if blob else len(event.get("output", "")))
+    if timing:
+        event["timing"] = timing
+    if capture.snapshots:
+        event["screens"] = capture.screens(start_time)
+    return event
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+
+# Client side of the daemon protocol. It lives apart from daemon.py so that
+# 'iris run' and the recorders never import the server's machinery.
+SIGNAL_DIR = os.path.join(os.path.expanduser("~"), ".iris")
+DAEMON_PORT_FILE = os.path.join(SIGNAL_DIR, "daemon.port")
+
+
+def parse_address(address, default_host='127.0.0.1'):
+    """(host, port) for "HOST:PORT" or a bare "PORT"; raises ValueError if it is neither."""
+    host, _, port = str(address).rpartition(":")
+    return host or default_host, int(port)
+
+
+def connect_daemon(timeout, address=None):
+    """Open a socket to a daemon: address ("unix:PATH", "HOST:PORT" or "PORT"), else the one in the port file."""
+    import socket
+    if address is None:
+        with open(DAEMON_PORT_FILE, 'r') as f:
+            address = f.readline().strip()
+    if address.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        target = address[len("unix:"):]
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        target = parse_address(address)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(target)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def daemon_request(command, timeout=5.0, **params):
+    """Send a control request to the daemon and yield its reply objects.
+
+    timeout=None waits indefinitely between replies (for 'tail' with
+    follow). Raises OSError if no daemon is reachable.
+    """
+    request = dict(params, type="control", command=command)
+    sock = connect_daemon(timeout)
+    try:
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with sock.makefile('rb') as f:
+            for line in f:
+                yield json.loads(line)
+    finally:
+        sock.close()
+
+
+class DaemonClient:
+    """Long-lived connection to the daemon for sending newline-framed events.
+
+    The daemon address is read once and the socket is reused for every
+    event. Events are batched until batch_size events are pending, and at
+    most max_pending_bytes are held before a flush is forced, so a slow
+    daemon pushes back on the sender instead of growing its memory.
+    """
+
+    def __init__(self, batch_size=1, max_pending_bytes=1024 * 1024, timeout=2.0):
+        self.batch_size = max(1, batch_size)
+        self.max_pending_bytes = max_pending_bytes
+        self.timeout = timeout
+        self.sock = None
+        self.pending = []
+        self.pending_bytes = 0
+
+    def _connect(self):
+        self.sock = connect_daemon(self.timeout)
+
+    def send(self, event):
+        line = (json.dumps(event) + '\n').encode('utf-8')
+        self.pending.append(line)
+        self.pending_bytes += len(line)
+        if len(self.pending) >= self.batch_size or self.pending_bytes >= self.max_pending_bytes:
+            return self.flush()
+        return True
+
+    def flush(self):
+        if not self.pending:
+            return True
+        payload = b"".join(self.pending)
+        # One reconnect covers a daemon that was restarted since the last send.
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self._connect()
+                self.sock.sendall(payload)
+                self.pending = []
+                self.pending_bytes = 0
+                return True
+            except Exception:
+                self.close()
+        self.pending = []
+        self.pending_bytes = 0
+        return False
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+            self.sock = None
+
+
+def daemon_trace_file():
+    """Trace file the running daemon will save to, or None if unknown."""
+    try:
+        with open(DAEMON_PORT_FILE, 'r') as f:
+            f.readline()
+            return f.readline().strip() or None
+    except OSError:
+        return None
+
+
+def terminal_name():
+    """Short name for the terminal this process runs in, e.g. 'pts/3'."""
+    for stream in (sys.stdin, sys.stdout):
+        try:
+            name = os.ttyname(stream.fileno())
+        except (OSError, AttributeError, ValueError):
+            continue
+        return name[len("/dev/"):] if name.startswith("/dev/") else name
+    if os.environ.get("WT_SESSION"):
+        return f"wt-{os.environ['WT_SESSION'][:8]}"
+    return f"ppid-{os.getppid()}"
+
+
+_client = None
+_origin = None
+
+def send_event_to_daemon(event):
+    global _client, _origin
+    if not os.path.exists(DAEMON_PORT_FILE):
+        return False
+
+    # Daemon traces mix terminals (and possibly hosts); tag where each
+    # event came from so summaries can split time by them.
+    if _origin is None:
+        import socket
+        _origin = {"host": socket.gethostname(), "terminal": terminal_name()}
+    for key, value in _origin.items():
+        event.setdefault(key, value)
+
+    if _client is None:
+        _client = DaemonClient()
+    return _client.send(event)
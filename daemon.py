@@ -3,27 +3,354 @@ import sys
 import time
 import json
 import socket
+import selectors
 import threading
 import datetime
-from storage import save_session
+import metrics
+from eventstore import EventStore
+from storage import save_session, session_path, is_database, TraceWriter, open_session, convert_session
+from client import SIGNAL_DIR, DAEMON_PORT_FILE, connect_daemon, parse_address
+# Re-exported for callers that still import the client side from here.
+from client import DaemonClient, daemon_trace_file, send_event_to_daemon, terminal_name  # noqa: F401
 
-SIGNAL_DIR = os.path.join(os.path.expanduser("~"), ".iris")
 STOP_SIGNAL = os.path.join(SIGNAL_DIR, "stop.signal")
 RECORDING_LOCK = os.path.join(SIGNAL_DIR, "recording.lock")
-DAEMON_PORT_FILE = os.path.join(SIGNAL_DIR, "daemon.port")
+DAEMON_SOCKET = os.path.join(SIGNAL_DIR, "daemon.sock")
+
+# "tcp" listens on 127.0.0.1; "unix" uses a socket file in ~/.iris where supported.
+DAEMON_TRANSPORT = os.environ.get("IRIS_DAEMON_TRANSPORT", "tcp")
+
+READ_CHUNK = 65536
+# A client that sends more than this without a newline is dropped instead of
+# letting its buffer grow without bound.
+MAX_LINE_BYTES = 64 * 1024 * 1024
+STOP_POLL_INTERVAL = 0.5
+# Replies to control requests are written with a timeout; a 'tail -f'
+# subscriber that falls this far behind is disconnected rather than
+# buffered without bound.
+CONTROL_TIMEOUT = 5.0
+MAX_TAIL_BACKLOG = 16 * 1024 * 1024
+# Malformed lines are always counted; only the first few are reported.
+MALFORMED_WARNINGS = 5
+
+# Ingested events are checkpointed to a journal in the streaming trace format
+# every CHECKPOINT_INTERVAL seconds, or sooner once CHECKPOINT_EVENTS are
+# pending. The journal is removed after a clean shutdown; if the daemon dies,
+# the next 'iris start' recovers it into a .trace file.
+DAEMON_JOURNAL = os.path.join(SIGNAL_DIR, "daemon.journal")
+CHECKPOINT_INTERVAL = float(os.environ.get("IRIS_CHECKPOINT_INTERVAL", 5))
+CHECKPOINT_EVENTS = int(os.environ.get("IRIS_CHECKPOINT_EVENTS", 100))
+
+# A daemon started with an upstream also forwards every ingested event to
+# that daemon, RELAY_BATCH events per write. While the upstream cannot be
+# reached, forwarding is retried every RELAY_RETRY seconds.
+RELAY_BATCH = 256
+RELAY_RETRY = float(os.environ.get("IRIS_RELAY_RETRY", 2))
+# Control requests (status, search, stop...) are only taken from these peers
+# when the daemon listens beyond localhost; other hosts may only send events.
+LOCAL_PEERS = ("127.0.0.1", "::1")
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    if os.name == 'nt':
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Checkpointer(threading.Thread):
+    """Background thread appending newly ingested events to the journal.
+
+    The ingest path only appends to the daemon's event list and, past the
+    event threshold, sets a flag; serializing and fsyncing happen here.
+    """
+
+    def __init__(self, iris_daemon, path, interval=None, max_events=None):
+        super().__init__(name="iris-checkpoint", daemon=True)
+        self.source = iris_daemon
+        self.interval = CHECKPOINT_INTERVAL if interval is None else interval
+        self.max_events = CHECKPOINT_EVENTS if max_events is None else max_events
+        self.written = 0
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = False
+        # 'iris flush' requests: (control socket, events to journal) queued by
+        # the selector loop, then (control socket, events, error or None) once
+        # written, for the selector loop to answer after notify() wakes it.
+        self.flush_waiters = []
+        self.flushed = []
+        self.waiters_lock = threading.Lock()
+        self.notify = None
+        self.writer = TraceWriter(path, iris_daemon.session_id, iris_daemon.start_time, buffered=True,
+                                  extra={"journal": True, "pid": os.getpid(),
+                                         "trace_file": iris_daemon.trace_file})
+        self.writer.sync()
+
+    def pending(self, count):
+        """Called on ingest with the total event count."""
+        if count - self.written >= self.max_events and not self.wake.is_set():
+            self.wake.set()
+
+    def request_flush(self, client_sock, count):
+        """Checkpoint now; client_sock lands in flushed once count events are journaled."""
+        with self.waiters_lock:
+            self.flush_waiters.append((client_sock, count))
+        self.wake.set()
+
+    def run(self):
+        while not self.stopping:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            error = None
+            try:
+                self.checkpoint()
+            except OSError as e:
+                error = e
+                print(f"[iris] Checkpoint failed: {e}")
+            self._release(error)
+
+    def _release(self, error):
+        """Move the flush waiters this checkpoint covered (all of them on error) to flushed."""
+        with self.waiters_lock:
+            done = [(sock, count, error) for sock, count in self.flush_waiters
+                    if error is not None or count <= self.written]
+            if not done:
+                return
+            self.flush_waiters = [(sock, count) for sock, count in self.flush_waiters
+                                  if error is None and count > self.written]
+            self.flushed.extend(done)
+        if self.notify is not None:
+            self.notify()
+
+    def checkpoint(self):
+        """Write and fsync every event not yet in the journal; safe to call from any thread."""
+        with self.write_lock:
+            with self.source.lock:
+                end = len(self.source.events)
+            # Rebuilding events from the store happens outside the ingest lock.
+            batch = self.source.events[self.written:end]
+            if not batch:
+                return
+            for event in batch:
+                self.writer.append(event)
+            self.writer.sync()
+            self.written += len(batch)
+        # Journaled events are compressed here, off the ingest path.
+        self.source.events.compact()
+
+    def stop(self):
+        self.stopping = True
+        self.wake.set()
+        self.join()
+        self.writer.close(datetime.datetime.now())
+        self._release(OSError("the daemon stopped before journaling"))
+
+
+class Relay(threading.Thread):
+    """Background thread forwarding ingested events to an upstream daemon.
+
+    Like the Checkpointer it only keeps its position in the daemon's event
+    list, so an unreachable upstream costs no extra memory and forwarding
+    resumes where it stopped once the upstream is back. Delivery is at
+    least once: a batch in flight when the connection drops is sent again.
+    """
+
+    def __init__(self, iris_daemon, upstream, retry=None):
+        super().__init__(name="iris-relay", daemon=True)
+        self.source = iris_daemon
+        self.upstream = upstream
+        self.retry = RELAY_RETRY if retry is None else retry
+        self.sent = 0
+        self.sock = None
+        self.failing = False
+        self.wake = threading.Event()
+        self.stopping = False
+
+    def pending(self):
+        """Called on ingest."""
+        if not self.wake.is_set():
+            self.wake.set()
+
+    def run(self):
+        while not self.stopping:
+            self.wake.wait(self.retry if self.failing else None)
+            self.wake.clear()
+            self.forward()
+
+    def forward(self):
+        """Send every event the upstream has not had yet; False if it could not be reached."""
+        while True:
+            with self.source.lock:
+                end = min(len(self.source.events), self.sent + RELAY_BATCH)
+            batch = self.source.events[self.sent:end]
+            if not batch:
+                return True
+            payload = b"".join((json.dumps(self._relayed(event)) + '\n').encode('utf-8') for event in batch)
+            try:
+                if self.sock is None:
+                    self.sock = connect_daemon(CONTROL_TIMEOUT, self.upstream)
+                self.sock.sendall(payload)
+            except (OSError, ValueError) as e:
+                self._disconnect()
+                if not self.failing:
+                    self.failing = True
+                    print(f"[iris] Upstream {self.upstream} unreachable ({e}); retrying every {self.retry:g}s.")
+                return False
+            if self.failing:
+                self.failing = False
+                print(f"[iris] Upstream {self.upstream} reachable again.")
+            self.sent += len(batch)
+            metrics.count("relay_events_forwarded", len(batch))
+
+    def _relayed(self, event):
+        # The upstream numbers events its own way; these say where each came from.
+        relayed = dict(event)
+        relayed.setdefault("host", self.source.hostname)
+        relayed.setdefault("session", self.source.session_id)
+        relayed.setdefault("source_id", event.get("id"))
+        return relayed
+
+    def _disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def stop(self):
+        """Stop after a last attempt to forward; returns how many events the upstream never got."""
+        self.stopping = True
+        self.wake.set()
+        self.join()
+        self.forward()
+        self._disconnect()
+        return len(self.source.events) - self.sent
+
+
+def recover_journal(interactive=None):
+    """Recover the journal of a daemon that did not shut down cleanly.
+
+    Returns False if the journal belongs to a daemon that is still running,
+    True otherwise. The user is asked before recovering when stdin is a
+    terminal; a declined journal is kept aside in ~/.iris.
+    """
+    if not os.path.exists(DAEMON_JOURNAL):
+        return True
+    try:
+        reader = open_session(DAEMON_JOURNAL)
+        header = reader.header
+    except (OSError, ValueError):
+        header = {}
+    if os.path.exists(DAEMON_PORT_FILE) and _pid_alive(header.get("pid")) and header.get("pid") != os.getpid():
+        print(f"An iris daemon is already running (pid {header['pid']}). Run 'iris stop' first.")
+        return False
+
+    count = 0
+    if header:
+        try:
+            count = sum(1 for _ in reader.events(fields=()))
+        except (OSError, ValueError):
+            header = {}
+    if not header:
+        # Possibly the only copy of a crashed session's events: keep it.
+        kept = DAEMON_JOURNAL + ".corrupt"
+        if os.path.exists(kept):
+            kept = f"{DAEMON_JOURNAL}.{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.corrupt"
+        os.replace(DAEMON_JOURNAL, kept)
+        print(f"[iris] The daemon journal could not be read; moved it to {kept}.")
+        return True
+    session_id = header.get("session_id", "unknown")
+    target = header.get("trace_file") or session_path(os.path.join(os.getcwd(), f"{session_id}.trace"))
+    # A database takes the recovered session alongside the others.
+    if os.path.exists(target) and not is_database(target):
+        target = os.path.splitext(target)[0] + "-recovered.trace"
+    print(f"[iris] The daemon for session {session_id} did not shut down cleanly ({count} events journaled).")
+
+    if interactive is None:
+        interactive = sys.stdin.isatty()
+    answer = "y"
+    if interactive and count:
+        try:
+            answer = input(f"Recover them into {target}? [Y/n] ").strip().lower() or "y"
+        except EOFError:
+            pass
+    if count and answer.startswith("y"):
+        convert_session(DAEMON_JOURNAL, target, "sqlite" if is_database(target) else "stream")
+        os.remove(DAEMON_JOURNAL)
+        print(f"[iris] Recovered {count} events into {target}")
+    elif count:
+        kept = os.path.join(SIGNAL_DIR, f"{session_id}.journal")
+        os.replace(DAEMON_JOURNAL, kept)
+        print(f"[iris] Journal kept at {kept} (recover it later with 'iris convert {kept} out.trace').")
+    else:
+        os.remove(DAEMON_JOURNAL)
+    return True
+
 
 class IrisDaemon:
-    def __init__(self):
-        self.events = []
+    """Collects events from attached terminals and saves them as one session.
+
+    Clients send newline-delimited JSON events over the daemon socket. A
+    connection whose first line is {"type": "control", "command": ...} is a
+    control request instead; see _control for the commands and replies.
+
+    listen ("HOST:PORT", or a port on every interface) accepts events from
+    other hosts, e.g. from daemons relaying to this one. upstream is the
+    address of a daemon every ingested event is forwarded to (see Relay).
+    """
+
+    def __init__(self, transport=None, metrics_port=None, listen=None, upstream=None):
+        # Events are kept compactly until the session is saved; see eventstore.py.
+        # Only the Checkpointer compacts, so ingest never waits for it.
+        self.events = EventStore(compact_every=None)
         self.server_socket = None
+        self.selector = None
+        self.buffers = {}
         self.running = False
+        self.transport = transport or DAEMON_TRANSPORT
+        if self.transport == "unix" and (listen or not hasattr(socket, "AF_UNIX")):
+            self.transport = "tcp"
+        self.listen = listen
+        self.listen_address = None
+        self.upstream = upstream
+        self.relay = None
+        self.remote = set()
+        self.looped = 0
+        self.hostname = socket.gethostname()
         self.start_time = datetime.datetime.now()
         self.session_id = self.start_time.strftime("%Y-%m-%d_%H-%M-%S")
-        self.trace_file = os.path.join(os.getcwd(), f"{self.session_id}.trace")
+        self.trace_file = session_path(os.path.join(os.getcwd(), f"{self.session_id}.trace"))
         self.lock = threading.Lock()
-        
+        self.checkpointer = None
+        self.bytes_ingested = 0
+        self.terminals = {}
+        self.terminal_events = {}
+        self.subscribers = {}
+        self.stop_waiters = []
+        self.malformed = 0
+        self.metrics_port = metrics_port
+        self.metrics_socket = None
+        self.http_buffers = {}
+        self.waker = None
+        self.waker_w = None
+
     def start(self):
         os.makedirs(SIGNAL_DIR, exist_ok=True)
+        if not recover_journal():
+            return
         for f in [STOP_SIGNAL, RECORDING_LOCK, DAEMON_PORT_FILE]:
             if os.path.exists(f):
                 try:
@@ -31,100 +358,476 @@ class IrisDaemon:
                 except OSError:
                     pass
 
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind(('127.0.0.1', 0))
-        self.server_socket.listen(5)
-        
-        port = self.server_socket.getsockname()[1]
-        
+        address = self._bind()
+        if self.metrics_port is not None:
+            self._bind_metrics()
+
+        # The second line tells clients where large outputs should spill to.
         with open(DAEMON_PORT_FILE, 'w') as f:
-            f.write(str(port))
-            
+            f.write(f"{address}\n{self.trace_file}\n")
+
         with open(RECORDING_LOCK, 'w') as f:
             f.write(str(os.getpid()))
 
+        self.checkpointer = Checkpointer(self, DAEMON_JOURNAL)
+        # The checkpoint thread wakes the selector loop to answer 'iris flush'.
+        self.waker, self.waker_w = socket.socketpair()
+        self.waker.setblocking(False)
+        self.waker_w.setblocking(False)
+        self.selector.register(self.waker, selectors.EVENT_READ, self._on_waker)
+        self.checkpointer.notify = self._wake_loop
+        self.checkpointer.start()
+        if self.upstream:
+            self.relay = Relay(self, self.upstream)
+            self.relay.start()
+
         self.running = True
         print(f"Iris multi-terminal recording daemon started.")
-        print(f"Waiting for terminals to attach... (Port: {port})")
+        print(f"Waiting for terminals to attach... ({address})")
+        if self.listen:
+            print(f"Accepting events from other hosts on {self.listen_address}.")
+        if self.relay is not None:
+            print(f"Relaying events to the upstream daemon at {self.upstream}.")
         print(f"Run 'iris shell' in any new terminal to record it.")
         print(f"Run 'iris stop' to end the recording session.\n")
 
-        accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
-        accept_thread.start()
-
         try:
-            while self.running:
-                if os.path.exists(STOP_SIGNAL):
-                    print("Stop signal received. Shutting down daemon...")
-                    self.running = False
-                    break
-                time.sleep(0.5)
+            self._serve_loop()
         except KeyboardInterrupt:
             self.running = False
 
         self._shutdown()
 
-    def _accept_loop(self):
-        self.server_socket.settimeout(1.0)
+    def _bind(self):
+        """Create the listening socket and return the address clients should use."""
+        if self.transport == "unix":
+            if os.path.exists(DAEMON_SOCKET):
+                os.remove(DAEMON_SOCKET)
+            self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server_socket.bind(DAEMON_SOCKET)
+            address = f"unix:{DAEMON_SOCKET}"
+        else:
+            host, port = parse_address(self.listen, '0.0.0.0') if self.listen else ('127.0.0.1', 0)
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if self.listen:
+                # A fixed port must be reusable right after a restart.
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind((host, port))
+            port = self.server_socket.getsockname()[1]
+            self.listen_address = f"{host}:{port}"
+            # Local terminals reach a wildcard or loopback listener on 127.0.0.1.
+            address = str(port) if host in ("0.0.0.0", "127.0.0.1", "localhost") else f"{host}:{port}"
+        self.server_socket.listen(128)
+        self.server_socket.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ, self._accept)
+        return address
+
+    def _bind_metrics(self):
+        """Serve the Prometheus text format on http://127.0.0.1:<metrics_port>/metrics."""
+        metrics.enable()
+        metrics.gauge("daemon_events", lambda: len(self.events))
+        metrics.gauge("daemon_connections", lambda: len(self.buffers))
+        metrics.gauge("daemon_terminals", lambda: len(set(self.terminals.values())))
+        # Bytes received but not yet ingested: the daemon's ingest queue.
+        metrics.gauge("daemon_pending_bytes", lambda: sum(len(b) for b in list(self.buffers.values())))
+        metrics.gauge("daemon_unjournaled_events",
+                      lambda: len(self.events) - (self.checkpointer.written if self.checkpointer else 0))
+        metrics.gauge("daemon_tail_backlog_bytes", lambda: sum(len(b) for b in list(self.subscribers.values())))
+        if self.upstream:
+            metrics.gauge("relay_backlog_events", lambda: len(self.events) - (self.relay.sent if self.relay else 0))
+        self.metrics_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.metrics_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.metrics_socket.bind(('127.0.0.1', self.metrics_port))
+        self.metrics_socket.listen(16)
+        self.metrics_socket.setblocking(False)
+        self.selector.register(self.metrics_socket, selectors.EVENT_READ, self._accept_metrics)
+        print(f"Serving metrics on http://127.0.0.1:{self.metrics_socket.getsockname()[1]}/metrics")
+
+    def _accept_metrics(self, server_sock, mask):
+        try:
+            client_sock, _ = server_sock.accept()
+        except OSError:
+            return
+        client_sock.setblocking(False)
+        self.http_buffers[client_sock] = bytearray()
+        self.selector.register(client_sock, selectors.EVENT_READ, self._handle_metrics)
+
+    def _handle_metrics(self, client_sock, mask):
+        try:
+            data = client_sock.recv(READ_CHUNK)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        buffer = self.http_buffers[client_sock]
+        buffer += data
+        if data and b"\r\n\r\n" not in buffer and len(buffer) < 65536:
+            return
+        del self.http_buffers[client_sock]
+        self.selector.unregister(client_sock)
+        if not data:
+            client_sock.close()
+            return
+        path = bytes(buffer).split(b" ", 2)[1] if buffer.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] in (b"/", b"/metrics"):
+            status, body = "200 OK", metrics.prometheus()
+        else:
+            status, body = "404 Not Found", "not found\n"
+        payload = body.encode('utf-8')
+        head = (f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n").encode('ascii')
+        try:
+            client_sock.setblocking(True)
+            client_sock.settimeout(CONTROL_TIMEOUT)
+            client_sock.sendall(head + payload)
+        except OSError:
+            pass
+        finally:
+            client_sock.close()
+
+    def _serve_loop(self):
+        next_stop_check = 0.0
         while self.running:
-            try:
-                client_sock, addr = self.server_socket.accept()
-                client_thread = threading.Thread(target=self._handle_client, args=(client_sock,), daemon=True)
-                client_thread.start()
-            except socket.timeout:
-                continue
-            except Exception as e:
-                if self.running:
-                    print(f"Accept error: {e}")
+            for key, mask in self.selector.select(timeout=STOP_POLL_INTERVAL):
+                key.data(key.fileobj, mask)
 
-    def _handle_client(self, client_sock):
-        client_sock.settimeout(1.0)
-        buffer = b""
-        
+            now = time.monotonic()
+            if now >= next_stop_check:
+                next_stop_check = now + STOP_POLL_INTERVAL
+                if os.path.exists(STOP_SIGNAL):
+                    print("Stop signal received. Shutting down daemon...")
+                    self.running = False
+
+    def _accept(self, server_sock, mask=selectors.EVENT_READ):
         try:
-            while self.running:
-                try:
-                    data = client_sock.recv(4096)
-                    if not data:
-                        break
-                    buffer += data
-                except socket.timeout:
-                    break
-            
-            while b'\n' in buffer:
-                line, buffer = buffer.split(b'\n', 1)
-                if not line.strip():
-                    continue
-                try:
-                    event = json.loads(line.decode('utf-8'))
-                    with self.lock:
-                        event['id'] = len(self.events) + 1
-                        self.events.append(event)
-                except json.JSONDecodeError:
-                    pass
-                    
+            client_sock, addr = server_sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            if self.running:
+                print(f"Accept error: {e}")
+            return
+        client_sock.setblocking(False)
+        if isinstance(addr, tuple) and addr[0] not in LOCAL_PEERS:
+            self.remote.add(client_sock)
+        self.buffers[client_sock] = bytearray()
+        self.selector.register(client_sock, selectors.EVENT_READ, self._handle_client)
+
+    def _handle_client(self, client_sock, mask=selectors.EVENT_READ):
+        # Reading one chunk per readiness event keeps a chatty client from
+        # starving the others; complete lines are ingested immediately.
+        started = metrics.clock()
+        try:
+            data = client_sock.recv(READ_CHUNK)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        metrics.count("daemon_bytes_received", len(data))
+        self._receive(client_sock, data)
+        metrics.elapsed("daemon_handle_client", started)
+
+    def _receive(self, client_sock, data):
+        """Buffer received bytes and ingest every complete line; empty data means EOF."""
+        buffer = self.buffers[client_sock]
+        if not data:
             if buffer.strip():
-                try:
-                    event = json.loads(buffer.decode('utf-8'))
-                    with self.lock:
-                        event['id'] = len(self.events) + 1
-                        self.events.append(event)
-                except json.JSONDecodeError:
-                    pass
+                self._ingest_line(bytes(buffer), client_sock)
+            self._close_client(client_sock)
+            return
+
+        start = len(buffer)
+        buffer += data
+        pos = buffer.find(b'\n', start)
+        if pos == -1:
+            if len(buffer) > MAX_LINE_BYTES:
+                print(f"[iris] Dropped a client that sent over {MAX_LINE_BYTES // (1024 * 1024)} MB without a newline.")
+                metrics.count("daemon_dropped_clients")
+                self._close_client(client_sock)
+            return
+
+        begin = 0
+        while pos != -1:
+            if self._ingest_line(bytes(buffer[begin:pos]), client_sock):
+                # The connection was handed over to a control request.
+                return
+            begin = pos + 1
+            pos = buffer.find(b'\n', begin)
+        del buffer[:begin]
+
+    def _ingest_line(self, line, client_sock=None):
+        """Ingest one event line; returns True if it was a control request instead."""
+        if not line.strip():
+            return False
+        try:
+            event = json.loads(line.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            event = None
+        if not isinstance(event, dict):
+            self._malformed(line)
+            return False
+        if event.get('type') == 'control':
+            if client_sock is None:
+                return False
+            self._control(client_sock, event)
+            return True
+        if event.get('session') == self.session_id and event.get('host') == self.hostname:
+            # Our own event came back: an upstream chain that loops.
+            self.looped += 1
+            if self.looped == 1:
+                print("[iris] Dropping events relayed back to this daemon; check the --upstream chain.")
+            return False
+        self.bytes_ingested += len(line)
+        terminal = event.get('terminal') or 'unknown'
+        if 'session' in event:
+            # Relayed from another daemon: terminal names only mean something per host.
+            terminal = f"{event.get('host')} {terminal}"
+        self.terminal_events[terminal] = self.terminal_events.get(terminal, 0) + 1
+        if client_sock is not None:
+            self.terminals[client_sock] = terminal
+        self._ingest(event)
+        metrics.count("daemon_events_ingested")
+        return False
 
-        except Exception as e:
+    def _malformed(self, line):
+        self.malformed += 1
+        metrics.count("daemon_malformed_events")
+        if self.malformed <= MALFORMED_WARNINGS:
+            preview = line[:80].decode('utf-8', errors='replace')
+            print(f"[iris] Ignored a malformed event ({len(line)} bytes): {preview!r}")
+            if self.malformed == MALFORMED_WARNINGS:
+                print("[iris] Further malformed events are only counted (see 'iris status').")
+
+    def _ingest(self, event):
+        with self.lock:
+            event['id'] = len(self.events) + 1
+            self.events.append(event)
+        if self.checkpointer is not None:
+            self.checkpointer.pending(event['id'])
+        if self.relay is not None:
+            self.relay.pending()
+        if self.subscribers:
+            self._publish(event)
+
+    # Control requests. Each gets its own connection and one or more JSON
+    # reply lines:
+    #   status                      -> {"type": "status", ...}
+    #   tail {last, follow}         -> {"type": "event", "event": ...} lines;
+    #                                  with follow, one more per new event
+    #   search {query, limit, first_id, last_id, since, until}
+    #                               -> {"type": "event", ...} lines, then {"type": "done", "count": n}
+    #   flush                       -> {"type": "flushed", "journal": ..., "events": n}
+    #   stop                        -> {"type": "stopped", "trace_file": ..., "events": n} once saved
+
+    def _control(self, client_sock, request):
+        self.buffers.pop(client_sock, None)
+        try:
+            self.selector.unregister(client_sock)
+        except (KeyError, ValueError):
+            pass
+        if client_sock in self.remote:
+            self.remote.discard(client_sock)
+            self._reply(client_sock, [{"type": "error", "message": "control requests are only accepted locally"}])
+            return
+        command = request.get('command')
+        if command == 'status':
+            self._reply(client_sock, [self._status()])
+        elif command == 'flush':
+            # Journaling fsyncs and compacts, so the checkpoint thread does it
+            # and _answer_flushes replies once it is done.
+            self.checkpointer.request_flush(client_sock, len(self.events))
+        elif command == 'stop':
+            print("Stop requested. Shutting down daemon...")
+            self.stop_waiters.append(client_sock)
+            self.running = False
+        elif command == 'search':
+            # Scanning a long session would stall ingest, so it runs on its own thread.
+            threading.Thread(target=self._search, args=(client_sock, request), daemon=True).start()
+        elif command == 'tail':
+            self._tail(client_sock, request)
+        else:
+            self._reply(client_sock, [{"type": "error", "message": f"unknown command: {command}"}])
+
+    def _wake_loop(self):
+        try:
+            self.waker_w.send(b"\0")
+        except OSError:
+            # Already woken (the buffer is full) or shutting down.
+            pass
+
+    def _on_waker(self, waker, mask=selectors.EVENT_READ):
+        try:
+            waker.recv(READ_CHUNK)
+        except (BlockingIOError, InterruptedError):
+            pass
+        self._answer_flushes()
+
+    def _answer_flushes(self):
+        with self.checkpointer.waiters_lock:
+            done, self.checkpointer.flushed = self.checkpointer.flushed, []
+        for client_sock, count, error in done:
+            if error is None:
+                self._reply(client_sock, [{"type": "flushed", "journal": DAEMON_JOURNAL, "events": count}])
+            else:
+                self._reply(client_sock, [{"type": "error", "message": f"flush failed: {error}"}])
+
+    def _status(self):
+        attached = {}
+        for terminal in self.terminals.values():
+            attached[terminal] = attached.get(terminal, 0) + 1
+        return {
+            "type": "status",
+            "pid": os.getpid(),
+            "session_id": self.session_id,
+            "start_time": self.start_time.isoformat(),
+            "uptime_s": round((datetime.datetime.now() - self.start_time).total_seconds(), 1),
+            "trace_file": self.trace_file,
+            "events": len(self.events),
+            "bytes": self.bytes_ingested,
+            "malformed": self.malformed,
+            "journaled": self.checkpointer.written if self.checkpointer is not None else 0,
+            "terminals": [{"terminal": name, "events": count, "connections": attached.get(name, 0)}
+                          for name, count in sorted(self.terminal_events.items())],
+            "subscribers": len(self.subscribers),
+            "upstream": self.upstream,
+            "relayed": self.relay.sent if self.relay is not None else 0,
+        }
+
+    def _reply(self, client_sock, replies):
+        """Send reply lines with a blocking write and close the connection."""
+        try:
+            client_sock.setblocking(True)
+            client_sock.settimeout(CONTROL_TIMEOUT)
+            for reply in replies:
+                client_sock.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+        except OSError:
             pass
         finally:
             try:
                 client_sock.close()
-            except Exception:
+            except OSError:
                 pass
 
+    def _search(self, client_sock, request):
+        from search import output_contains
+
+        needle = str(request.get('query', '')).lower()
+        limit = request.get('limit')
+        since, until = request.get('since'), request.get('until')
+        # Event ids are positions in the store, so id bounds select a slice.
+        first = max(int(request.get('first_id') or 1), 1) - 1
+        last = request.get('last_id')
+
+        def matches():
+            count = 0
+            # Reading the store rebuilds one event at a time; events
+            # ingested meanwhile are not searched.
+            end = len(self.events) if last is None else min(int(last), len(self.events))
+            for i in range(first, end):
+                if limit is not None and count >= limit:
+                    break
+                event = self.events[i]
+                timestamp = event.get('timestamp') or ''
+                if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                    continue
+                if (needle in event.get('command', '').lower() or needle in (event.get('output') or '').lower()
+                        or (event.get('output_blob') and output_contains(self.trace_file, event, needle))):
+                    count += 1
+                    yield {"type": "event", "event": event}
+            yield {"type": "done", "count": count}
+
+        self._reply(client_sock, matches())
+
+    def _tail(self, client_sock, request):
+        last = max(0, int(request.get('last', 10)))
+        with self.lock:
+            recent = self.events[len(self.events) - last:] if last else []
+        if not request.get('follow'):
+            self._reply(client_sock, [{"type": "event", "event": e} for e in recent])
+            return
+        self.subscribers[client_sock] = bytearray(
+            b"".join((json.dumps({"type": "event", "event": e}) + '\n').encode('utf-8') for e in recent))
+        self.selector.register(client_sock, selectors.EVENT_READ, self._serve_subscriber)
+        self._flush_subscriber(client_sock)
+
+    def _publish(self, event):
+        line = (json.dumps({"type": "event", "event": event}) + '\n').encode('utf-8')
+        for client_sock, backlog in list(self.subscribers.items()):
+            was_empty = not backlog
+            backlog += line
+            if len(backlog) > MAX_TAIL_BACKLOG:
+                metrics.count("daemon_dropped_clients")
+                self._drop_subscriber(client_sock)
+            elif was_empty:
+                self._flush_subscriber(client_sock)
+
+    def _flush_subscriber(self, client_sock):
+        backlog = self.subscribers[client_sock]
+        try:
+            sent = client_sock.send(backlog)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._drop_subscriber(client_sock)
+            return
+        del backlog[:sent]
+        # Wait for writability only while there is something left to send.
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if backlog else 0)
+        self.selector.modify(client_sock, events, self._serve_subscriber)
+
+    def _serve_subscriber(self, client_sock, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = client_sock.recv(READ_CHUNK)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":
+                self._drop_subscriber(client_sock)
+                return
+        if mask & selectors.EVENT_WRITE:
+            self._flush_subscriber(client_sock)
+
+    def _drop_subscriber(self, client_sock):
+        self.subscribers.pop(client_sock, None)
+        try:
+            self.selector.unregister(client_sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            client_sock.close()
+        except OSError:
+            pass
+
+    def _close_client(self, client_sock):
+        self.buffers.pop(client_sock, None)
+        self.terminals.pop(client_sock, None)
+        self.remote.discard(client_sock)
+        try:
+            self.selector.unregister(client_sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            client_sock.close()
+        except Exception:
+            pass
+
     def _shutdown(self):
         self.running = False
-        if self.server_socket:
+        if self.selector:
+            for client_sock in list(self.subscribers):
+                self._drop_subscriber(client_sock)
+            for client_sock in list(self.buffers):
+                self._drain_client(client_sock)
+            self.selector.close()
+        for sock in [self.server_socket, self.metrics_socket, self.waker, self.waker_w] + list(self.http_buffers):
+            if sock is None:
+                continue
             try:
-                self.server_socket.close()
+                sock.close()
             except Exception:
                 pass
 
@@ -134,29 +837,48 @@ class IrisDaemon:
                     os.remove(f)
                 except OSError:
                     pass
+        if self.transport == "unix" and os.path.exists(DAEMON_SOCKET):
+            try:
+                os.remove(DAEMON_SOCKET)
+            except OSError:
+                pass
 
+        if self.relay is not None:
+            unsent = self.relay.stop()
+            if unsent:
+                print(f"[iris] {unsent} events never reached the upstream daemon; "
+                      f"'iris merge' this session's trace with the upstream one to combine them.")
         end_time = datetime.datetime.now()
         save_session(self.trace_file, self.session_id, self.start_time, end_time, self.events)
+        # The trace is complete, so the journal is no longer needed.
+        if self.checkpointer is not None:
+            self.checkpointer.stop()
+            self._answer_flushes()
+            try:
+                os.remove(DAEMON_JOURNAL)
+            except OSError:
+                pass
         print(f"\n[iris] Multi-terminal session saved to {self.trace_file}")
         print(f"[iris] Captured {len(self.events)} total commands across all terminals.")
+        for client_sock in self.stop_waiters:
+            self._reply(client_sock, [{"type": "stopped", "trace_file": self.trace_file,
+                                       "events": len(self.events)}])
 
-def run_daemon():
-    daemon = IrisDaemon()
-    daemon.start()
+    def _drain_client(self, client_sock):
+        """Ingest whatever a client still has in flight before the daemon exits."""
+        chunks = [bytes(self.buffers.get(client_sock, b""))]
+        while True:
+            try:
+                data = client_sock.recv(READ_CHUNK)
+            except OSError:
+                break
+            if not data:
+                break
+            chunks.append(data)
+        for line in b"".join(chunks).split(b'\n'):
+            self._ingest_line(line)
+        self._close_client(client_sock)
 
-def send_event_to_daemon(event):
-    if not os.path.exists(DAEMON_PORT_FILE):
-        return False
-        
-    try:
-        with open(DAEMON_PORT_FILE, 'r') as f:
-            port = int(f.read().strip())
-            
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(2.0)
-            s.connect(('127.0.0.1', port))
-            message = json.dumps(event) + '\n'
-            s.sendall(message.encode('utf-8'))
-            return True
-    except Exception:
-        return False
+def run_daemon(transport=None, metrics_port=None, listen=None, upstream=None):
+    daemon = IrisDaemon(transport, metrics_port, listen, upstream)
+    daemon.start()
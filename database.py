@@ -0,0 +1,369 @@
+import json
+import sqlite3
+import metrics
+from storage import FSYNC_POLICY, _hostname, _fsync_interval
+
+# The optional session database (IRIS_STORAGE=sqlite). Recorders, 'iris run'
+# and the daemon write every session into one SQLite file in ~/.iris instead
+# of a .trace file in whatever directory they started in. The database runs
+# in WAL mode, so any number of terminals write at once while others read.
+#
+# The fields every event has are columns, indexed where queries filter or
+# sort on them; the rest of an event is kept as JSON in extra. An FTS5 index
+# over command and output (trigram tokens, so any substring of three or more
+# characters matches, like the plain-text search) answers 'iris search'
+# without reading outputs.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    hostname TEXT,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_session_id ON sessions(session_id);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    session INTEGER NOT NULL REFERENCES sessions(id),
+    id INTEGER,
+    timestamp TEXT,
+    command TEXT,
+    output TEXT,
+    exit_code INTEGER,
+    duration_ms INTEGER,
+    host TEXT,
+    terminal TEXT,
+    blob TEXT,
+    resources TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS events_session_id ON events(session, id);
+CREATE INDEX IF NOT EXISTS events_timestamp ON events(timestamp);
+CREATE INDEX IF NOT EXISTS events_exit_code ON events(exit_code);
+CREATE INDEX IF NOT EXISTS events_duration ON events(duration_ms);
+CREATE INDEX IF NOT EXISTS events_host ON events(host);
+CREATE INDEX IF NOT EXISTS events_blob ON events(blob) WHERE blob IS NOT NULL;
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+    command, output, content='events', content_rowid='seq', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts(rowid, command, output) VALUES (new.seq, new.command, new.output);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts(events_fts, rowid, command, output) VALUES ('delete', old.seq, old.command, old.output);
+END;
+"""
+
+# Seconds a writer waits for another one's transaction before giving up.
+BUSY_TIMEOUT = 30.0
+# A buffered writer (save_session, convert) commits every this many events,
+# so it never holds the write lock for long while terminals are recording.
+BATCH_EVENTS = 500
+# Event fields kept in columns; everything else goes into extra.
+_COLUMN_FIELDS = ("id", "timestamp", "command", "output", "exit_code", "duration_ms", "host", "terminal",
+                  "resources")
+_MIN_TRIGRAM = 3
+# Rows fetched per query when looking up search hits by rowid.
+_FETCH_ROWS = 500
+
+
+def connect(db_path):
+    """Open (creating if needed) the database at db_path."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL commits are durable across a crash of iris with synchronous=NORMAL;
+    # IRIS_FSYNC=always also makes them survive power loss.
+    conn.execute("PRAGMA synchronous=" + ("FULL" if _fsync_interval(FSYNC_POLICY) == 0.0 else "NORMAL"))
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'events_fts'").fetchone() is None:
+        try:
+            with conn:
+                conn.executescript(SCHEMA.format(tokenizer="trigram"))
+        except sqlite3.OperationalError:
+            # SQLite before 3.34 has no trigram tokenizer; words still match.
+            with conn:
+                conn.executescript(SCHEMA.format(tokenizer="unicode61"))
+    return conn
+
+
+def _row(session, event, hostname):
+    extra = {k: v for k, v in event.items() if k not in _COLUMN_FIELDS}
+    blob = event.get("output_blob")
+    resources = event.get("resources")
+    return (session, event.get("id"), event.get("timestamp"), event.get("command"), event.get("output"),
+            event.get("exit_code"), event.get("duration_ms"), event.get("host") or hostname, event.get("terminal"),
+            blob["sha256"] if blob else None, json.dumps(resources) if resources is not None else None,
+            json.dumps(extra) if extra else None)
+
+
+class DatabaseWriter:
+    """Writes one session into the database; used in place of a TraceWriter.
+
+    Like TraceWriter it behaves as the events list build_event numbers
+    from. Each event is committed as it is appended unless buffered, in
+    which case events are committed in batches and on close().
+    """
+
+    def __init__(self, db_path, session_id, start_dt, hostname=None, buffered=False, extra=None):
+        self.trace_file = db_path
+        self.count = 0
+        self.hostname = hostname or _hostname()
+        self._buffered = buffered
+        self._pending = 0
+        self._conn = connect(db_path)
+        # Session ids only have one-second resolution, so two 'iris run's can
+        # start the same one; the later gets a -2, -3... suffix. The write
+        # lock is taken first so concurrent writers cannot pick the same one.
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            taken = {row[0] for row in self._conn.execute(
+                "SELECT session_id FROM sessions WHERE session_id = ? OR session_id LIKE ? ESCAPE '\\'",
+                (session_id, session_id.replace("_", "\\_") + "-%"))}
+            unique, n = session_id, 1
+            while unique in taken:
+                n += 1
+                unique = f"{session_id}-{n}"
+            cur = self._conn.execute(
+                "INSERT INTO sessions (session_id, start_time, hostname, header) VALUES (?, ?, ?, ?)",
+                (unique, start_dt.isoformat(), self.hostname, json.dumps(extra) if extra else None))
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self.session_id = unique
+        self.session = cur.lastrowid
+
+    def __len__(self):
+        return self.count
+
+    def append(self, event):
+        started = metrics.clock()
+        self._conn.execute("INSERT INTO events (session, id, timestamp, command, output, exit_code, duration_ms, "
+                           "host, terminal, blob, resources, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           _row(self.session, event, self.hostname))
+        self.count += 1
+        self._pending += 1
+        if not self._buffered or self._pending >= BATCH_EVENTS:
+            self._conn.commit()
+            self._pending = 0
+        metrics.elapsed("serialize", started)
+        metrics.count("events_written")
+
+    def sync(self):
+        self._conn.commit()
+        self._pending = 0
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self, end_dt):
+        if self._conn is None:
+            return
+        with self._conn:
+            self._conn.execute("UPDATE sessions SET end_time = ? WHERE id = ?", (end_dt.isoformat(), self.session))
+        self._conn.close()
+        self._conn = None
+
+
+def _fts_phrase(query):
+    return '"' + query.replace('"', '""') + '"'
+
+
+class DatabaseSession:
+    """Read-side view of the database, like storage.SessionReader for a trace.
+
+    session selects one session: by session_id (the latest one when a
+    database written before ids were made unique has several), or by its
+    row in the sessions table when an int. Without it, events() walks every
+    session in the order they were written. header describes the selected
+    session, or the database as a whole.
+    """
+
+    format = "sqlite"
+
+    def __init__(self, db_path, session=None):
+        self.trace_file = db_path
+        self.session_id = None
+        self._session_row = None
+        self.recovered = False
+        self._conn = connect(db_path)
+        self._conn.row_factory = sqlite3.Row
+        if session is None:
+            row = self._conn.execute("SELECT COUNT(*), MIN(start_time), MAX(end_time), "
+                                     "MIN(hostname), MAX(hostname) FROM sessions").fetchone()
+            self.header = {"session_id": f"{row[0]} sessions in {db_path}", "start_time": row[1],
+                           "hostname": row[3] if row[3] == row[4] else f"{row[3]} and others"}
+            self.end_time = row[2]
+            return
+        if isinstance(session, int):
+            row = self._conn.execute("SELECT * FROM sessions WHERE id = ?", (session,)).fetchone()
+        else:
+            row = self._conn.execute("SELECT * FROM sessions WHERE session_id = ? ORDER BY id DESC LIMIT 1",
+                                     (session,)).fetchone()
+        if row is None:
+            raise ValueError(f"no session {session!r} in {db_path}")
+        self.session_id = row["session_id"]
+        # Events are selected by this row, never by session_id, which older
+        # databases can share between sessions.
+        self._session_row = row["id"]
+        self.header = dict(json.loads(row["header"]) if row["header"] else {}, session_id=row["session_id"],
+                           start_time=row["start_time"], hostname=row["hostname"])
+        self.end_time = row["end_time"] or row["start_time"]
+
+    def sessions(self):
+        """(session_id, start_time, end_time, hostname, events) of every session, oldest first."""
+        return self._conn.execute(
+            "SELECT s.session_id, s.start_time, s.end_time, s.hostname, "
+            "(SELECT COUNT(*) FROM events e WHERE e.session = s.id) FROM sessions s ORDER BY s.id").fetchall()
+
+    def session_rows(self):
+        """Row of every session in the sessions table, oldest first, for DatabaseSession(db, row)."""
+        return [row[0] for row in self._conn.execute("SELECT id FROM sessions ORDER BY id")]
+
+    def latest_session(self):
+        """(session_id, row) of the latest session, or None."""
+        row = self._conn.execute("SELECT session_id, id FROM sessions ORDER BY id DESC LIMIT 1").fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _where(self, first_id, last_id, since, until, failed_only=False, command_regex=None):
+        where, params = [], []
+        if self._session_row is not None:
+            where.append("e.session = ?")
+            params.append(self._session_row)
+        for clause, value in (("e.id >= ?", first_id), ("e.id <= ?", last_id),
+                              ("e.timestamp >= ?", since), ("e.timestamp <= ?", until)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        if failed_only:
+            where.append("e.exit_code != 0")
+        if command_regex is not None:
+            import re
+            pattern = re.compile(command_regex)
+            self._conn.create_function("iris_regexp", 1, lambda text: pattern.search(text or "") is not None,
+                                       deterministic=True)
+            where.append("iris_regexp(e.command)")
+        return where, params
+
+    def _select(self, where, params, skip_output):
+        columns = "e.id, e.timestamp, e.command, e.exit_code, e.duration_ms, e.host, e.terminal, e.resources, e.extra"
+        if not skip_output:
+            columns += ", e.output"
+        sql = f"SELECT {columns} FROM events e"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._conn.execute(sql + " ORDER BY e.seq", params)
+
+    @staticmethod
+    def _event(row, skip_output):
+        event = {"id": row["id"]}
+        extra = json.loads(row["extra"]) if row["extra"] else {}
+        if "type" in extra:
+            event["type"] = extra.pop("type")
+        event["timestamp"] = row["timestamp"]
+        event["command"] = row["command"]
+        if not skip_output:
+            event["output"] = row["output"]
+        event["exit_code"] = row["exit_code"]
+        event["duration_ms"] = row["duration_ms"]
+        for key in ("host", "terminal"):
+            if row[key] is not None:
+                event[key] = row[key]
+        if row["resources"] is not None:
+            event["resources"] = json.loads(row["resources"])
+        event.update(extra)
+        return event
+
+    def events(self, first_id=None, last_id=None, since=None, until=None, fields=None,
+               failed_only=False, command_regex=None):
+        """Yield events in the order they were written, filtered by indexed columns.
+
+        Besides the bounds SessionReader.events takes, failed_only and
+        command_regex filter inside the query, before outputs are read.
+        """
+        skip_output = fields is not None and "output" not in fields
+        where, params = self._where(first_id, last_id, since, until, failed_only, command_regex)
+        for row in self._select(where, params, skip_output):
+            event = self._event(row, skip_output)
+            if fields is not None:
+                event = {k: event[k] for k in fields if k in event}
+            yield event
+
+    def search(self, query, first_id=None, last_id=None, since=None, until=None, limit=None):
+        """Yield (session_id, event, matched) in written order for a case-insensitive substring query.
+
+        matched is True when the command or the stored output contains the
+        query. Events whose full output spilled to a blob come along with
+        matched False when their excerpt did not match, for the caller to
+        scan the blob.
+        """
+        conn = self._conn
+        where, params = self._where(first_id, last_id, since, until)
+        fts = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'events_fts'").fetchone()[0]
+        if len(query) >= _MIN_TRIGRAM or "trigram" not in fts:
+            match = "e.seq IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)"
+            match_params = [_fts_phrase(query)]
+        else:
+            # Too short for trigrams: scan the columns.
+            match = "(instr(lower(e.command), ?) > 0 OR instr(lower(e.output), ?) > 0)"
+            match_params = [query.lower(), query.lower()]
+        matched = {seq for seq, in conn.execute(
+            "SELECT e.seq FROM events e WHERE " + " AND ".join(where + [match]), params + match_params)}
+        spilled = {seq for seq, in conn.execute(
+            "SELECT e.seq FROM events e WHERE " + " AND ".join(where + ["e.blob IS NOT NULL"]), params)}
+        candidates = sorted(matched | spilled)
+        found = 0
+        for i in range(0, len(candidates), _FETCH_ROWS):
+            chunk = candidates[i:i + _FETCH_ROWS]
+            rows = conn.execute(
+                "SELECT e.*, s.session_id AS session_id FROM events e JOIN sessions s ON s.id = e.session "
+                f"WHERE e.seq IN ({', '.join('?' * len(chunk))}) ORDER BY e.seq", chunk)
+            for row in rows:
+                hit = row["seq"] in matched
+                yield row["session_id"], self._event(row, False), hit
+                found += hit
+                if limit is not None and found >= limit:
+                    return
+
+    def stats(self):
+        """summary.SessionStats for the selected sessions, built from aggregate queries."""
+        from summary import SessionStats, CACHED_TOP, normalize_command, duration_bucket
+
+        conn = self._conn
+        conn.create_function("iris_normalize", 1, lambda command: normalize_command(command or ""),
+                             deterministic=True)
+        conn.create_function("iris_bucket", 1, lambda ms: str(duration_bucket(ms or 0)), deterministic=True)
+        where, params = self._where(None, None, None, None)
+        clause = (" WHERE " + " AND ".join(where)) if where else ""
+        base = "FROM events e JOIN sessions s ON s.id = e.session" + clause
+
+        stats = SessionStats()
+        commands, errors, total, longest = conn.execute(
+            f"SELECT COUNT(*), SUM(e.exit_code != 0), SUM(COALESCE(e.duration_ms, 0)), "
+            f"MAX(COALESCE(e.duration_ms, 0)) {base}", params).fetchone()
+        stats.commands, stats.errors, stats.total_ms, stats.max_ms = commands, errors or 0, total or 0, longest or 0
+        stats.hist = dict(conn.execute(f"SELECT iris_bucket(e.duration_ms), COUNT(*) {base} GROUP BY 1", params))
+        # The duration index hands these over without sorting.
+        stats.top = [list(row) for row in conn.execute(
+            f"SELECT COALESCE(e.duration_ms, 0), e.command, e.timestamp, s.session_id, e.id {base} "
+            f"ORDER BY e.duration_ms DESC LIMIT {CACHED_TOP}", params)]
+        stats.groups = {name: [count, total or 0, longest or 0, failed or 0] for name, count, total, longest, failed
+                        in conn.execute(f"SELECT iris_normalize(e.command), COUNT(*), SUM(e.duration_ms), "
+                                        f"MAX(e.duration_ms), SUM(e.exit_code != 0) {base} GROUP BY 1", params)}
+        stats.hosts = {host or "unknown": ms or 0 for host, ms in conn.execute(
+            f"SELECT e.host, SUM(e.duration_ms) {base} GROUP BY e.host", params)}
+        stats.terminals = {f"{host or 'unknown'} {terminal}": ms or 0 for host, terminal, ms in conn.execute(
+            f"SELECT e.host, COALESCE(e.terminal, s.session_id), SUM(e.duration_ms) {base} GROUP BY 1, 2", params)}
+        # Only 'iris run' events carry resource usage; SessionStats.add sums them.
+        scratch = SessionStats()
+        for command, resources in conn.execute(
+                f"SELECT e.command, e.resources {base}{' AND' if where else ' WHERE'} e.resources IS NOT NULL",
+                params):
+            scratch.add({"command": command, "resources": json.loads(resources)}, None, None, None)
+        stats.measured, stats.cpu, stats.blocks = scratch.measured, scratch.cpu, scratch.blocks
+        stats.peak_rss, stats.first_output = scratch.peak_rss, scratch.first_output
+
+        session_clause = " WHERE id = ?" if self._session_row is not None else ""
+        for start, end in conn.execute(f"SELECT start_time, end_time FROM sessions{session_clause}",
+                                       [self._session_row] if self._session_row is not None else []):
+            stats.add_session({"start_time": start}, end or start)
+        return stats
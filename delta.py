@@ -0,0 +1,196 @@
+import os
+from collections import OrderedDict
+
+# Delta encoding of repeated command outputs.
+#
+# Sessions that poll (kubectl get pods, docker ps, tail -n 50 app.log) store
+# nearly the same output over and over. A trace written with delta encoding
+# stores such an output as a line diff against the previous output of the
+# same command:
+#
+#     "output_delta": {"base": 41, "key": 17, "ops": [[0, 3], "new line", [4, 50]]}
+#
+# base is the id of the event diffed against, key the keyframe its chain
+# starts from (an event with a full output). Each op either copies base lines
+# [i, j) or inserts the lines of a string. Every KEYFRAME_INTERVAL-th output
+# of a command, and any output the diff would not shrink enough, is stored in
+# full, so decoding an event never walks more than KEYFRAME_INTERVAL events.
+KEYFRAME_INTERVAL = int(os.environ.get("IRIS_DELTA_KEYFRAME", 16))
+# Outputs with more lines than this are always stored in full; diffing them
+# would cost more than it saves.
+MAX_DELTA_LINES = 20000
+# A delta is only kept if it is at most this fraction of the full output.
+MAX_DELTA_RATIO = 0.7
+# Encoder and decoder keep the last output of at most this many commands, and
+# of at most this many characters in all, dropping the least recently used.
+# A command dropped by the encoder starts over with a keyframe; one dropped by
+# the decoder is decoded afresh from its keyframe.
+MAX_CHAINS = 256
+MAX_CHAIN_CHARS = 16 * 1024 * 1024
+
+
+def delta_key(command):
+    """Commands whose outputs are diffed against each other: same words, any spacing."""
+    return " ".join(command.split())
+
+
+def _chains_key(event):
+    # Events without an id, or whose output spilled to a blob, are not
+    # part of any chain; encoder and decoder must skip exactly the same ones.
+    if event.get("id") is None or event.get("output_blob"):
+        return None
+    return delta_key(event.get("command", ""))
+
+
+def diff_ops(base, lines):
+    """Ops turning the base lines into lines, or None if not worth storing."""
+    import difflib
+
+    ops = []
+    size = 0
+    matcher = difflib.SequenceMatcher(None, base, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+            size += 12
+        elif j2 > j1:
+            text = "\n".join(lines[j1:j2])
+            ops.append(text)
+            size += len(text) + 4
+    total = sum(len(line) + 1 for line in lines)
+    if size > total * MAX_DELTA_RATIO:
+        return None
+    return ops
+
+
+def apply_ops(base, ops):
+    lines = []
+    for op in ops:
+        if isinstance(op, str):
+            lines.extend(op.split("\n"))
+        else:
+            lines.extend(base[op[0]:op[1]])
+    return lines
+
+
+class _Chains:
+    """Per delta key state with the last output's lines, bounded as an LRU (see MAX_CHAINS)."""
+
+    def __init__(self, max_keys=MAX_CHAINS, max_chars=MAX_CHAIN_CHARS):
+        self.max_keys = max_keys
+        self.max_chars = max_chars
+        self.entries = OrderedDict()   # delta key -> (state, size of its output)
+        self.chars = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, state, size):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.chars -= old[1]
+        self.entries[key] = (state, size)
+        self.chars += size
+        while self.entries and (len(self.entries) > self.max_keys or self.chars > self.max_chars):
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.chars -= evicted
+
+
+def _replace_key(event, old, new, value):
+    """Copy of event with key old replaced by new, keeping the field order."""
+    return {(new if k == old else k): (value if k == old else v) for k, v in event.items()}
+
+
+class DeltaEncoder:
+    """Turns events with full outputs into delta-encoded events (for trace writers)."""
+
+    def __init__(self, keyframe_interval=None):
+        self.keyframe_interval = KEYFRAME_INTERVAL if keyframe_interval is None else keyframe_interval
+        self.chains = _Chains()   # delta key -> [last id, keyframe id, last lines, outputs since keyframe]
+
+    def encode(self, event):
+        output = event.get("output")
+        key = _chains_key(event)
+        if key is None or not isinstance(output, str):
+            return event
+        lines = output.split("\n")
+        chain = self.chains.get(key)
+        ops = None
+        if chain is not None and chain[3] < self.keyframe_interval and len(lines) <= MAX_DELTA_LINES:
+            ops = diff_ops(chain[2], lines)
+        if ops is None:
+            self.chains.put(key, [event["id"], event["id"], lines, 1], len(output))
+            return event
+        delta = {"base": chain[0], "key": chain[1], "ops": ops}
+        self.chains.put(key, [event["id"], chain[1], lines, chain[3] + 1], len(output))
+        return _replace_key(event, "output", "output_delta", delta)
+
+
+class DeltaDecoder:
+    """Restores full outputs while reading a delta-encoded trace in order.
+
+    Every event read must be passed to decode(), in range or not, so the
+    chains stay current. resolve(keyframe_id, base_id) is called for a base
+    that was never seen (a range read that skipped it) or is no longer kept,
+    and must return the base's output lines.
+    """
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+        self.chains = _Chains()   # delta key -> (last id, last lines)
+
+    def decode(self, event):
+        key = _chains_key(event)
+        delta = event.get("output_delta")
+        if delta is None:
+            if key is not None and isinstance(event.get("output"), str):
+                self.chains.put(key, (event["id"], event["output"].split("\n")), len(event["output"]))
+            return event
+        chain = self.chains.get(key)
+        if chain is not None and chain[0] == delta["base"]:
+            base = chain[1]
+        else:
+            base = self.resolve(delta["key"], delta["base"])
+        lines = apply_ops(base, delta["ops"])
+        output = "\n".join(lines)
+        self.chains.put(key, (event["id"], lines), len(output))
+        return _replace_key(event, "output_delta", "output", output)
+
+
+def diff_events(trace_file, first, second, context=3):
+    """Print a unified diff between the outputs of two events of a trace."""
+    import sys
+    import difflib
+    from storage import open_session
+
+    session = open_session(trace_file)
+    found = {}
+    for event_id in (first, second):
+        for event in session.events(first_id=event_id, last_id=event_id):
+            found[event_id] = event
+        if event_id not in found:
+            print(f"Error: no event #{event_id} in {trace_file}")
+            sys.exit(1)
+    a, b = found[first], found[second]
+    for event in (a, b):
+        if event.get("output_blob"):
+            print(f"Note: the output of event #{event['id']} spilled to a blob; diffing its excerpt.")
+    lines = list(difflib.unified_diff(
+        (a.get("output") or "").split("\n"), (b.get("output") or "").split("\n"),
+        fromfile=f"#{first} $ {a.get('command', '')}  [{a.get('timestamp')}]",
+        tofile=f"#{second} $ {b.get('command', '')}  [{b.get('timestamp')}]",
+        n=context, lineterm=""))
+    if not lines:
+        print(f"Events #{first} and #{second} have identical output.")
+        return
+    color = sys.stdout.isatty()
+    for line in lines:
+        if color and line.startswith("+") and not line.startswith("+++"):
+            line = f"\x1b[32m{line}\x1b[0m"
+        elif color and line.startswith("-") and not line.startswith("---"):
+            line = f"\x1b[31m{line}\x1b[0m"
+        print(line)
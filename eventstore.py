@@ -0,0 +1,236 @@
+import json
+import zlib
+import datetime
+import threading
+from array import array
+
+# Compact in-memory storage for the events of a running session.
+#
+# A dict per event repeats every key, keeps a fresh copy of the same host,
+# terminal and command strings and holds each output as a full str, so a
+# long multi-terminal session costs hundreds of MB before it is written.
+# EventStore keeps events in columns instead:
+#
+#   * ids, exit codes and durations in int64 arrays, timestamps as int64
+#     microseconds when they are plain ISO timestamps without a time zone
+#   * type, command, host, terminal, cwd and session as indexes into one
+#     table of interned strings
+#   * outputs of COMPRESS_MIN characters or more as zlib-compressed UTF-8
+#   * every other key (timing, resources, output_blob, screens...) as one
+#     compact JSON document per event, compressed the same way
+#
+# A value that does not fit its column (a None exit code, a timestamp with
+# an offset) is kept with the other keys, so every event reads back equal
+# to the dict that was appended. Events are rebuilt as dicts on access.
+#
+# append() only keeps the event dict as it is; compact() moves everything
+# appended since its last call into the columns, so the daemon does that
+# work on its checkpoint thread right after journaling those events, not
+# on the ingest path, and creates its store with compact_every=None.
+# Otherwise append() compacts every compact_every events (COMPACT_EVERY by
+# default), unless another thread is compacting already.
+#
+# Appends may run on one thread while others read and compact: columns are
+# filled before events leave the recent list, so readers always find each
+# event in one place or the other.
+
+COMPRESS_MIN = 256
+COMPRESS_LEVEL = 1
+# Raw deflate with a 4 KiB window and small hash tables for everything but
+# large outputs: zlib.compress's full-size state costs tens of microseconds
+# to set up per call, far more than compressing a typical output, and the
+# smaller one compresses command output just as well.
+SMALL_WINDOW, SMALL_MEMLEVEL = -12, 4
+LARGE_OUTPUT = 65536
+COMPACT_EVERY = 1024
+
+_MISSING = -(2 ** 63)
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_INT_COLUMNS = ("id", "exit_code", "duration_ms")
+_HEAD_STRINGS = ("type",)
+_TAIL_STRINGS = ("host", "terminal", "cwd", "session")
+_COLUMNS = frozenset(_INT_COLUMNS + _HEAD_STRINGS + _TAIL_STRINGS + ("timestamp", "command", "output"))
+# json.dumps builds a new encoder per call when given separators.
+_encode_rest = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def _pack(text):
+    """text as is when short, else compressed UTF-8 if that is smaller."""
+    if len(text) < COMPRESS_MIN:
+        return text
+    data = text.encode('utf-8')
+    if len(data) < LARGE_OUTPUT:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, SMALL_WINDOW, SMALL_MEMLEVEL)
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    packed = compressor.compress(data) + compressor.flush()
+    return packed if len(packed) < len(text) else text
+
+
+def _unpack(value):
+    return value if isinstance(value, str) else zlib.decompress(value, -15).decode('utf-8')
+
+
+def _micros(timestamp):
+    """timestamp as microseconds since the epoch if it reads back identically, else None."""
+    try:
+        parsed = datetime.datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is not None or parsed.isoformat() != timestamp:
+        return None
+    return (parsed - _EPOCH) // _MICROSECOND
+
+
+class EventStore:
+    """Append-only sequence of events, stored column by column.
+
+    Behaves like the list of event dicts it replaces: len() numbers the
+    next event for build_event, append() adds one, and indexing, slicing
+    and iteration give back dicts, so it can be passed to save_session.
+    compact_every=None leaves all compaction to compact().
+    """
+
+    def __init__(self, events=(), compact_every=COMPACT_EVERY):
+        self._count = 0
+        self._compact_every = compact_every
+        # Events from self._compacted on, as appended.
+        self._recent = []
+        self._compacted = 0
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._ints = {key: array('q') for key in _INT_COLUMNS}
+        self._timestamps = array('q')
+        self._strings = {key: array('l') for key in _HEAD_STRINGS + _TAIL_STRINGS + ("command",)}
+        self._table = [None]
+        self._interned = {}
+        self._outputs = []
+        self._rest = []
+        for event in events:
+            self.append(event)
+
+    def __len__(self):
+        return self._count
+
+    def _intern(self, text):
+        index = self._interned.get(text)
+        if index is None:
+            index = self._interned[text] = len(self._table)
+            self._table.append(text)
+        return index
+
+    def append(self, event):
+        with self._lock:
+            self._recent.append(event)
+            self._count += 1
+        if self._compact_every is not None and len(self._recent) >= self._compact_every:
+            # Another thread compacting will get to these events too.
+            self.compact(blocking=False)
+
+    def compact(self, blocking=True):
+        """Move the events appended since the last call into the columns, compressed.
+
+        With blocking=False, returns at once if another thread is compacting.
+        """
+        if not self._compact_lock.acquire(blocking):
+            return
+        try:
+            with self._lock:
+                events = self._recent[:]
+            for event in events:
+                self._store(event)
+            with self._lock:
+                del self._recent[:len(events)]
+                self._compacted += len(events)
+        finally:
+            self._compact_lock.release()
+
+    def _store(self, event):
+        rest = {key: value for key, value in event.items() if key not in _COLUMNS}
+        for key, column in self._ints.items():
+            value = event.get(key, _MISSING)
+            if type(value) is not int or not _MISSING < value < 2 ** 63:
+                if key in event:
+                    rest[key] = value
+                value = _MISSING
+            column.append(value)
+        for key, column in self._strings.items():
+            value = event.get(key)
+            if type(value) is str:
+                column.append(self._intern(value))
+            else:
+                if key in event:
+                    rest[key] = value
+                column.append(0)
+        timestamp = event.get("timestamp")
+        micros = _micros(timestamp) if type(timestamp) is str else None
+        if micros is None:
+            if "timestamp" in event:
+                rest["timestamp"] = timestamp
+            micros = _MISSING
+        self._timestamps.append(micros)
+        output = event.get("output")
+        if type(output) is str:
+            self._outputs.append(_pack(output))
+        else:
+            if "output" in event:
+                rest["output"] = output
+            self._outputs.append(None)
+        self._rest.append(_pack(_encode_rest(rest)) if rest else None)
+
+    def _event(self, i):
+        with self._lock:
+            if i >= self._compacted:
+                return self._recent[i - self._compacted]
+        rest = self._rest[i]
+        rest = json.loads(_unpack(rest)) if rest is not None else {}
+        event = {}
+        for key in ("id",) + _HEAD_STRINGS:
+            self._column(event, rest, key, i)
+        if self._timestamps[i] != _MISSING:
+            event["timestamp"] = (_EPOCH + self._timestamps[i] * _MICROSECOND).isoformat()
+        elif "timestamp" in rest:
+            event["timestamp"] = rest.pop("timestamp")
+        self._column(event, rest, "command", i)
+        output = self._outputs[i]
+        if output is not None:
+            event["output"] = _unpack(output)
+        elif "output" in rest:
+            event["output"] = rest.pop("output")
+        for key in ("exit_code", "duration_ms"):
+            self._column(event, rest, key, i)
+        tail = {}
+        for key in _TAIL_STRINGS:
+            self._column(tail, rest, key, i)
+        event.update(rest)
+        event.update(tail)
+        return event
+
+    def _column(self, event, rest, key, i):
+        if key in self._ints:
+            value = self._ints[key][i]
+            if value != _MISSING:
+                event[key] = value
+                return
+        else:
+            index = self._strings[key][i]
+            if index:
+                event[key] = self._table[index]
+                return
+        if key in rest:
+            event[key] = rest.pop(key)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._event(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("event index out of range")
+        return self._event(index)
+
+    def __iter__(self):
+        # Events appended while iterating are left for the next pass.
+        for i in range(self._count):
+            yield self._event(i)
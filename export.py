@@ -1,15 +1,303 @@
-from storage import load_session
-
-def export_session(trace_file, output_file):
-    session = load_session(trace_file)
-        
-    with open(output_file, 'w') as f:
-        f.write(f"Iris Report: {session.get('session_id')}\n")
-        f.write("=" * 40 + "\n\n")
-        for event in session.get('events', []):
-            f.write(f"[{event['timestamp']}] $ {event['command']}\n")
-            if event['output']:
-                f.write(f"{event['output']}\n")
-            f.write("\n")
-            
-    print(f"Exported clean text report to {output_file}")
+import os
+import re
+import html
+import json
+import collections
+from storage import open_session, open_event_output
+
+# Events are sent to worker processes in chunks of about this many output
+# characters, with at most JOBS_WINDOW chunks per worker in flight, so memory
+# stays bounded. The pool is only started for traces of POOL_MIN_BYTES or more.
+CHUNK_CHARS = 4 * 1024 * 1024
+JOBS_WINDOW = 2
+POOL_MIN_BYTES = 32 * 1024 * 1024
+# Spilled outputs are copied from their blobs in pieces of this many characters.
+COPY_CHARS = 1024 * 1024
+
+
+def _has_output(event):
+    # An output spilled to a blob is streamed in even when its excerpt is empty.
+    return bool(event.get('output') or event.get('output_blob'))
+
+
+class TextExporter:
+    """Plain text report; every exporter writes an event as open + escaped output + close."""
+
+    name = "text"
+
+    def header(self, info):
+        return f"Iris Report: {info.get('session_id')}\n" + "=" * 40 + "\n\n"
+
+    def open_event(self, event):
+        return f"[{event['timestamp']}] $ {event['command']}\n"
+
+    def escape(self, text):
+        return text
+
+    def close_event(self, event):
+        return "\n\n" if _has_output(event) else "\n"
+
+    def footer(self, count, errors):
+        return ""
+
+
+class MarkdownExporter(TextExporter):
+    name = "markdown"
+
+    def header(self, info):
+        return (f"# Iris Report: {info.get('session_id')}\n\n"
+                f"- Host: {info.get('hostname')}\n"
+                f"- Started: {info.get('start_time')}\n\n")
+
+    def open_event(self, event):
+        command = f"$ {event['command']}"
+        code = f"`` {command} ``" if '`' in command else f"`{command}`"
+        line = (f"### {code}\n\n"
+                f"{event.get('timestamp')} · exit {event.get('exit_code')} · {event.get('duration_ms', 0)} ms\n\n")
+        return line + "~~~~text\n" if _has_output(event) else line
+
+    def close_event(self, event):
+        return "\n~~~~\n\n" if _has_output(event) else ""
+
+    def footer(self, count, errors):
+        return f"---\n\n{count} commands, {errors} with errors.\n"
+
+
+HTML_STYLE = """
+body { font-family: -apple-system, Segoe UI, sans-serif; margin: 2em auto; max-width: 72em; color: #222; }
+h1 { font-size: 1.4em; } .meta { color: #666; }
+details, div.event { border-left: 4px solid #3a3; margin: .4em 0; padding: .2em .6em; background: #f7f7f7; }
+.err { border-left-color: #c33; }
+summary { cursor: pointer; } code { font-size: 1em; }
+.ts { color: #888; font-size: .85em; margin-right: .6em; } .exit { color: #888; font-size: .85em; margin-left: .6em; }
+pre { white-space: pre-wrap; word-break: break-all; background: #fff; padding: .6em; margin: .4em 0; }
+"""
+
+
+class HtmlExporter(TextExporter):
+    """Self-contained HTML page; outputs are collapsed under their command."""
+
+    name = "html"
+
+    def header(self, info):
+        title = html.escape(f"Iris Report: {info.get('session_id')}")
+        return (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{title}</title>"
+                f"<style>{HTML_STYLE}</style></head><body>\n<h1>{title}</h1>\n"
+                f"<p class=\"meta\">Host {html.escape(str(info.get('hostname')))} · "
+                f"started {html.escape(str(info.get('start_time')))}</p>\n")
+
+    def open_event(self, event):
+        cls = "err" if event.get('exit_code', 0) != 0 else "ok"
+        line = (f"<span class=\"ts\">{html.escape(str(event.get('timestamp')))}</span>"
+                f"<code>$ {html.escape(event['command'])}</code>"
+                f"<span class=\"exit\">exit {event.get('exit_code')} · {event.get('duration_ms', 0)} ms</span>")
+        if _has_output(event):
+            return f"<details class=\"{cls}\"><summary>{line}</summary><pre>"
+        return f"<div class=\"event {cls}\">{line}</div>\n"
+
+    def escape(self, text):
+        return html.escape(text, quote=False)
+
+    def close_event(self, event):
+        return "</pre></details>\n" if _has_output(event) else ""
+
+    def footer(self, count, errors):
+        return f"<p class=\"meta\">{count} commands, {errors} with errors.</p>\n</body></html>\n"
+
+
+class JsonlExporter(TextExporter):
+    """One JSON object per event with the full output inlined, for log pipelines."""
+
+    name = "jsonl"
+
+    def __init__(self):
+        self.session_id = None
+
+    def header(self, info):
+        self.session_id = info.get('session_id')
+        return ""
+
+    def open_event(self, event):
+        record = {k: v for k, v in event.items() if k not in ('output', 'output_blob', 'timing')}
+        record['session_id'] = self.session_id
+        # The output string is streamed in after the other fields.
+        return json.dumps(record)[:-1] + ', "output": "'
+
+    def escape(self, text):
+        return json.dumps(text)[1:-1]
+
+    def close_event(self, event):
+        return '"}\n'
+
+    def footer(self, count, errors):
+        return ""
+
+
+EXPORTERS = {cls.name: cls for cls in (TextExporter, MarkdownExporter, HtmlExporter, JsonlExporter)}
+EXTENSIONS = {".md": "markdown", ".markdown": "markdown", ".html": "html", ".htm": "html",
+              ".jsonl": "jsonl", ".ndjson": "jsonl", ".trace": "trace"}
+
+
+def _format_events(fmt, session_id, events):
+    """Format a chunk of events with inline outputs (runs in worker processes)."""
+    exporter = EXPORTERS[fmt]()
+    exporter.header({"session_id": session_id})
+    return "".join(exporter.open_event(e) + exporter.escape(e.get('output') or '') + exporter.close_event(e)
+                   for e in events)
+
+
+class _Writer:
+    """Writes formatted chunks in order, formatting them on a process pool if given."""
+
+    def __init__(self, f, fmt, session_id, jobs):
+        self.f = f
+        self.fmt = fmt
+        self.session_id = session_id
+        self.pool = None
+        self.window = collections.deque()
+        if jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(max_workers=jobs)
+            self.max_window = jobs * JOBS_WINDOW
+        self.chunk = []
+        self.chunk_chars = 0
+
+    def add(self, event):
+        self.chunk.append(event)
+        self.chunk_chars += len(event.get('output') or '') + 256
+        if self.chunk_chars >= CHUNK_CHARS:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        if not self.chunk:
+            return
+        if self.pool is None:
+            self.f.write(_format_events(self.fmt, self.session_id, self.chunk))
+        else:
+            while len(self.window) >= self.max_window:
+                self.f.write(self.window.popleft().result())
+            self.window.append(self.pool.submit(_format_events, self.fmt, self.session_id, self.chunk))
+        self.chunk = []
+        self.chunk_chars = 0
+
+    def drain(self):
+        """Write everything queued so far, so the caller can write directly."""
+        self.flush_chunk()
+        while self.window:
+            self.f.write(self.window.popleft().result())
+
+    def close(self):
+        self.drain()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def export_format(output_file, fmt=None):
+    if fmt:
+        return fmt
+    return EXTENSIONS.get(os.path.splitext(output_file)[1].lower(), "text")
+
+
+def export_trace(session, events, output_file):
+    """Write events as a standalone streamed trace, with copies of the output blobs they reference.
+
+    Returns (events written, failed commands).
+    """
+    import datetime
+    from storage import TraceWriter, copy_blob
+
+    header = session.header
+    start = datetime.datetime.fromisoformat(header['start_time'])
+    writer = TraceWriter(output_file, header.get('session_id'), start, hostname=header.get('hostname'),
+                         buffered=True)
+    errors = 0
+    last_id = 0
+    try:
+        for event in events:
+            copy_blob(session.trace_file, output_file, event)
+            # Readers rely on ids increasing through a trace; an event that
+            # would break that is renumbered and keeps its id as source_id.
+            if not isinstance(event.get('id'), int) or event['id'] <= last_id:
+                event.setdefault('source_id', event.get('id'))
+                event['id'] = last_id + 1
+            last_id = event['id']
+            writer.append(event)
+            errors += event.get('exit_code', 0) != 0
+    finally:
+        writer.close(datetime.datetime.fromisoformat(session.end_time or header['start_time']))
+    return len(writer), errors
+
+
+def export_session(trace_file, output_file, bounds=None, fmt=None, errors_only=False, grep=None, jobs=None,
+                   session_id=None):
+    """Stream a trace into a text, Markdown, HTML or JSON Lines report, or a standalone .trace.
+
+    Events can be limited to failed commands, a range (bounds) and commands
+    matching the grep regex. Outputs spilled to blobs are copied in pieces,
+    so memory stays bounded whatever the trace size. jobs=None formats on
+    a process pool only for large traces; jobs=1 keeps everything in this
+    process. A session database can be exported whole or one session at a
+    time; a .trace always holds one session (the latest unless session_id
+    is given).
+    """
+    fmt = export_format(output_file, fmt)
+    pattern = re.compile(grep) if grep else None
+    if os.path.abspath(output_file) == os.path.abspath(trace_file):
+        print(f"Error: {output_file} is the file being exported.")
+        return
+
+    session = open_session(trace_file, session_id)
+    filters = dict(bounds or {})
+    if session.format == "sqlite":
+        if fmt == "trace" and session_id is None:
+            latest = session.latest_session()
+            if latest is None:
+                print(f"Error: {trace_file} holds no sessions.")
+                return
+            session_id, row = latest
+            print(f"Exporting the latest session, {session_id} (choose another with --session).")
+            session = open_session(trace_file, row)
+        # The database applies these with its indexes, before reading any output.
+        filters.update(failed_only=errors_only, command_regex=grep)
+
+    def selected():
+        for event in session.events(**filters):
+            if errors_only and event.get('exit_code', 0) == 0:
+                continue
+            if pattern is not None and not pattern.search(event.get('command', '')):
+                continue
+            yield event
+
+    if fmt == "trace":
+        count, errors = export_trace(session, selected(), output_file)
+        print(f"Exported {count} events as a trace to {output_file}")
+        return
+
+    exporter = EXPORTERS[fmt]()
+    if jobs is None:
+        jobs = (os.cpu_count() or 1) if os.path.getsize(trace_file) >= POOL_MIN_BYTES else 1
+    count = errors = 0
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(exporter.header(session.header))
+        writer = _Writer(f, fmt, session.header.get('session_id'), jobs)
+        try:
+            for event in selected():
+                count += 1
+                errors += event.get('exit_code', 0) != 0
+                if not event.get('output_blob'):
+                    writer.add(event)
+                    continue
+                writer.drain()
+                f.write(exporter.open_event(event))
+                with open_event_output(trace_file, event) as out:
+                    while True:
+                        text = out.read(COPY_CHARS)
+                        if not text:
+                            break
+                        f.write(exporter.escape(text))
+                f.write(exporter.close_event(event))
+        finally:
+            writer.close()
+        f.write(exporter.footer(count, errors))
+
+    print(f"Exported {count} events as {fmt} to {output_file}")
@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import math
+import zlib
+from collections import Counter
+from storage import open_session, open_event_output, write_json
+
+# The index lives next to the traces it covers, in <dir>/.iris-index/:
+#   manifest.json      trace path -> file id, mtime and size at index time
+#   postings-NN.json   token -> {file id: [event id, term count, event id, ...]}
+#   docs/<fid>.json    per-trace event metadata used to print hits
+INDEX_DIRNAME = ".iris-index"
+INDEX_VERSION = 1
+NUM_SHARDS = 64
+MAX_TOKEN_LEN = 64
+SNIPPET_LEN = 200
+
+TOKEN_RE = re.compile(r'[a-z0-9_]+')
+
+
+def tokenize(text):
+    """Split text into lower-case word tokens."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) <= MAX_TOKEN_LEN]
+
+
+def _shard_of(token):
+    return zlib.crc32(token.encode('utf-8')) % NUM_SHARDS
+
+
+def _index_dir(directory):
+    return os.path.join(directory, INDEX_DIRNAME)
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def find_traces(directory):
+    """Map each trace under directory (relative path) to its (mtime, size)."""
+    traces = {}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d != INDEX_DIRNAME]
+        for name in files:
+            if name.endswith((".trace", ".tracez")):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                traces[os.path.relpath(path, directory)] = (st.st_mtime, st.st_size)
+    return traces
+
+
+def _load_manifest(directory):
+    manifest = _read_json(os.path.join(_index_dir(directory), "manifest.json"), None)
+    if not manifest or manifest.get("version") != INDEX_VERSION:
+        manifest = {"version": INDEX_VERSION, "next_fid": 1, "files": {}}
+    return manifest
+
+
+def _stale_entries(manifest, traces):
+    files = manifest["files"]
+    removed = [rel for rel in files if rel not in traces]
+    changed = [rel for rel, (mtime, size) in traces.items()
+               if rel not in files or files[rel]["mtime"] != mtime or files[rel]["size"] != size]
+    return removed, changed
+
+
+def _index_trace(directory, rel):
+    """(docs, postings) of one trace: event id -> [timestamp, exit code, command], token -> [eid, tf, ...]."""
+    session = open_session(os.path.join(directory, rel))
+    docs = {}
+    file_postings = {}
+    for event in session.events():
+        eid = event.get('id')
+        command = event.get('command', '')
+        counts = Counter(tokenize(command))
+        if event.get('output_blob'):
+            with open_event_output(os.path.join(directory, rel), event) as out:
+                for line in out:
+                    counts.update(tokenize(line))
+        else:
+            counts.update(tokenize(event.get('output', '')))
+        for token, tf in counts.items():
+            hits = file_postings.get(token)
+            if hits is None:
+                hits = file_postings[token] = []
+            hits.append(eid)
+            hits.append(tf)
+        docs[str(eid)] = [event.get('timestamp'), event.get('exit_code'), command[:SNIPPET_LEN]]
+    return docs, file_postings
+
+
+def build_index(directory, verbose=True):
+    """Create or incrementally update the token index for a directory of traces."""
+    index_dir = _index_dir(directory)
+    os.makedirs(os.path.join(index_dir, "docs"), exist_ok=True)
+
+    manifest = _load_manifest(directory)
+    traces = find_traces(directory)
+    removed, changed = _stale_entries(manifest, traces)
+    if not removed and not changed:
+        if verbose:
+            print(f"Index for {directory} is up to date ({len(traces)} traces).")
+        return manifest
+
+    dropped_fids = set()
+    # Shards holding postings of the dropped traces; only these and the ones
+    # new postings go to are rewritten. Entries from before shards were
+    # recorded may be anywhere.
+    touched = set()
+    for rel in removed + changed:
+        entry = manifest["files"].pop(rel, None)
+        if entry:
+            dropped_fids.add(str(entry["fid"]))
+            touched.update(entry.get("shards", range(NUM_SHARDS)))
+            try:
+                os.remove(os.path.join(index_dir, "docs", f"{entry['fid']}.json"))
+            except OSError:
+                pass
+
+    additions = [dict() for _ in range(NUM_SHARDS)]
+    shard_of = {}
+    skipped = 0
+    for rel in changed:
+        fid = str(manifest["next_fid"])
+        manifest["next_fid"] += 1
+        mtime, size = traces[rel]
+        try:
+            docs, file_postings = _index_trace(directory, rel)
+        except (OSError, ValueError) as e:
+            # Kept in the manifest so it is only read again once it changes.
+            print(f"Warning: skipping {rel}: {e}")
+            skipped += 1
+            manifest["files"][rel] = {"fid": int(fid), "mtime": mtime, "size": size, "events": 0, "shards": []}
+            continue
+        shards = set()
+        for token, hits in file_postings.items():
+            shard = shard_of.get(token)
+            if shard is None:
+                shard = shard_of[token] = _shard_of(token)
+            shards.add(shard)
+            additions[shard].setdefault(token, {})[fid] = hits
+        touched.update(shards)
+        write_json(os.path.join(index_dir, "docs", f"{fid}.json"), {"path": rel, "events": docs})
+        manifest["files"][rel] = {"fid": int(fid), "mtime": mtime, "size": size, "events": len(docs),
+                                  "shards": sorted(shards)}
+
+    for shard in sorted(touched):
+        path = os.path.join(index_dir, f"postings-{shard:02d}.json")
+        postings = _read_json(path, {})
+        if dropped_fids:
+            for token in list(postings):
+                by_file = postings[token]
+                for fid in dropped_fids.intersection(by_file):
+                    del by_file[fid]
+                if not by_file:
+                    del postings[token]
+        for token, by_file in additions[shard].items():
+            postings.setdefault(token, {}).update(by_file)
+        write_json(path, postings)
+
+    manifest["total_events"] = sum(e["events"] for e in manifest["files"].values())
+    write_json(os.path.join(index_dir, "manifest.json"), manifest)
+    if verbose:
+        unreadable = f", skipped {skipped} unreadable" if skipped else ""
+        print(f"Indexed {len(changed) - skipped} new or changed traces{unreadable}, dropped {len(removed)} "
+              f"({len(traces)} traces, {manifest['total_events']} events) in {index_dir}")
+    return manifest
+
+
+def query_index(directory, query, limit=20):
+    """Return ranked hits for query as (score, trace path, event id, doc info) tuples."""
+    manifest = _load_manifest(directory)
+    traces = find_traces(directory)
+    removed, changed = _stale_entries(manifest, traces)
+    if removed or changed or not manifest["files"]:
+        manifest = build_index(directory, verbose=False)
+
+    tokens = sorted(set(tokenize(query)))
+    if not tokens:
+        return []
+
+    index_dir = _index_dir(directory)
+    total = max(1, manifest.get("total_events", 0))
+    shards = {}
+    scores = None
+    for token in tokens:
+        shard = _shard_of(token)
+        if shard not in shards:
+            shards[shard] = _read_json(os.path.join(index_dir, f"postings-{shard:02d}.json"), {})
+        by_file = shards[shard].get(token, {})
+        df = sum(len(hits) for hits in by_file.values()) // 2
+        if not df:
+            return []
+        idf = math.log(1 + total / df)
+        token_scores = {}
+        for fid, hits in by_file.items():
+            for i in range(0, len(hits), 2):
+                token_scores[(fid, hits[i])] = (1 + math.log(hits[i + 1])) * idf
+        # Every query token must appear in a hit.
+        if scores is None:
+            scores = token_scores
+        else:
+            scores = {key: s + token_scores[key] for key, s in scores.items() if key in token_scores}
+        if not scores:
+            return []
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], int(item[0][0]), item[0][1] or 0))
+    hits = []
+    docs = {}
+    for (fid, eid), score in ranked[:limit]:
+        if fid not in docs:
+            docs[fid] = _read_json(os.path.join(index_dir, "docs", f"{fid}.json"), {"events": {}})
+        info = docs[fid]["events"].get(str(eid), [None, None, ""])
+        hits.append((score, os.path.join(directory, docs[fid].get("path", "")), eid, info))
+    return hits
@@ -5,15 +5,9 @@ import os
 # Make imports work from any directory
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-import argparse
-import platform
-from storage import save_session, load_session
-from search import search_session
-from replay import replay_session
-from summary import summarize_session
-from export import export_session
-from daemon import run_daemon
-from runner import run_single_command
+# Subcommand modules are imported only when their subcommand runs, so each
+# invocation pays for what it uses. 'iris run' skips argparse entirely; see
+# benchmarks/startup_bench.py for the budget this is held to.
 
 # Signal directory for cross-terminal communication
 SIGNAL_DIR = os.path.join(os.path.expanduser("~"), ".iris")
@@ -21,14 +15,14 @@ STOP_SIGNAL = os.path.join(SIGNAL_DIR, "stop.signal")
 RECORDING_LOCK = os.path.join(SIGNAL_DIR, "recording.lock")
 DAEMON_PORT_FILE = os.path.join(SIGNAL_DIR, "daemon.port")
 
-def start_daemon():
+def start_daemon(transport=None, metrics_port=None, listen=None, upstream=None):
     """Start the central iris daemon for multi-terminal recording."""
-    run_daemon()
+    from daemon import run_daemon
+    run_daemon(transport, metrics_port, listen, upstream)
 
 
 def record_session():
-    os_name = platform.system()
-    if os_name == "Windows":
+    if sys.platform == "win32":
         try:
             from recorder_windows import record
         except ImportError:
@@ -36,11 +30,12 @@ def record_session():
             print("Please install it using: pip install pywinpty")
             sys.exit(1)
         record()
-    elif os_name in ("Linux", "Darwin"):
+    elif sys.platform.startswith("linux") or sys.platform == "darwin":
         from recorder_unix import record
         record()
     else:
-        print(f"Unsupported OS: {os_name}")
+        import platform
+        print(f"Unsupported OS: {platform.system()}")
         sys.exit(1)
 
 def stop_recording():
@@ -49,61 +44,268 @@ def stop_recording():
     if not os.path.exists(RECORDING_LOCK) and not os.path.exists(DAEMON_PORT_FILE):
         print("No active iris recording found.")
         return
+    if os.path.exists(DAEMON_PORT_FILE):
+        from live import stop_daemon
+        if stop_daemon():
+            return
+    # Single-terminal recordings, and daemons that cannot be reached, poll for this file.
     with open(STOP_SIGNAL, 'w') as f:
         f.write("stop")
     print("Stop signal sent. Recording will save and exit shortly.")
 
+def add_range_args(p):
+    p.add_argument("--from", dest="start", help="First event to include: an event id or an ISO timestamp")
+    p.add_argument("--to", dest="end", help="Last event to include: an event id or an ISO timestamp")
+
+def add_session_arg(p):
+    p.add_argument("--session", help="Only this session of a session database (a session id)")
+
+def trace_or_database(path):
+    """The trace a read command works on: path, or the session database with IRIS_STORAGE=sqlite."""
+    if path is not None:
+        return path
+    from storage import STORAGE_BACKEND, DATABASE_PATH
+    if STORAGE_BACKEND != "sqlite":
+        print("Error: please give a trace file (or set IRIS_STORAGE=sqlite to use the session database).")
+        sys.exit(1)
+    return DATABASE_PATH
+
+def convert_trace(src, dst, fmt=None, codec="zlib", delta=None):
+    """Convert a trace between the streamed, compressed and legacy JSON formats."""
+    from storage import convert_session, is_database
+    if is_database(src):
+        print(f"Error: {src} is a session database; use 'iris export {src} --session ID --output {dst}'.")
+        sys.exit(1)
+    if fmt is None:
+        fmt = "sqlite" if is_database(dst) else "compressed" if dst.endswith(".tracez") else "stream"
+    count = convert_session(src, dst, fmt, codec, delta)
+    print(f"Converted {count} events from {src} to {dst} ({fmt})")
+
+def run_command(cmd_args):
+    if not cmd_args:
+        print("Error: Please provide a command to run. (e.g., 'iris run python script.py')")
+        sys.exit(1)
+    from runner import run_single_command
+    run_single_command(cmd_args)
+
+def run_batch_file(path, jobs, cmd_args, fail_fast, buffered):
+    if cmd_args:
+        print("Error: a batch takes its commands from --file or stdin, not the command line.")
+        sys.exit(1)
+    if jobs is not None and jobs < 1:
+        print("Error: --jobs must be at least 1.")
+        sys.exit(1)
+    from runner import read_commands, run_batch
+    if path in (None, "-"):
+        commands = read_commands(sys.stdin)
+    else:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                commands = read_commands(f)
+        except OSError as e:
+            print(f"Error: cannot read {path}: {e.strerror}")
+            sys.exit(1)
+    if not commands:
+        print("Error: no commands to run.")
+        sys.exit(1)
+    sys.exit(run_batch(commands, jobs or 1, fail_fast, buffered))
+
 def main():
+    argv = sys.argv[1:]
+    profile = bool(argv) and argv[0] == "--profile"
+    if profile:
+        argv = argv[1:]
+    if profile or os.environ.get("IRIS_PROFILE", "") not in ("", "0"):
+        import metrics
+        metrics.profile_on_exit()
+    # Fast path: 'iris run CMD...' takes everything after 'run' verbatim.
+    # Options before the command (a batch, or --help) go through argparse.
+    if len(argv) >= 2 and argv[0] == "run" and not argv[1].startswith("-"):
+        run_command(argv[1:])
+        return
+
+    import argparse
     parser = argparse.ArgumentParser(description="iris: a terminal session recorder that creates searchable debugging artifacts.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print hot-path timings and counters on exit (also IRIS_PROFILE=1)")
     subparsers = parser.add_subparsers(dest="action", required=True)
     
-    subparsers.add_parser("start", help="Start the background daemon for multi-terminal recording")
+    start_p = subparsers.add_parser("start", help="Start the background daemon for multi-terminal recording")
+    start_p.add_argument("--unix", action="store_true", help="Listen on a Unix domain socket instead of localhost TCP")
+    start_p.add_argument("--metrics-port", type=int, default=os.environ.get("IRIS_METRICS_PORT"),
+                         help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    start_p.add_argument("--listen", metavar="[HOST:]PORT",
+                         help="Also accept events from other hosts on this address (e.g. from relaying daemons)")
+    start_p.add_argument("--upstream", metavar="[HOST:]PORT", default=os.environ.get("IRIS_UPSTREAM"),
+                         help="Relay every recorded event to the daemon listening there")
     subparsers.add_parser("shell", help="Attach current terminal to the running daemon session")
     subparsers.add_parser("record", help="Alias for 'shell' (for backwards compatibility)")
+    init_p = subparsers.add_parser("shell-init", help="Print shell integration for exact command boundaries and exit codes")
+    init_p.add_argument("shell", nargs="?", choices=["bash", "zsh"], help="Shell to integrate (default: $SHELL)")
     subparsers.add_parser("stop", help="Stop a multi-terminal recording from any terminal")
+    subparsers.add_parser("status", help="Show events and attached terminals of the running daemon")
+    tail_p = subparsers.add_parser("tail", help="Show the latest events of the running daemon")
+    tail_p.add_argument("-n", "--lines", type=int, default=10, help="Number of recent events to show")
+    tail_p.add_argument("-f", "--follow", action="store_true", help="Keep printing events as they arrive")
+    tail_p.add_argument("--output", action="store_true", help="Also print each command's output")
+    subparsers.add_parser("flush", help="Write the running daemon's events to its journal on disk now")
     
-    run_p = subparsers.add_parser("run", help="Run a single command/file and record it")
+    run_p = subparsers.add_parser("run", help="Run a single command/file and record it, or a batch of commands")
+    run_p.add_argument("-f", "--file", help="Run a batch: one shell command per line of FILE ('-' for stdin)")
+    run_p.add_argument("-j", "--jobs", type=int, help="Run a batch N commands at a time (commands from stdin "
+                                                       "without --file)")
+    failure = run_p.add_mutually_exclusive_group()
+    failure.add_argument("--fail-fast", action="store_true",
+                         help="Stop the batch at the first failure, terminating running commands")
+    failure.add_argument("--keep-going", dest="fail_fast", action="store_false",
+                         help="Run every command of the batch whatever fails (default)")
+    run_p.add_argument("--buffer", action="store_true",
+                       help="Print each batch command's output when it finishes instead of as prefixed lines")
     run_p.add_argument("cmd", nargs=argparse.REMAINDER, help="The command to run (e.g., 'python script.py')")
     
     search_p = subparsers.add_parser("search", help="Search through a recorded session")
     search_p.add_argument("query", help="Text to search for")
-    search_p.add_argument("file", help="Trace file to search in (.trace)")
+    search_p.add_argument("file", nargs="?", help="Trace file or session database to search in, or a directory "
+                                                  "of traces (default: the session the daemon is recording, "
+                                                  "else the database with IRIS_STORAGE=sqlite)")
+    search_p.add_argument("--limit", type=int, help="Maximum hits (default 20 for a directory)")
+    add_range_args(search_p)
+    add_session_arg(search_p)
+
+    index_p = subparsers.add_parser("index", help="Build or update the search index for a directory of traces")
+    index_p.add_argument("directory", nargs="?", default=".", help="Directory containing .trace or .tracez files")
     
     replay_p = subparsers.add_parser("replay", help="Replay a session in terminal")
-    replay_p.add_argument("file", help="Trace file to replay")
+    replay_p.add_argument("file", help="Trace file or session database to replay")
+    replay_p.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier (e.g. 2 plays twice as fast)")
+    replay_p.add_argument("--max-idle", type=float, default=2.0, help="Longest pause to replay, in seconds")
+    add_range_args(replay_p)
+    add_session_arg(replay_p)
     
     summary_p = subparsers.add_parser("summary", help="Show summary of a session")
-    summary_p.add_argument("file", help="Trace file to analyze")
+    summary_p.add_argument("file", nargs="?", help="Trace file or session database to analyze, or a directory "
+                                                   "of traces to aggregate (default: the database with "
+                                                   "IRIS_STORAGE=sqlite)")
+    summary_p.add_argument("--top", type=int, default=10, help="Rows to show in each ranking")
+    add_session_arg(summary_p)
     
-    export_p = subparsers.add_parser("export", help="Export as clean shareable text")
-    export_p.add_argument("file", help="Trace file to export")
-    export_p.add_argument("--output", required=True, help="Output text file path")
+    export_p = subparsers.add_parser("export", help="Export as a clean shareable report (text, Markdown, HTML or JSON Lines) or trace")
+    export_p.add_argument("file", nargs="?", help="Trace file or session database to export "
+                                                  "(default: the database with IRIS_STORAGE=sqlite)")
+    export_p.add_argument("--output", required=True, help="Output file path (.md, .html, .jsonl and .trace pick the format)")
+    export_p.add_argument("--format", choices=["text", "markdown", "html", "jsonl", "trace"], help="Report format")
+    export_p.add_argument("--errors-only", action="store_true", help="Only export commands that failed")
+    export_p.add_argument("--grep", help="Only export commands matching this regular expression")
+    export_p.add_argument("--jobs", type=int, help="Worker processes for formatting (default: all CPUs for large traces)")
+    add_range_args(export_p)
+    add_session_arg(export_p)
+
+    convert_p = subparsers.add_parser("convert", help="Convert a trace between formats")
+    convert_p.add_argument("input", help="Trace file to read")
+    convert_p.add_argument("output", help="Trace file to write (.tracez defaults to the compressed format, "
+                                          ".db adds the session to a session database)")
+    convert_p.add_argument("--format", choices=["stream", "compressed", "json", "sqlite"], help="Output format")
+    convert_p.add_argument("--codec", choices=["zlib", "lzma"], default="zlib", help="Compression codec for the compressed format")
+    convert_p.add_argument("--delta", action="store_true", default=None,
+                           help="Store repeated outputs as line diffs (default: same as the input)")
+    convert_p.add_argument("--no-delta", dest="delta", action="store_false", help="Store every output in full")
+
+    merge_p = subparsers.add_parser("merge", help="Merge traces from several hosts or sessions into one, ordered by time")
+    merge_p.add_argument("inputs", nargs="+", help="Trace files or session databases to merge")
+    merge_p.add_argument("--output", required=True, help="Trace file to write (.tracez compresses, "
+                                                         ".db adds the merged session to a session database)")
+    merge_p.add_argument("--window", type=int, default=64,
+                         help="Events each input may be out of timestamp order by (default 64)")
+    merge_p.add_argument("--codec", choices=["zlib", "lzma"], default="zlib", help="Compression codec for .tracez")
+
+    diff_p = subparsers.add_parser("diff", help="Show how the output of one event differs from another's")
+    diff_p.add_argument("file", help="Trace file")
+    diff_p.add_argument("first", type=int, help="Event id of the old output")
+    diff_p.add_argument("second", type=int, help="Event id of the new output")
+    diff_p.add_argument("-U", "--context", type=int, default=3, help="Lines of context around changes")
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     if args.action == "start":
-        start_daemon()
+        if args.unix and args.listen:
+            print("Error: --listen needs a TCP socket; drop --unix.")
+            sys.exit(1)
+        start_daemon("unix" if args.unix else None, args.metrics_port, args.listen, args.upstream)
     elif args.action in ("shell", "record"):
         if not os.path.exists(DAEMON_PORT_FILE):
             print("No background daemon found.")
             print("Run 'iris start' first in a terminal, then run 'iris shell' in any terminal you want to record.")
             sys.exit(1)
         record_session()
+    elif args.action == "shell-init":
+        from shell_integration import init_script
+        try:
+            print(init_script(args.shell), end="")
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
     elif args.action == "stop":
         stop_recording()
+    elif args.action == "status":
+        from live import show_status
+        show_status() or sys.exit(1)
+    elif args.action == "tail":
+        from live import tail_events
+        tail_events(args.lines, args.follow, args.output) or sys.exit(1)
+    elif args.action == "flush":
+        from live import flush_daemon
+        flush_daemon() or sys.exit(1)
     elif args.action == "run":
-        if not args.cmd:
-            print("Error: Please provide a command to run. (e.g., 'iris run python script.py')")
-            sys.exit(1)
-        run_single_command(args.cmd)
+        if args.file is None and args.jobs is None:
+            run_command(args.cmd)
+        else:
+            run_batch_file(args.file, args.jobs, args.cmd, args.fail_fast, args.buffer)
     elif args.action == "search":
-        search_session(args.file, args.query)
+        if args.file is None and (os.path.exists(DAEMON_PORT_FILE)
+                                  or os.environ.get("IRIS_STORAGE", "").strip().lower() != "sqlite"):
+            if args.session is not None:
+                print("Error: --session needs a session database; the daemon records a single session.")
+                sys.exit(1)
+            from storage import event_range
+            from live import search_live
+            search_live(args.query, args.limit, event_range(args.start, args.end)) or sys.exit(1)
+        elif args.file is not None and os.path.isdir(args.file):
+            from search import search_directory
+            search_directory(args.file, args.query, args.limit or 20)
+        else:
+            from storage import event_range
+            from search import search_session
+            search_session(trace_or_database(args.file), args.query, event_range(args.start, args.end),
+                           args.session, args.limit)
+    elif args.action == "index":
+        from index import build_index
+        build_index(args.directory)
     elif args.action == "replay":
-        replay_session(args.file)
+        if args.speed <= 0:
+            print("Error: --speed must be greater than 0.")
+            sys.exit(1)
+        from storage import event_range
+        from replay import replay_session
+        replay_session(args.file, event_range(args.start, args.end), args.speed, args.max_idle, args.session)
     elif args.action == "summary":
-        summarize_session(args.file)
+        from summary import summarize_session, summarize_directory
+        if args.file is not None and os.path.isdir(args.file):
+            summarize_directory(args.file, args.top)
+        else:
+            summarize_session(trace_or_database(args.file), args.top, args.session)
     elif args.action == "export":
-        export_session(args.file, args.output)
+        from storage import event_range
+        from export import export_session
+        export_session(trace_or_database(args.file), args.output, event_range(args.start, args.end), args.format,
+                       args.errors_only, args.grep, args.jobs, args.session)
+    elif args.action == "convert":
+        convert_trace(args.input, args.output, args.format, args.codec, args.delta)
+    elif args.action == "merge":
+        from merge import merge_traces
+        merge_traces(args.inputs, args.output, max(0, args.window), args.codec)
+    elif args.action == "diff":
+        from delta import diff_events
+        diff_events(args.file, args.first, args.second, args.context)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,101 @@
+import os
+from client import DAEMON_PORT_FILE, daemon_request
+
+# Commands that talk to a running daemon over its control channel.
+
+
+def _print_event(event, show_output=True):
+    where = event.get('terminal') or '?'
+    print(f"[{event.get('timestamp')}] {where} Event #{event.get('id')} (Exit: {event.get('exit_code')})")
+    print(f"$ {event.get('command', '')}")
+    if show_output and event.get('output'):
+        print(event['output'])
+    elif show_output and event.get('output_blob'):
+        print(f"(output spilled to {event['output_blob']})")
+    print("-" * 40)
+
+
+def _no_daemon():
+    print("No running iris daemon found. Start one with 'iris start'.")
+    return False
+
+
+def show_status():
+    if not os.path.exists(DAEMON_PORT_FILE):
+        return _no_daemon()
+    try:
+        status = next(daemon_request("status"))
+    except (OSError, StopIteration):
+        return _no_daemon()
+    mb = status['bytes'] / (1024 * 1024)
+    print(f"Session {status['session_id']} (daemon pid {status['pid']}), up {status['uptime_s']:.0f}s")
+    print(f"  Events:     {status['events']} ({mb:.1f} MB ingested, {status['journaled']} journaled)")
+    if status.get('malformed'):
+        print(f"  Malformed:  {status['malformed']} lines ignored")
+    print(f"  Trace file: {status['trace_file']}")
+    if status.get('upstream'):
+        backlog = status['events'] - status['relayed']
+        print(f"  Upstream:   {status['upstream']} ({status['relayed']} relayed, {backlog} pending)")
+    if status['subscribers']:
+        print(f"  Tailing:    {status['subscribers']} client(s)")
+    if not status['terminals']:
+        print("  No terminals have sent events yet.")
+    for t in status['terminals']:
+        state = "attached" if t['connections'] else "detached"
+        print(f"  {t['terminal']:<20}{t['events']:>8} events  {state}")
+    return True
+
+
+def tail_events(last=10, follow=False, show_output=False):
+    if not os.path.exists(DAEMON_PORT_FILE):
+        return _no_daemon()
+    try:
+        for reply in daemon_request("tail", timeout=None if follow else 5.0, last=last, follow=follow):
+            _print_event(reply['event'], show_output)
+    except KeyboardInterrupt:
+        pass
+    except OSError:
+        return _no_daemon()
+    return True
+
+
+def search_live(query, limit=None, bounds=None):
+    """Search the running session; bounds are events() bounds (see storage.event_range)."""
+    if not os.path.exists(DAEMON_PORT_FILE):
+        return _no_daemon()
+    print(f"Searching for '{query}' in the running session...\n")
+    try:
+        for reply in daemon_request("search", timeout=30.0, query=query, limit=limit, **(bounds or {})):
+            if reply['type'] == 'event':
+                _print_event(reply['event'])
+            else:
+                print(f"Found {reply['count']} matching events.")
+    except OSError:
+        return _no_daemon()
+    return True
+
+
+def flush_daemon():
+    if not os.path.exists(DAEMON_PORT_FILE):
+        return _no_daemon()
+    try:
+        reply = next(daemon_request("flush", timeout=30.0))
+    except (OSError, StopIteration):
+        return _no_daemon()
+    if reply['type'] == 'error':
+        print(f"Error: {reply['message']}")
+        return False
+    print(f"Flushed {reply['events']} events to {reply['journal']}")
+    return True
+
+
+def stop_daemon(timeout=60.0):
+    """Ask the daemon to stop and wait until it has saved; False if it cannot be reached."""
+    if not os.path.exists(DAEMON_PORT_FILE):
+        return False
+    try:
+        reply = next(daemon_request("stop", timeout=timeout))
+    except (OSError, StopIteration):
+        return False
+    print(f"Recording stopped. {reply['events']} events saved to {reply['trace_file']}")
+    return True
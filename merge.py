@@ -0,0 +1,132 @@
+import os
+import sys
+import heapq
+import datetime
+
+# Merging traces from several hosts, sessions and terminals into one.
+#
+# Every input is read as a stream and the streams are merged by timestamp
+# with a k-way merge (heapq.merge), so memory holds a few events per input
+# whatever the trace sizes. Each merged event is tagged with where it came
+# from (host, terminal, session and its id there, source_id) and renumbered
+# from 1 in merged order.
+#
+# A trace is written in the order commands finished, or for a daemon trace
+# the order events arrived, which can be a little out of step with the
+# timestamps. Each input is therefore re-sorted through a window of
+# REORDER_WINDOW events before it joins the merge. A daemon that other
+# daemons relay to interleaves their streams however they arrived (a relay
+# catching up after an outage sends a long run of old events), so such a
+# trace is read once per origin, each of which is in order on its own.
+# Timestamps are compared as text, as recorded on each host, so the hosts'
+# clocks and time zones should agree.
+REORDER_WINDOW = 64
+
+
+def _origin(event):
+    # Relayed events carry the relaying daemon's session; local ones do not.
+    return event.get("session"), event.get("host")
+
+
+def _sources(paths):
+    """(reader, origin) per input stream: each trace or each relayed stream in it, and every database session."""
+    from storage import open_session, is_database
+    for path in paths:
+        if is_database(path):
+            whole = open_session(path)
+            for row in whole.session_rows():
+                yield open_session(path, row), None
+            continue
+        reader = open_session(path)
+        origins = {}
+        for event in reader.events(fields=("session", "host")):
+            origins.setdefault(_origin(event), None)
+        if not any(session for session, _ in origins):
+            yield reader, None
+            continue
+        yield reader, next(iter(origins))
+        for origin in list(origins)[1:]:
+            yield open_session(path), origin
+
+
+def _tagged(reader, origin, source, window):
+    """Yield (timestamp, source, seq, event) from one reader, in timestamp order within window.
+
+    With an origin, only the events relayed from there are read.
+    """
+    header = reader.header
+    session_id = header.get("session_id")
+    hostname = header.get("hostname")
+    last = header.get("start_time") or ""
+    pending = []
+    for seq, event in enumerate(reader.events()):
+        if origin is not None and _origin(event) != origin:
+            continue
+        # An event without a timestamp stays where it was recorded.
+        timestamp = event.get("timestamp") or last
+        last = timestamp
+        if hostname and not event.get("host"):
+            event["host"] = hostname
+        if not event.get("terminal"):
+            event["terminal"] = session_id
+        # Events relayed by another daemon, or merged before, keep their origin.
+        event.setdefault("session", session_id)
+        event.setdefault("source_id", event.get("id"))
+        heapq.heappush(pending, (timestamp, source, seq, event))
+        if len(pending) > window:
+            yield heapq.heappop(pending)
+    while pending:
+        yield heapq.heappop(pending)
+
+
+def merge_traces(inputs, output_file, window=REORDER_WINDOW, codec="zlib"):
+    """Merge traces (and database sessions) into one timestamp-ordered session.
+
+    The output format follows its extension like 'iris convert': .tracez
+    is compressed, a database path adds the merged session to it. Output
+    blobs referenced by merged events are copied next to the output.
+    Returns the number of events written.
+    """
+    from storage import open_trace_writer, is_database, copy_blob
+
+    output = os.path.abspath(output_file)
+    if any(os.path.abspath(path) == output for path in inputs):
+        print(f"Error: {output_file} is one of the inputs; merge into a new file.")
+        sys.exit(1)
+    sources = list(_sources(inputs))
+    readers = [reader for reader, _ in sources]
+    starts = [r.header["start_time"] for r in readers if r.header.get("start_time")]
+    if not starts:
+        print("Error: no sessions to merge.")
+        sys.exit(1)
+    start = datetime.datetime.fromisoformat(min(starts))
+    hosts = sorted({r.header["hostname"] for r in readers if r.header.get("hostname")})
+    session_id = f"merge-{start.strftime('%Y-%m-%d_%H-%M-%S')}"
+    merged = {(r.trace_file, r.header.get("session_id")): r.header.get("hostname") for r in readers}
+    extra = {"merged": [{"trace": trace, "session_id": sid, "hostname": host} for (trace, sid), host in merged.items()]}
+    hostname = ", ".join(hosts) or None
+
+    if is_database(output_file):
+        from database import DatabaseWriter
+        writer = DatabaseWriter(output_file, session_id, start, hostname=hostname, buffered=True, extra=extra)
+    else:
+        writer = open_trace_writer(output_file, session_id, start, hostname=hostname,
+                                   compressed=output_file.endswith(".tracez"), codec=codec, extra=extra)
+    last = min(starts)
+    seen_hosts = set()
+    try:
+        streams = [_tagged(reader, origin, source, window) for source, (reader, origin) in enumerate(sources)]
+        for timestamp, source, _, event in heapq.merge(*streams):
+            copy_blob(readers[source].trace_file, output_file, event)
+            event["id"] = len(writer) + 1
+            writer.append(event)
+            seen_hosts.add(event.get("host"))
+            last = max(last, timestamp)
+    finally:
+        # Stream traces only know their end time once read to the end.
+        ends = [r.end_time for r in readers if r.end_time] + [last]
+        writer.close(datetime.datetime.fromisoformat(max(ends)))
+    count = len(writer)
+    print(f"Merged {count} events from {len(readers)} sessions on {len(seen_hosts - {None}) or len(hosts)} hosts "
+          f"into {output_file}")
+    return count
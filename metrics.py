@@ -0,0 +1,123 @@
+import os
+import time
+
+# Opt-in instrumentation for the hot paths. Nothing is recorded unless
+# enable() was called (iris --profile, IRIS_PROFILE=1 or a daemon metrics
+# endpoint), so the disabled cost is one global lookup per call site:
+#
+#     t = metrics.clock()
+#     ...
+#     metrics.elapsed("redact", t)
+#     metrics.count("events_built")
+
+enabled = os.environ.get("IRIS_PROFILE", "") not in ("", "0")
+
+_counters = {}
+_timers = {}       # name -> [total seconds, calls]
+_gauges = {}       # name -> callable returning the current value
+
+HELP = {
+    "bytes_captured": "Bytes of terminal output captured by recorders",
+    "bytes_typed": "Bytes of terminal input captured by recorders",
+    "capture_errors": "Terminal reads the recorder's capture thread failed to process",
+    "capture_dropped_bytes": "Bytes of terminal output left out of recordings because capture fell behind",
+    "events_built": "Events built from captured commands",
+    "events_written": "Events serialized to trace files",
+    "daemon_bytes_received": "Bytes received by the daemon from clients",
+    "daemon_events_ingested": "Events ingested by the daemon",
+    "daemon_malformed_events": "Lines the daemon could not decode as a JSON object",
+    "daemon_dropped_clients": "Clients dropped for oversized lines or slow tails",
+    "relay_events_forwarded": "Events forwarded to the upstream daemon",
+    "screen_snapshots": "Full-screen program snapshots taken by recorders",
+    "strip_ansi": "Time spent stripping ANSI escape sequences",
+    "redact": "Time spent redacting sensitive data",
+    "screen_model": "Time spent playing full-screen output into the screen model",
+    "serialize": "Time spent serializing and writing events",
+    "daemon_handle_client": "Time spent reading and ingesting client data",
+    "daemon_events": "Events in the daemon's current session",
+    "daemon_connections": "Open client connections",
+    "daemon_terminals": "Distinct terminals with an open connection",
+    "daemon_pending_bytes": "Bytes received by the daemon but not yet ingested",
+    "daemon_unjournaled_events": "Ingested events not yet checkpointed to the journal",
+    "daemon_tail_backlog_bytes": "Bytes queued for 'iris tail -f' clients",
+    "relay_backlog_events": "Ingested events not yet forwarded to the upstream daemon",
+}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def clock():
+    return time.perf_counter() if enabled else 0.0
+
+
+def elapsed(name, started):
+    if enabled:
+        timer = _timers.get(name)
+        if timer is None:
+            timer = _timers[name] = [0.0, 0]
+        timer[0] += time.perf_counter() - started
+        timer[1] += 1
+
+
+def count(name, n=1):
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def gauge(name, fn):
+    """Register a callable sampled whenever metrics are reported."""
+    _gauges[name] = fn
+
+
+def snapshot():
+    gauges = {}
+    for name, fn in _gauges.items():
+        try:
+            gauges[name] = fn()
+        except Exception:
+            continue
+    return {"counters": dict(_counters), "timers": {k: tuple(v) for k, v in _timers.items()}, "gauges": gauges}
+
+
+def prometheus():
+    """Render every metric in the Prometheus text exposition format."""
+    snap = snapshot()
+    lines = []
+    for name, value in sorted(snap["counters"].items()):
+        metric = f"iris_{name}_total"
+        lines += [f"# HELP {metric} {HELP.get(name, name)}", f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, (total, calls) in sorted(snap["timers"].items()):
+        metric = f"iris_{name}_seconds"
+        lines += [f"# HELP {metric} {HELP.get(name, name)}", f"# TYPE {metric} summary",
+                  f"{metric}_sum {total:.6f}", f"{metric}_count {calls}"]
+    for name, value in sorted(snap["gauges"].items()):
+        metric = f"iris_{name}"
+        lines += [f"# HELP {metric} {HELP.get(name, name)}", f"# TYPE {metric} gauge", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def report(out=None):
+    """Print a human-readable profile of everything recorded so far."""
+    import sys
+    out = out or sys.stderr
+    snap = snapshot()
+    print("\n[iris] Profile", file=out)
+    if not any(snap.values()):
+        print("  (nothing recorded)", file=out)
+    for name, value in sorted(snap["counters"].items()):
+        print(f"  {name:<28}{value:>16,}", file=out)
+    for name, (total, calls) in sorted(snap["timers"].items()):
+        mean_us = total / calls * 1e6 if calls else 0.0
+        print(f"  {name:<28}{total * 1000:>13.1f} ms  {calls:>9,} calls  {mean_us:>9.1f} us/call", file=out)
+    for name, value in sorted(snap["gauges"].items()):
+        print(f"  {name:<28}{value:>16,}", file=out)
+
+
+def profile_on_exit():
+    """Enable metrics and print the report when the process exits."""
+    import atexit
+    enable()
+    atexit.register(report)
@@ -6,84 +6,285 @@ import pty
 import tty
 import termios
 import select
-from storage import save_session
+import metrics
+from storage import session_writer, session_path, blob_dir
 from redact import build_event
+from capture import OutputCapture, attach_timing
+from shell_integration import MarkerParser
+from screen import terminal_size
+
+# Bytes read from stdin or the PTY per syscall. Reads land in one reusable
+# buffer and are forwarded through a memoryview without copying.
+READ_SIZE = 65536
+
+# The loop between the terminal and the PTY only forwards bytes and hands a
+# copy to a capture thread, which finds commands, cleans and redacts their
+# output and writes events. Keystrokes then echo as fast as without iris,
+# however much output is being processed. IRIS_CAPTURE_THREAD=0 processes
+# everything in the loop itself instead.
+CAPTURE_THREAD = os.environ.get("IRIS_CAPTURE_THREAD", "1") not in ("", "0")
+# Bytes handed over but not yet processed, past which output is dropped from
+# the recording (it still reaches the terminal); see CaptureQueue.
+CAPTURE_QUEUE_BYTES = int(float(os.environ.get("IRIS_CAPTURE_QUEUE_MB", "64")) * 1024 * 1024)
+
+TYPED, PRINTED, DROPPED, CLOSED = "typed", "printed", "dropped", "closed"
+_MARKER = b"\x1b]133;"
+
+
+class CaptureQueue:
+    """Bounded handoff of terminal bytes from the forwarding loop to the capture thread.
+
+    Items are (kind, data, arrival time). The bound is on bytes waiting, and
+    when it is reached output is dropped, counted, and reported to the
+    capture thread as one DROPPED item before the next chunk it gets. Input
+    is never dropped, as commands are made of it, and neither is output
+    carrying a shell integration marker, as command boundaries are. put()
+    never blocks.
+    """
+
+    def __init__(self, limit=CAPTURE_QUEUE_BYTES):
+        import queue
+        self._queue = queue.SimpleQueue()
+        self.limit = limit
+        # Each counter is only written by one side, so no lock is needed.
+        self.put_bytes = 0
+        self.got_bytes = 0
+        self.dropping = 0
+        self.dropped = 0
+
+    def put(self, kind, data, now):
+        if (kind == PRINTED and self.put_bytes - self.got_bytes + len(data) > self.limit
+                and _MARKER not in data):
+            self.dropping += len(data)
+            self.dropped += len(data)
+            metrics.count("capture_dropped_bytes", len(data))
+            return
+        if self.dropping:
+            self._queue.put((DROPPED, self.dropping, now))
+            self.dropping = 0
+        self.put_bytes += len(data)
+        self._queue.put((kind, data, now))
+
+    def get(self):
+        item = self._queue.get()
+        if item[0] in (TYPED, PRINTED):
+            self.got_bytes += len(item[1])
+        return item
+
+    def close(self, now):
+        self._queue.put((CLOSED, b"", now))
+
+
+def _write_all(fd, data):
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
 
 def record():
     now = datetime.datetime.now()
     session_id = now.strftime("%Y-%m-%d_%H-%M-%S")
-    trace_file = f"{session_id}.trace"
-    
-    events = []
-    
+    trace_file = session_path(f"{session_id}.trace")
+
     print(f"Starting iris recording... Saving to {trace_file}")
     print("Type 'exit' or press Ctrl+D to stop.")
     time.sleep(1)
-    
+
     pid, fd = pty.fork()
     if pid == 0:
         shell = os.environ.get('SHELL', 'bash')
+        # Lets the optional shell integration (iris shell-init) switch itself on.
+        os.environ['IRIS_RECORDING'] = '1'
         os.execvp(shell, [shell])
     else:
+        events = session_writer(trace_file, session_id, now)
         old_tty = termios.tcgetattr(sys.stdin)
         tty.setraw(sys.stdin.fileno())
-        
+        stdin_fd = sys.stdin.fileno()
+        stdout_fd = sys.stdout.fileno()
+
+        buf = bytearray(READ_SIZE)
+        view = memoryview(buf)
+
         state = "START"
-        current_input = ""
-        current_output = ""
-        cmd_start_time = time.time()
-        
+        current_input = bytearray()
+        # When the bytes being processed arrived; with a capture thread that
+        # can be a moment ago, and every time recorded is taken from it.
+        arrived = time.time()
+        # Output is decoded as it arrives and spills to a blob next to the
+        # trace once it outgrows the per-event memory cap. Full-screen
+        # programs are kept as snapshots of a screen the size of the PTY.
+        output = OutputCapture(blob_dir(trace_file), screen_size=terminal_size(fd), clock=lambda: arrived)
+        cmd_start_time = arrived
+        # Once the shell emits integration markers they alone decide where
+        # commands start and end; until then keystrokes are used.
+        markers = MarkerParser()
+        cwd = None
+        # Input typed before the shell is ready for it, e.g. the rest of a paste.
+        typed_ahead = bytearray()
+
+        def finish_command(exit_code=None):
+            if current_input.strip():
+                duration = int((arrived - cmd_start_time) * 1000)
+                raw_input = current_input.decode('utf-8', errors='replace')
+                evt = build_event(events, raw_input, output.result(), duration,
+                                  datetime.datetime.fromtimestamp(arrived).isoformat(), exit_code)
+                if evt:
+                    if cwd:
+                        evt['cwd'] = cwd
+                    events.append(attach_timing(evt, output, cmd_start_time))
+
+        def on_marker(kind, value):
+            nonlocal state, cmd_start_time, cwd
+            if kind == "cwd":
+                cwd = value
+            elif kind in ("A", "D"):
+                if state == "RUNNING":
+                    # The prompt is not part of the output here, so end the
+                    # last line; otherwise it would be trimmed as the prompt.
+                    output.feed(b"\n")
+                    finish_command(value if kind == "D" else None)
+                state = "PROMPT"
+            elif kind == "B":
+                state = "INPUT"
+                current_input[:] = typed_ahead
+                typed_ahead.clear()
+            elif kind == "C" and state != "RUNNING":
+                # Only the first line typed belongs to this command.
+                ends = [i for i in (current_input.find(b'\r'), current_input.find(b'\n')) if i != -1]
+                if ends:
+                    typed_ahead[:0] = current_input[min(ends) + 1:]
+                    del current_input[min(ends) + 1:]
+                state = "RUNNING"
+                cmd_start_time = arrived
+                output.reset()
+
+        def on_typed(data):
+            nonlocal state, cmd_start_time
+            if markers.seen:
+                # Keystrokes only form the command text; markers set the state.
+                # Input to a running command is not recorded.
+                if state == "INPUT":
+                    current_input.extend(data)
+                elif state != "RUNNING":
+                    typed_ahead.extend(data)
+            elif state == "RUNNING" and output.screen is not None:
+                # Keys typed into a full-screen program are not commands.
+                pass
+            else:
+                # A read can hold several lines (a paste); each line
+                # ending in \r or \n starts a command, and the next byte
+                # typed afterwards closes it.
+                start = 0
+                n = len(data)
+                while start < n:
+                    if state != "INPUT":
+                        if state == "RUNNING":
+                            finish_command()
+                        state = "INPUT"
+                        current_input.clear()
+                        output.reset()
+
+                    cr = data.find(b'\r', start, n)
+                    lf = data.find(b'\n', start, n)
+                    end = min(cr, lf) if cr != -1 and lf != -1 else max(cr, lf)
+                    if end == -1:
+                        current_input.extend(data[start:])
+                        break
+                    current_input.extend(data[start:end + 1])
+                    state = "RUNNING"
+                    cmd_start_time = arrived
+                    start = end + 1
+
+        def on_printed(data):
+            for kind, value in markers.feed(data):
+                if kind == "output":
+                    if state == "RUNNING":
+                        output.feed(value)
+                else:
+                    on_marker(kind, value)
+
+        def process(kind, data, when):
+            nonlocal arrived
+            arrived = when
+            if kind == TYPED:
+                on_typed(data)
+            elif kind == PRINTED:
+                on_printed(data)
+            elif kind == DROPPED and state == "RUNNING":
+                output.feed_text(f"\n[iris: {data} bytes of output not recorded]\n")
+
+        # The first error processing hit, reported when recording ends.
+        capture_error = None
+
+        def capture_failed(error):
+            nonlocal capture_error
+            metrics.count("capture_errors")
+            if capture_error is None:
+                capture_error = error
+
+        def capture_worker():
+            while True:
+                kind, data, when = handoff.get()
+                if kind == CLOSED:
+                    return
+                try:
+                    process(kind, data, when)
+                except Exception as e:
+                    # One bad chunk must not stop the recording, but a failing
+                    # writer (a full disk) must not go unnoticed either.
+                    capture_failed(e)
+
+        if CAPTURE_THREAD:
+            import threading
+            handoff = CaptureQueue()
+            worker = threading.Thread(target=capture_worker, name="iris-capture", daemon=True)
+            worker.start()
+            hand_over = handoff.put
+        else:
+            handoff = worker = None
+            hand_over = process
+
         try:
             while True:
-                r, w, e = select.select([sys.stdin, fd], [], [])
-                if sys.stdin in r:
-                    char = os.read(sys.stdin.fileno(), 1)
-                    if not char:
+                r, w, e = select.select([stdin_fd, fd], [], [])
+                if stdin_fd in r:
+                    n = os.readv(stdin_fd, [buf])
+                    if not n:
                         break
-                    
-                    char_str = char.decode('utf-8', errors='replace')
-                    
-                    if state != "INPUT":
-                        if state == "RUNNING" and current_input.strip():
-                            duration = int((time.time() - cmd_start_time) * 1000)
-                            evt = build_event(events, current_input, current_output, duration, datetime.datetime.now().isoformat())
-                            if evt:
-                                events.append(evt)
-                        
-                        state = "INPUT"
-                        current_input = ""
-                        current_output = ""
-                    
-                    current_input += char_str
-                    os.write(fd, char)
-                    
-                    if char == b'\r' or char == b'\n':
-                        state = "RUNNING"
-                        cmd_start_time = time.time()
-                        
+                    _write_all(fd, view[:n])
+                    metrics.count("bytes_typed", n)
+                    hand_over(TYPED, bytes(view[:n]), time.time())
+
                 if fd in r:
                     try:
-                        data = os.read(fd, 1024)
+                        n = os.readv(fd, [buf])
                     except OSError:
                         break
-                    if not data:
+                    if not n:
                         break
-                    
-                    os.write(sys.stdout.fileno(), data)
-                    
-                    text = data.decode('utf-8', errors='replace')
-                    if state == "RUNNING":
-                        current_output += text
+
+                    _write_all(stdout_fd, view[:n])
+                    metrics.count("bytes_captured", n)
+                    hand_over(PRINTED, bytes(view[:n]), time.time())
         except Exception as e:
             pass
         finally:
             termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_tty)
-            
-            if state == "RUNNING" and current_input.strip():
-                duration = int((time.time() - cmd_start_time) * 1000)
-                evt = build_event(events, current_input, current_output, duration, datetime.datetime.now().isoformat())
-                if evt:
-                    events.append(evt)
-                    
-            save_session(trace_file, session_id, now, datetime.datetime.now(), events)
+
+            if worker is not None:
+                handoff.close(time.time())
+                worker.join()
+            arrived = time.time()
+            try:
+                if state == "RUNNING":
+                    finish_command()
+            except Exception as e:
+                capture_failed(e)
+
+            events.close(datetime.datetime.now())
+            if handoff is not None and handoff.dropped:
+                print(f"\r\n[iris] {handoff.dropped} bytes of output arrived faster than they could be "
+                      f"recorded and were left out (IRIS_CAPTURE_QUEUE_MB raises the limit).")
+            if capture_error is not None:
+                print(f"\r\n[iris] Some of the session could not be recorded: {capture_error!r}")
             print(f"\r\n[iris] Session saved to {trace_file}")
@@ -6,9 +6,11 @@ import msvcrt
 import sys
 import os
 import re
-from storage import save_session
+import metrics
+from storage import session_writer, session_path, blob_dir
 from redact import build_event
-from daemon import send_event_to_daemon, DAEMON_PORT_FILE
+from capture import OutputCapture, attach_timing
+from client import send_event_to_daemon, daemon_trace_file, DAEMON_PORT_FILE
 
 # Signal directory for cross-terminal communication
 SIGNAL_DIR = os.path.join(os.path.expanduser("~"), ".iris")
@@ -70,10 +72,12 @@ def _cleanup_signals():
 def record():
     now = datetime.datetime.now()
     session_id = now.strftime("%Y-%m-%d_%H-%M-%S")
-    trace_file = f"{session_id}.trace"
-    events = []
+    trace_file = session_path(f"{session_id}.trace")
 
     is_daemon_mode = os.path.exists(DAEMON_PORT_FILE)
+    # Standalone sessions stream events to disk as they happen; attached
+    # terminals only need the running count for event ids.
+    events = [] if is_daemon_mode else session_writer(trace_file, session_id, now)
 
     if is_daemon_mode:
         print(f"Attaching terminal to central Iris recording daemon...")
@@ -88,13 +92,14 @@ def record():
     process = winpty.PtyProcess.spawn("cmd.exe")
 
     current_input = ""
-    current_output = ""
+    # Large outputs spill next to whichever trace the events land in.
+    blob_trace = (daemon_trace_file() if is_daemon_mode else None) or trace_file
+    current_output = OutputCapture(blob_dir(blob_trace))
     cmd_start_time = time.time()
     lock = threading.Lock()
     user_stopped = False  # Only True when user explicitly stops
 
     def read_output():
-        nonlocal current_output
         while not user_stopped:
             try:
                 if not process.isalive():
@@ -102,12 +107,13 @@ def record():
                     continue
                 data = process.read()
                 if data:
+                    metrics.count("bytes_captured", len(data))
                     display_text = clean_display(data)
                     if display_text.strip():
                         sys.stdout.write(display_text)
                         sys.stdout.flush()
                     with lock:
-                        current_output += display_text
+                        current_output.feed_text(display_text)
             except EOFError:
                 time.sleep(0.5)
                 continue
@@ -151,8 +157,9 @@ def record():
                             duration = int((time.time() - cmd_start_time) * 1000)
                             cmd_text = current_input.strip()
                             if cmd_text:
-                                evt = build_event(events, current_input, current_output, duration, datetime.datetime.now().isoformat())
+                                evt = build_event(events, current_input, current_output.result(), duration, datetime.datetime.now().isoformat())
                                 if evt:
+                                    attach_timing(evt, current_output, cmd_start_time)
                                     if is_daemon_mode:
                                         if not send_event_to_daemon(evt):
                                             print("\n[iris] Daemon connection lost. Stopping recording.")
@@ -164,7 +171,7 @@ def record():
                                     user_stopped = True
                                     break
                             current_input = ""
-                            current_output = ""
+                            current_output.reset()
                             cmd_start_time = time.time()
                     else:
                         try:
@@ -184,7 +191,7 @@ def record():
     
     if not is_daemon_mode:
         _cleanup_signals()
-        save_session(trace_file, session_id, now, datetime.datetime.now(), events)
+        events.close(datetime.datetime.now())
         print(f"\n[iris] Session saved to {trace_file}")
     else:
         print(f"\n[iris] Terminal detached from recording daemon.")
@@ -1,4 +1,7 @@
+import os
 import re
+import sys
+import metrics
 
 ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 
@@ -10,13 +13,164 @@ SENSITIVE_PATTERNS = [
     r'[A-Za-z0-9]{32,}',  # long random strings (API keys)
 ]
 
+# Lower-case literals, one tuple per entry in SENSITIVE_PATTERNS. Every match
+# of a pattern starts with one of its literals, so text without them skips
+# the pattern, and text with them only tries the pattern at those offsets.
+# An empty tuple means the pattern is scanned for normally.
+SENSITIVE_LITERALS = [
+    ("password", "passwd", "pwd"),
+    ("api_key", "apikey", "api-key"),
+    ("secret", "token"),
+    ("bearer",),
+    (),
+]
+
+REDACTED = '[REDACTED]'
+
+# Extra patterns, one regex per line ('#' starts a comment), applied after
+# the built-in ones.
+REDACT_RULES_FILE = os.environ.get(
+    "IRIS_REDACT_RULES", os.path.join(os.path.expanduser("~"), ".iris", "redact_rules.txt"))
+
+# Non-ASCII letters that (?i) matches against ASCII ones but str.lower()
+# leaves unchanged; their presence means literal offsets cannot be trusted.
+_CASE_FOLD_EXTRAS = ('\u0131', '\u017f')
+
+
+def _aligned_lower(text):
+    """Lower-case text with offsets matching the original, or None if that is not possible."""
+    lower = text.lower()
+    if text.isascii():
+        return lower
+    if len(lower) != len(text) or any(c in text for c in _CASE_FOLD_EXTRAS):
+        return None
+    return lower
+
+
+class RedactionEngine:
+    """Applies redaction patterns in one pass over the text.
+
+    The result is identical to substituting each pattern over the whole
+    text in order. A pattern whose literals are absent never runs; otherwise
+    it is only tried where one of them occurs, so the one regex scan left is
+    for patterns without literals. All matches are then replaced together.
+    A match nested inside an earlier pattern's match is dropped, since the
+    ordered substitutions would have erased it; any other overlap falls
+    back to those substitutions. Extra patterns (user rules) may match text
+    produced by an earlier replacement, so they run afterwards, one pass
+    each.
+    """
+
+    def __init__(self, patterns, literals=None, extra_patterns=()):
+        self.rules = [re.compile(p) for p in patterns]
+        literals = list(literals or [])
+        literals += [()] * (len(self.rules) - len(literals))
+        self.literals = [tuple(l.lower() for l in lits) for lits in literals]
+        self.extra_rules = [re.compile(p) for p in extra_patterns]
+
+    def redact(self, text):
+        if not text:
+            return text
+        text = self._redact_builtin(text)
+        for rule in self.extra_rules:
+            text = rule.sub(REDACTED, text)
+        return text
+
+    def _spans(self, i, text, lower):
+        """Non-overlapping match spans of pattern i, as re.sub would find them."""
+        rule = self.rules[i]
+        lits = self.literals[i]
+        if not lits or lower is None:
+            return [m.span() for m in rule.finditer(text)]
+        starts = set()
+        for lit in lits:
+            pos = lower.find(lit)
+            while pos != -1:
+                starts.add(pos)
+                pos = lower.find(lit, pos + 1)
+        spans = []
+        end = 0
+        for pos in sorted(starts):
+            if pos < end:
+                continue
+            m = rule.match(text, pos)
+            if m and m.end() > pos:
+                spans.append((pos, m.end()))
+                end = m.end()
+        return spans
+
+    def _redact_builtin(self, text):
+        lower = _aligned_lower(text)
+        active = []
+        matches = []
+        for i, lits in enumerate(self.literals):
+            if lits and lower is not None and not any(lit in lower for lit in lits):
+                continue
+            active.append(i)
+            matches.extend((start, i, end) for start, end in self._spans(i, text, lower))
+        if not matches:
+            return text
+
+        matches.sort()
+        pieces = []
+        last = 0
+        last_rule = -1
+        for start, i, end in matches:
+            if start < last:
+                # A later pattern matching inside an earlier pattern's match
+                # is wiped out by that replacement; any other overlap needs
+                # the ordered substitutions.
+                if i > last_rule and end <= last:
+                    continue
+                return self.redact_sequential(text, active)
+            pieces.append(text[last:start])
+            pieces.append(REDACTED)
+            last = end
+            last_rule = i
+        pieces.append(text[last:])
+        return "".join(pieces)
+
+    def redact_sequential(self, text, active=None):
+        for i in (range(len(self.rules)) if active is None else active):
+            text = self.rules[i].sub(REDACTED, text)
+        return text
+
+
+def load_rule_file(path):
+    """Read extra redaction patterns from a rules file, skipping invalid ones."""
+    patterns = []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return patterns
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            re.compile(line)
+        except re.error as e:
+            print(f"Warning: ignoring redaction rule {path}:{lineno}: {e}", file=sys.stderr)
+            continue
+        patterns.append(line)
+    return patterns
+
+
+_engine = None
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = RedactionEngine(SENSITIVE_PATTERNS, SENSITIVE_LITERALS,
+                                  load_rule_file(REDACT_RULES_FILE))
+    return _engine
+
 def strip_ansi(text):
     return ANSI_ESCAPE.sub('', text)
 
 def redact(text):
-    for pattern in SENSITIVE_PATTERNS:
-        text = re.sub(pattern, '[REDACTED]', text)
-    return text
+    return get_engine().redact(text)
 
 def clean_command(raw_input):
     s = strip_ansi(raw_input)
@@ -32,17 +186,38 @@ def clean_command(raw_input):
     return "".join(res).strip()
 
 def guess_exit_code(output):
+    # Only used when the real exit code is unknown. A single case-insensitive
+    # regex would scan once but is many times slower in CPython than
+    # lower() followed by these substring searches.
     lower_out = output.lower()
     if "error" in lower_out or "traceback" in lower_out or "exception" in lower_out or "not found" in lower_out or "failed" in lower_out:
         return 1
     return 0
 
-def build_event(events, raw_input, raw_output, duration_ms, timestamp_iso):
+def build_event(events, raw_input, raw_output, duration_ms, timestamp_iso, exit_code=None):
+    """Event for one command; exit_code is guessed from the output unless given."""
     command = clean_command(raw_input)
     if not command:
         return None
+
+    metrics.count("events_built")
+    if not isinstance(raw_output, str):
+        # Output past the in-memory cap was already cleaned into a blob by
+        # capture.OutputCapture; the event keeps excerpts and a reference.
+        return {
+            "id": len(events) + 1,
+            "type": "command",
+            "timestamp": timestamp_iso,
+            "command": redact(command),
+            "output": raw_output.excerpt(),
+            "exit_code": exit_code if exit_code is not None else (1 if raw_output.has_error else 0),
+            "duration_ms": duration_ms,
+            "output_blob": raw_output.blob_ref()
+        }
         
+    started = metrics.clock()
     out_clean = strip_ansi(raw_output)
+    metrics.elapsed("strip_ansi", started)
     out_clean = out_clean.replace('\r\n', '\n').replace('\r', '\n')
     lines = out_clean.split('\n')
     if lines and lines[0] == '':
@@ -51,10 +226,13 @@ def build_event(events, raw_input, raw_output, duration_ms, timestamp_iso):
         lines = lines[:-1]
     output = '\n'.join(lines).strip()
     
+    started = metrics.clock()
     command = redact(command)
     output = redact(output)
+    metrics.elapsed("redact", started)
     
-    exit_code = guess_exit_code(output)
+    if exit_code is None:
+        exit_code = guess_exit_code(output)
     
     return {
         "id": len(events) + 1,
@@ -64,4 +242,4 @@ def build_event(events, raw_input, raw_output, duration_ms, timestamp_iso):
         "output": output,
         "exit_code": exit_code,
         "duration_ms": duration_ms
-    }
+    }
\ No newline at end of file
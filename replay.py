@@ -1,11 +1,92 @@
+import sys
 import time
-from storage import load_session
+import shutil
+import datetime
+from storage import open_session, open_event_output
 
-def replay_session(trace_file):
-    session = load_session(trace_file)
-        
-    for event in session.get('events', []):
+# Longest pause replayed, in recorded seconds, before --speed applies.
+MAX_IDLE = 2.0
+
+
+def _start_and_end(event):
+    # Events are stamped when the command finishes.
+    try:
+        end = datetime.datetime.fromisoformat(event['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+    return end - datetime.timedelta(milliseconds=event.get('duration_ms') or 0), end
+
+
+def _play_output(trace_file, event, pause):
+    """Write an event's output, pausing between recorded chunks when it has timing."""
+    timing = event.get('timing')
+    with open_event_output(trace_file, event) as out:
+        if not timing:
+            shutil.copyfileobj(out, sys.stdout)
+            return
+        last_ms = 0
+        written = 0
+        for ms, offset in timing:
+            pause((ms - last_ms) / 1000.0)
+            last_ms = ms
+            if offset > written:
+                sys.stdout.write(out.read(offset - written))
+                sys.stdout.flush()
+                written = offset
+        shutil.copyfileobj(out, sys.stdout)
+    pause(max(0, (event.get('duration_ms') or 0) - last_ms) / 1000.0)
+
+
+def _play_screens(event, pause):
+    """Show a full-screen program's snapshots: on the alternate screen of a terminal, else the last one."""
+    screens = event['screens']
+    if not sys.stdout.isatty():
+        ms, text = screens[-1]
+        print(f"[full-screen program, screen at {ms / 1000:.1f}s]\n{text}")
+        return
+    last_ms = 0
+    sys.stdout.write("\x1b[?1049h")
+    for ms, text in screens:
+        pause((ms - last_ms) / 1000.0)
+        last_ms = ms
+        sys.stdout.write("\x1b[H\x1b[2J" + text)
+        sys.stdout.flush()
+    pause(max(0.5, (event.get('duration_ms') or 0) - last_ms) / 1000.0)
+    sys.stdout.write("\x1b[?1049l")
+
+
+def replay_session(trace_file, bounds=None, speed=1.0, max_idle=MAX_IDLE, session_id=None):
+    """Play a session back with its recorded timing.
+
+    Events are streamed from the trace, so playback starts at once however
+    large it is. Gaps between and within commands are replayed as recorded,
+    capped at max_idle seconds, then divided by speed.
+    """
+    session = open_session(trace_file, session_id)
+
+    def pause(seconds):
+        seconds = min(seconds, max_idle) / speed
+        if seconds > 0:
+            sys.stdout.flush()
+            time.sleep(seconds)
+
+    previous_end = None
+    for event in session.events(**(bounds or {})):
+        start, end = _start_and_end(event)
+        if previous_end is not None and start is not None:
+            pause((start - previous_end).total_seconds())
         print(f"$ {event['command']}")
+        screens = event.get('screens')
+        if screens:
+            _play_screens(event, pause)
         if event['output']:
-            print(event['output'])
-        time.sleep(0.5)
+            _play_output(trace_file, event, pause)
+            print()
+        elif screens:
+            pass   # _play_screens waited out the command
+        elif start is None:
+            pause(0.5)
+        else:
+            pause((event.get('duration_ms') or 0) / 1000.0)
+        sys.stdout.flush()
+        previous_end = end
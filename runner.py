@@ -1,62 +1,426 @@
-import subprocess
 import time
 import datetime
 import os
 import sys
+import metrics
 from redact import build_event
-from storage import save_session
-from daemon import send_event_to_daemon, DAEMON_PORT_FILE
+from storage import save_session, session_path, session_writer, blob_dir
+from capture import OutputCapture, attach_timing
+from client import send_event_to_daemon, daemon_trace_file, DAEMON_PORT_FILE
+
+# Output is pumped from the child's pipe in chunks of up to this many bytes.
+READ_SIZE = 65536
+
+
+class _SpawnedChild:
+    """The parts of subprocess.Popen used here, for a child from os.posix_spawnp.
+
+    Spawning directly keeps 'iris run' from importing subprocess (and the
+    threading and selectors machinery it pulls in) on every invocation.
+    """
+
+    def __init__(self, cmd_args, stdin_null=False, own_group=False):
+        r, w = os.pipe()
+        file_actions = [(os.POSIX_SPAWN_DUP2, w, 1), (os.POSIX_SPAWN_DUP2, w, 2)]
+        if stdin_null:
+            file_actions.append((os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0))
+        # setpgroup=0 puts the child in a new group; there is no value for "unchanged".
+        group = {"setpgroup": 0} if own_group else {}
+        try:
+            self.pid = os.posix_spawnp(cmd_args[0], cmd_args, os.environ, file_actions=file_actions, **group)
+        except BaseException:
+            os.close(r)
+            raise
+        finally:
+            os.close(w)
+        self.stdout = os.fdopen(r, 'rb', buffering=0)
+        self.returncode = None
+        self.own_group = own_group
+
+    def terminate(self):
+        import signal
+        try:
+            # A shell's children hold the output pipe open too; signal them all.
+            if self.own_group:
+                os.killpg(self.pid, signal.SIGTERM)
+            else:
+                os.kill(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+
+def _spawn(cmd_args, stdin_null=False, own_group=False):
+    """Start cmd_args with stdout and stderr sent to one pipe.
+
+    stdin_null gives the child /dev/null as stdin; own_group starts it in a
+    process group of its own (POSIX only), which terminate() signals whole.
+    """
+    if hasattr(os, 'posix_spawnp'):
+        return _SpawnedChild(cmd_args, stdin_null, own_group)
+    import subprocess
+    return subprocess.Popen(
+        cmd_args,
+        stdin=subprocess.DEVNULL if stdin_null else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=0,
+        shell=True if os.name == 'nt' else False
+    )
+
+
+def _wait(process):
+    """Reap the child, returning (exit_code, rusage or None).
+
+    os.wait4 reports the resources used by the child and every descendant
+    it waited for. It is not available on Windows, where only the exit code
+    is collected.
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            break
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+
+def _own_peak_rss():
+    """iris's own peak RSS in ru_maxrss units, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _resources(usage, first_output_ms, parent_rss=None):
+    resources = {"first_output_ms": first_output_ms}
+    if usage is not None:
+        resources.update({
+            "user_ms": int(usage.ru_utime * 1000),
+            "sys_ms": int(usage.ru_stime * 1000),
+            "in_blocks": usage.ru_inblock,
+            "out_blocks": usage.ru_oublock,
+        })
+        # A child starts out counted at the peak of the address space it was
+        # spawned from, iris's, and that survives exec. A figure no higher
+        # than iris's own peak at spawn may be all iris's, so it is left out.
+        if parent_rss is None or usage.ru_maxrss > parent_rss:
+            # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+            resources["max_rss_kb"] = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return resources
+
+
+class _Run:
+    """One command being run: its child, captured output and timing."""
+
+    def __init__(self, cmd_text, blob_trace):
+        self.cmd_text = cmd_text
+        # Large outputs spill next to whichever trace the event will land in.
+        self.output = OutputCapture(blob_dir(blob_trace))
+        self.process = None
+        self.parent_rss = None
+        self.start_time = time.time()
+        self.first_output_ms = None
+        self.usage = None
+        self.end_time = None
+
+    def spawn(self, cmd_args, **options):
+        """Start the command (see _spawn), noting iris's peak RSS as it starts."""
+        self.process = _spawn(cmd_args, **options)
+        self.parent_rss = _own_peak_rss()
+
+    def pump(self, write):
+        """Pass the child's output to write() and the capture until the child closes it."""
+        # Forward raw chunks as they arrive; a fast-printing command is
+        # never held back by per-line decoding and flushing.
+        pipe_fd = self.process.stdout.fileno()
+        while True:
+            data = os.read(pipe_fd, READ_SIZE)
+            if not data:
+                break
+            if self.first_output_ms is None:
+                self.first_output_ms = int((time.time() - self.start_time) * 1000)
+            write(data)
+            self.output.feed(data)
+            metrics.count("bytes_captured", len(data))
+        self.process.stdout.close()
+
+    def wait(self):
+        """Reap the child; returns its exit code."""
+        exit_code, self.usage = _wait(self.process)
+        self.end_time = time.time()
+        return exit_code
+
+    def event(self, events, exit_code):
+        end_time = self.end_time or time.time()
+        duration = int((end_time - self.start_time) * 1000)
+        evt = build_event(events, self.cmd_text, self.output.result(), duration,
+                          datetime.datetime.fromtimestamp(end_time).isoformat(), exit_code)
+        if evt:
+            evt['resources'] = _resources(self.usage, self.first_output_ms, self.parent_rss)
+            attach_timing(evt, self.output, self.start_time)
+        return evt
+
+
+def _write_stdout(data):
+    stdout = getattr(sys.stdout, 'buffer', None)
+    if stdout is not None:
+        stdout.write(data)
+        stdout.flush()
+    else:
+        sys.stdout.write(data.decode('utf-8', errors='replace'))
+        sys.stdout.flush()
+
 
 def run_single_command(cmd_args):
     now = datetime.datetime.now()
     session_id = now.strftime("%Y-%m-%d_%H-%M-%S")
-    trace_file = f"{session_id}.trace"
+    trace_file = session_path(f"{session_id}.trace")
     events = []
     
     is_daemon_mode = os.path.exists(DAEMON_PORT_FILE)
-    
-    start_time = time.time()
-    cmd_text = " ".join(cmd_args)
-    
-    output_lines = []
+    run = _Run(" ".join(cmd_args), (daemon_trace_file() if is_daemon_mode else None) or trace_file)
     
     try:
-        process = subprocess.Popen(
-            cmd_args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            shell=True if os.name == 'nt' else False
-        )
-        
-        for line in iter(process.stdout.readline, ''):
-            sys.stdout.write(line)
-            sys.stdout.flush()
-            output_lines.append(line)
-            
-        process.stdout.close()
-        process.wait()
-        exit_code = process.returncode
+        run.spawn(cmd_args)
+        run.pump(_write_stdout)
+        exit_code = run.wait()
         
     except KeyboardInterrupt:
-        process.terminate()
-        output_lines.append("\n^C\n")
+        if run.process is not None:
+            run.process.terminate()
+            run.wait()
+        run.output.feed_text("\n^C\n")
         exit_code = 130
     except Exception as e:
         print(f"Error running command: {e}")
         exit_code = 1
-        output_lines.append(str(e))
+        run.output.feed_text(str(e))
         
-    duration = int((time.time() - start_time) * 1000)
-    raw_output = "".join(output_lines)
-    
-    evt = build_event(events, cmd_text, raw_output, duration, datetime.datetime.now().isoformat())
+    evt = run.event(events, exit_code)
     if evt:
-        evt['exit_code'] = exit_code
         if is_daemon_mode:
             send_event_to_daemon(evt)
         else:
             events.append(evt)
             save_session(trace_file, session_id, now, datetime.datetime.now(), events)
             print(f"\n[iris] Command session saved to {trace_file}")
+
+
+def read_commands(f):
+    """Command lines of a batch: one per line, skipping blank lines and # comments."""
+    commands = []
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            commands.append(line)
+    return commands
+
+
+class _Batch:
+    """Commands run by a pool of worker threads into one session.
+
+    Workers take the next command in order, run it through the shell and
+    record it as an event as soon as it finishes, so events are numbered
+    in the order commands finished. One lock guards the session (trace or
+    daemon connection), the terminal and the batch's bookkeeping.
+    """
+
+    def __init__(self, commands, fail_fast, buffered, writer, blob_trace):
+        import threading
+        self.commands = commands
+        self.fail_fast = fail_fast
+        self.buffered = buffered
+        # The session's writer, or None to send events to the daemon.
+        self.writer = writer
+        self.blob_trace = blob_trace
+        self.lock = threading.Lock()
+        self.next = 0
+        self.running = {}
+        self.exit_codes = {}
+        self.terminated = set()
+        self.stopping = False
+        self.interrupted = False
+        self.width = len(str(len(commands)))
+
+    def tag(self, number):
+        return f"[{number:>{self.width}}]"
+
+    def _take(self):
+        with self.lock:
+            if self.stopping or self.next >= len(self.commands):
+                return None, None
+            self.next += 1
+            return self.next, self.commands[self.next - 1]
+
+    def work(self):
+        while True:
+            number, command = self._take()
+            if number is None:
+                return
+            self._run(number, command)
+
+    def _run(self, number, command):
+        run = _Run(command, self.blob_trace)
+        argv = [command] if os.name == 'nt' else ["/bin/sh", "-c", command]
+        started = f"[iris] {self.tag(number)} $ {command}\n".encode('utf-8')
+        if self.buffered:
+            import tempfile
+            held = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+            write = held.write
+        else:
+            held = None
+            write = _LinePrefixer(f"{self.tag(number)} ".encode('utf-8'), self.lock)
+        # The held output is closed however the command ends, skipped ones included.
+        try:
+            self._execute(number, run, argv, started, held, write)
+        finally:
+            if held is not None:
+                held.close()
+
+    def _execute(self, number, run, argv, started, held, write):
+        try:
+            with self.lock:
+                # A batch stopped while this command was being set up skips it.
+                if self.stopping:
+                    return
+                run.spawn(argv, stdin_null=True, own_group=True)
+                self.running[number] = run.process
+                if held is None:
+                    _write_stdout(started)
+            run.pump(write)
+            exit_code = run.wait()
+        except Exception as e:
+            exit_code = 1
+            run.output.feed_text(str(e))
+            write(f"Error running command: {e}\n".encode('utf-8'))
+        with self.lock:
+            self.running.pop(number, None)
+            if self.interrupted:
+                run.output.feed_text("\n^C\n")
+                exit_code = 130
+            self.exit_codes[number] = exit_code
+            if exit_code != 0 and self.fail_fast:
+                self._stop()
+        # Redaction can take a while on large outputs, so the event is built
+        # outside the lock and only numbered under it.
+        evt = run.event([], exit_code)
+        seconds = (run.end_time or time.time()) - run.start_time
+        with self.lock:
+            if held is not None:
+                held.seek(0)
+                _write_stdout(started)
+                _write_stdout(held.read())
+            else:
+                write.close()
+            _write_stdout(f"[iris] {self.tag(number)} exit {exit_code} in {seconds:.1f}s\n".encode('utf-8'))
+            if evt:
+                if self.writer is None:
+                    send_event_to_daemon(evt)
+                else:
+                    evt['id'] = len(self.writer) + 1
+                    self.writer.append(evt)
+
+    def _stop(self):
+        """Start no more commands and terminate the running ones; call with the lock held."""
+        self.stopping = True
+        for number, process in self.running.items():
+            self.terminated.add(number)
+            process.terminate()
+
+    def interrupt(self):
+        with self.lock:
+            self.interrupted = True
+            self._stop()
+
+
+class _LinePrefixer:
+    """write() for a command's output that prints whole lines, each after prefix."""
+
+    def __init__(self, prefix, lock):
+        self.prefix = prefix
+        self.lock = lock
+        self.partial = b""
+
+    def __call__(self, data):
+        data = self.partial + data
+        end = data.rfind(b"\n") + 1
+        self.partial = data[end:]
+        if end:
+            lines = data[:end].splitlines(keepends=True)
+            with self.lock:
+                _write_stdout(b"".join(self.prefix + line for line in lines))
+
+    def close(self):
+        """Print what is left of the last line; call with the lock held."""
+        if self.partial:
+            _write_stdout(self.prefix + self.partial + b"\n")
+            self.partial = b""
+
+
+def run_batch(commands, jobs=1, fail_fast=False, buffered=False):
+    """Run shell command lines on up to jobs workers, each recorded as an event of one session.
+
+    Output is printed line by line prefixed with the command's number, or
+    with buffered=True all at once when the command finishes. With
+    fail_fast the first failure terminates the running commands and
+    starts no more. Returns 0 if every command ran and succeeded, else 1
+    (130 when interrupted).
+    """
+    import threading
+    now = datetime.datetime.now()
+    session_id = now.strftime("%Y-%m-%d_%H-%M-%S")
+    trace_file = session_path(f"{session_id}.trace")
+    is_daemon_mode = os.path.exists(DAEMON_PORT_FILE)
+    if is_daemon_mode:
+        # Events go over the one connection send_event_to_daemon keeps.
+        writer, blob_trace = None, daemon_trace_file() or trace_file
+    else:
+        writer, blob_trace = session_writer(trace_file, session_id, now), trace_file
+
+    batch = _Batch(commands, fail_fast, buffered, writer, blob_trace)
+    workers = [threading.Thread(target=batch.work, daemon=True) for _ in range(max(1, min(jobs, len(commands))))]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            # Joined with a timeout so Ctrl+C reaches this thread.
+            while worker.is_alive():
+                worker.join(0.2)
+    except KeyboardInterrupt:
+        batch.interrupt()
+        for worker in workers:
+            worker.join()
+    finally:
+        if writer is not None:
+            writer.close(datetime.datetime.now())
+
+    codes = batch.exit_codes
+    failed = [number for number, code in sorted(codes.items()) if code != 0]
+    terminated = batch.terminated & set(failed)
+    summary = f"{len(codes) - len(failed)} succeeded, {len(failed) - len(terminated)} failed"
+    if terminated:
+        summary += f", {len(terminated)} terminated"
+    if len(codes) < len(commands):
+        summary += f", {len(commands) - len(codes)} not run"
+    print(f"\n[iris] {len(commands)} commands: {summary}")
+    for number in failed:
+        status = "terminated" if number in terminated else f"exit {codes[number]}"
+        print(f"[iris]   {batch.tag(number)} {status}: {commands[number - 1]}")
+    if not is_daemon_mode:
+        print(f"[iris] Batch session saved to {trace_file}")
+    if batch.interrupted:
+        return 130
+    return 1 if failed or len(codes) < len(commands) else 0
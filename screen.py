@@ -0,0 +1,306 @@
+import os
+import re
+
+# Full-screen programs (vim, less, top, htop) switch the terminal to its
+# alternate screen and redraw it with cursor movements. Stripping the escape
+# codes from that stream leaves megabytes of scrambled text, so while the
+# alternate screen is active the output is played into a small terminal
+# model instead, and only snapshots of what was on screen are kept.
+#
+# The model covers what such programs use: printing with auto-wrap, cursor
+# movement, erasing, scroll regions, inserting and deleting lines and
+# characters. Colors and attributes are ignored and every character is one
+# cell wide, so a snapshot is the screen's text, not a pixel-exact copy.
+
+# Sequences that switch to the alternate screen (xterm's 1049, 1047 and the
+# older 47) and back.
+ALT_ENTER = re.compile(r'\x1b\[\?(?:1049|1047|47)h')
+_ALT_PREFIXES = ("\x1b[?1049h", "\x1b[?1047h", "\x1b[?47h")
+_ALT_EXIT_MODES = ("1049", "1047", "47")
+
+DEFAULT_SIZE = (24, 80)
+# A sequence split across reads is held back at most this long; anything
+# longer is not one the model needs and is dropped.
+MAX_PENDING = 4096
+
+_TOKEN = re.compile(
+    r'\x1b\[([0-?]*)[ -/]*([@-~])'          # CSI: parameters, final byte
+    r'|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)'   # OSC (titles, hyperlinks): ignored
+    r'|\x1b[()*+#%].'                       # charset and line-size selection: ignored
+    r'|\x1b(.)?'                            # other ESC sequences
+    r'|[\x00-\x1f\x7f]', re.S)
+# Colors and attributes, dropped before tokenizing: they are most of the
+# sequences in a redraw stream and change nothing the model keeps.
+_SGR = re.compile(r'\x1b\[[0-9;:]*m')
+_PARTIAL = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[()*+#%])?\Z')
+
+
+def terminal_size(fd):
+    """(rows, columns) of the terminal on fd, or DEFAULT_SIZE if it has none."""
+    try:
+        size = os.get_terminal_size(fd)
+    except OSError:
+        return DEFAULT_SIZE
+    if not size.lines or not size.columns:
+        return DEFAULT_SIZE
+    return size.lines, size.columns
+
+
+def find_alt_enter(text):
+    """Match of the first switch to the alternate screen in text, or None.
+
+    Most output holds no "?" at all, which a one-character find settles at
+    memchr speed; the regex only runs from the first one.
+    """
+    question = text.find("?")
+    if question == -1:
+        return None
+    return ALT_ENTER.search(text, max(0, question - 2))
+
+
+def alt_prefix_at_end(text):
+    """Length of a trailing partial alternate-screen switch in text (0 if none)."""
+    start = text.rfind("\x1b", max(0, len(text) - 8))
+    if start == -1:
+        return 0
+    tail = text[start:]
+    return len(tail) if any(p.startswith(tail) for p in _ALT_PREFIXES) else 0
+
+
+def _params(raw):
+    if not raw:
+        return [0]
+    return [int(part) if part.isdigit() else 0 for part in raw.split(";")]
+
+
+class Screen:
+    """A rows x columns terminal fed with decoded text.
+
+    feed() returns None while the alternate screen is still active, or the
+    text that followed the switch back to the normal screen.
+    """
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.lines = [[" "] * cols for _ in range(rows)]
+        self.row = 0
+        self.col = 0          # cols means a wrap is pending
+        self.top = 0
+        self.bottom = rows - 1
+        self.saved = (0, 0)
+        self.pending = ""
+        self.changed = False
+
+    def snapshot(self):
+        """The screen's text, trailing blanks and blank lines dropped."""
+        self.changed = False
+        text = "\n".join("".join(line).rstrip() for line in self.lines)
+        return text.rstrip("\n")
+
+    def feed(self, text):
+        if self.pending:
+            text = self.pending + text
+            self.pending = ""
+        if not text:
+            return None
+        self.changed = True
+        if "m" in text:
+            text = _SGR.sub("", text)
+        pos = 0
+        for match in _TOKEN.finditer(text):
+            start = match.start()
+            if start > pos:
+                self._print(text[pos:start])
+            pos = match.end()
+            raw, final, char = match.groups()
+            if final is not None:
+                if self._csi(raw, final):
+                    return text[pos:]
+                continue
+            token = match.group()
+            if token[0] != "\x1b":
+                self._control(token)
+            elif token[1:2] in ("", "[", "]", "(", ")", "*", "+", "#", "%") and _PARTIAL.match(text, start):
+                # A sequence cut off by the end of this read.
+                if len(text) - start <= MAX_PENDING:
+                    self.pending = text[start:]
+                return None
+            elif char is not None and self._esc(char):
+                return text[pos:]
+        if pos < len(text):
+            self._print(text[pos:])
+        return None
+
+    def _print(self, run):
+        cols = self.cols
+        col = self.col
+        end = col + len(run)
+        if end <= cols:
+            self.lines[self.row][col:end] = run
+            self.col = end
+            return
+        while run:
+            if self.col >= cols:
+                self.col = 0
+                self._linefeed()
+            line = self.lines[self.row]
+            n = min(len(run), cols - self.col)
+            line[self.col:self.col + n] = run[:n]
+            self.col += n
+            run = run[n:]
+
+    def _control(self, char):
+        if char == "\n" or char == "\x0b" or char == "\x0c":
+            self._linefeed()
+        elif char == "\r":
+            self.col = 0
+        elif char == "\b":
+            self.col = max(0, min(self.col, self.cols - 1) - 1)
+        elif char == "\t":
+            self.col = min(self.cols - 1, (self.col // 8 + 1) * 8)
+
+    def _linefeed(self):
+        if self.row == self.bottom:
+            self._scroll_up(1)
+        elif self.row < self.rows - 1:
+            self.row += 1
+
+    def _blank(self):
+        return [" "] * self.cols
+
+    def _scroll_up(self, n, top=None):
+        top = self.top if top is None else top
+        n = min(n, self.bottom - top + 1)
+        del self.lines[top:top + n]
+        self.lines[self.bottom - n + 1:self.bottom - n + 1] = [self._blank() for _ in range(n)]
+
+    def _scroll_down(self, n, top=None):
+        top = self.top if top is None else top
+        n = min(n, self.bottom - top + 1)
+        del self.lines[self.bottom - n + 1:self.bottom + 1]
+        self.lines[top:top] = [self._blank() for _ in range(n)]
+
+    def _esc(self, char):
+        """Apply one ESC sequence; True if it was a full reset, which leaves the alternate screen."""
+        if char == "c":
+            return True
+        if char == "7":
+            self.saved = (self.row, self.col)
+        elif char == "8":
+            self.row, self.col = self.saved
+        elif char == "D":
+            self._linefeed()
+        elif char == "E":
+            self.col = 0
+            self._linefeed()
+        elif char == "M":
+            if self.row == self.top:
+                self._scroll_down(1)
+            elif self.row > 0:
+                self.row -= 1
+        return False
+
+    def _csi(self, raw, final):
+        """Apply one CSI sequence; True if it left the alternate screen."""
+        rows, cols = self.rows, self.cols
+        if final == "H":
+            # Cursor positioning, by far the most common sequence.
+            row, _, col = raw.partition(";")
+            try:
+                self.row = min(rows, int(row or 1) or 1) - 1
+                self.col = min(cols, int(col or 1) or 1) - 1
+            except ValueError:
+                pass
+            return False
+        if raw.startswith("?"):
+            if final == "l" and any(mode in _ALT_EXIT_MODES for mode in raw[1:].split(";")):
+                return True
+            return False
+        if raw and not raw[0].isdigit() and raw[0] != ";":
+            return False   # other private sequences (>, <, =)
+        row, col = self.row, min(self.col, cols - 1)
+        if final == "s":
+            self.saved = (self.row, self.col)
+            return False
+        if final == "u":
+            self.row, self.col = self.saved
+            return False
+        if final in "HfABCDEFGdJKLMPX@STr":
+            params = _params(raw)
+            n = max(1, params[0])
+        else:
+            return False
+        if final == "f":
+            self.row = min(rows, n) - 1
+            self.col = min(cols, max(1, params[1]) if len(params) > 1 else 1) - 1
+        elif final == "A":
+            self.row = max(self.top if row >= self.top else 0, row - n)
+            self.col = col
+        elif final in "BE":
+            self.row = min(self.bottom if row <= self.bottom else rows - 1, row + n)
+            self.col = 0 if final == "E" else col
+        elif final == "F":
+            self.row = max(self.top if row >= self.top else 0, row - n)
+            self.col = 0
+        elif final == "C":
+            self.col = min(cols - 1, col + n)
+        elif final == "D":
+            self.col = max(0, col - n)
+        elif final == "G":
+            self.col = min(cols, n) - 1
+        elif final == "d":
+            self.row = min(rows, n) - 1
+            self.col = col
+        elif final == "J":
+            mode = params[0]
+            if mode == 0:
+                self.lines[row][col:] = [" "] * (cols - col)
+                for i in range(row + 1, rows):
+                    self.lines[i] = self._blank()
+            elif mode == 1:
+                self.lines[row][:col + 1] = [" "] * (col + 1)
+                for i in range(row):
+                    self.lines[i] = self._blank()
+            elif mode == 2:
+                self.lines = [self._blank() for _ in range(rows)]
+        elif final == "K":
+            mode = params[0]
+            line = self.lines[row]
+            if mode == 0:
+                line[col:] = [" "] * (cols - col)
+            elif mode == 1:
+                line[:col + 1] = [" "] * (col + 1)
+            else:
+                self.lines[row] = self._blank()
+        elif final in "LM":
+            if self.top <= row <= self.bottom:
+                if final == "L":
+                    self._scroll_down(n, row)
+                else:
+                    self._scroll_up(n, row)
+                self.col = 0
+        elif final == "P":
+            line = self.lines[row]
+            n = min(n, cols - col)
+            del line[col:col + n]
+            line.extend(" " * n)
+        elif final == "@":
+            line = self.lines[row]
+            n = min(n, cols - col)
+            line[col:col] = " " * n
+            del line[cols:]
+        elif final == "X":
+            n = min(n, cols - col)
+            self.lines[row][col:col + n] = [" "] * n
+        elif final == "S":
+            self._scroll_up(n)
+        elif final == "T":
+            self._scroll_down(n)
+        elif final == "r":
+            top = max(1, params[0]) - 1
+            bottom = (params[1] if len(params) > 1 and params[1] else rows) - 1
+            if top < bottom < rows:
+                self.top, self.bottom = top, bottom
+                self.row, self.col = 0, 0
+        return False
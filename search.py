@@ -1,19 +1,71 @@
-from storage import load_session
+from storage import open_session, open_event_output
 
-def search_session(trace_file, query):
-    session = load_session(trace_file)
+def output_contains(trace_file, event, needle):
+    """Scan an event's spilled output blob for a lower-case needle, a chunk at a time."""
+    carry = ""
+    with open_event_output(trace_file, event) as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                return False
+            window = carry + chunk.lower()
+            if needle in window:
+                return True
+            carry = window[-(len(needle) - 1):] if len(needle) > 1 else ""
+
+def search_session(trace_file, query, bounds=None, session_id=None, limit=None):
+    session = open_session(trace_file, session_id)
+    if session.format == "sqlite":
+        search_database(session, query, bounds, limit)
+        return
         
-    results = []
+    found = 0
+    needle = query.lower()
     print(f"Searching for '{query}' in {trace_file}...\n")
-    for event in session.get('events', []):
+    for event in session.events(**(bounds or {})):
         cmd = event.get('command', '')
         out = event.get('output', '')
-        if query.lower() in cmd.lower() or query.lower() in out.lower():
-            results.append(event)
+        if (needle in cmd.lower() or needle in out.lower()
+                or (event.get('output_blob') and output_contains(trace_file, event, needle))):
+            found += 1
             print(f"[{event['timestamp']}] Event #{event['id']} (Exit: {event['exit_code']})")
             print(f"$ {cmd}")
             if out:
                 print(f"{out}")
             print("-" * 40)
-            
-    print(f"Found {len(results)} matching events.")
+            if limit is not None and found >= limit:
+                break
+
+    print(f"Found {found} matching events.")
+
+def search_database(db, query, bounds=None, limit=None):
+    """Search a session database through its full-text index."""
+    needle = query.lower()
+    found = 0
+    print(f"Searching for '{query}' in {db.trace_file}...\n")
+    for session_id, event, matched in db.search(query, limit=limit, **(bounds or {})):
+        if not matched and not output_contains(db.trace_file, event, needle):
+            continue
+        found += 1
+        print(f"[{event['timestamp']}] {session_id} Event #{event['id']} (Exit: {event['exit_code']})")
+        print(f"$ {event['command']}")
+        if event.get('output'):
+            print(event['output'])
+        print("-" * 40)
+        if limit is not None and found >= limit:
+            break
+
+    print(f"Found {found} matching events.")
+
+def search_directory(directory, query, limit=20):
+    """Search every trace under a directory through its token index."""
+    from index import query_index
+
+    print(f"Searching for '{query}' in traces under {directory}...\n")
+    hits = query_index(directory, query, limit)
+    for score, trace_file, event_id, (timestamp, exit_code, command) in hits:
+        print(f"[{timestamp}] {trace_file} Event #{event_id} (Exit: {exit_code}) score={score:.2f}")
+        print(f"$ {command}")
+        print("-" * 40)
+
+    print(f"Found {len(hits)} matching events.")
@@ -0,0 +1,155 @@
+import os
+import re
+
+# Opt-in shell integration. Sourcing the script for bash or zsh makes the
+# shell mark its prompt and commands with OSC 133 sequences (the ones
+# terminals like iTerm2, WezTerm and VS Code understand) while it is being
+# recorded:
+#
+#     ESC ] 133 ; A BEL        prompt starts (the previous command finished)
+#     ESC ] 133 ; B BEL        prompt ends, the user types a command
+#     ESC ] 133 ; C BEL        the command starts executing
+#     ESC ] 133 ; D ; <n> BEL  the command finished with exit code n
+#     ESC ] 7 ; file://<host><cwd> BEL   current directory
+#
+# With markers the recorder knows exactly where each command starts and
+# ends, its real exit code and its working directory; without them it
+# falls back to guessing from keystrokes and output.
+
+BASH_SCRIPT = r'''
+# iris shell integration for bash (4.4+): eval "$(iris shell-init bash)" in ~/.bashrc
+if [ -n "$IRIS_RECORDING" ] && [ -z "$__iris_integrated" ]; then
+    __iris_integrated=1
+    __iris_precmd() {
+        local code=$?
+        printf '\033]133;D;%s\007\033]7;file://%s%s\007\033]133;A\007' "$code" "$HOSTNAME" "$PWD"
+        return $code
+    }
+    PROMPT_COMMAND="__iris_precmd${PROMPT_COMMAND:+; $PROMPT_COMMAND}"
+    PS1="$PS1"'\[\e]133;B\a\]'
+    PS0='\e]133;C\a'"$PS0"
+fi
+'''
+
+ZSH_SCRIPT = r'''
+# iris shell integration for zsh: eval "$(iris shell-init zsh)" in ~/.zshrc
+if [[ -n "$IRIS_RECORDING" && -z "$__iris_integrated" ]]; then
+    __iris_integrated=1
+    __iris_precmd() {
+        local code=$?
+        printf '\033]133;D;%s\007\033]7;file://%s%s\007\033]133;A\007' "$code" "$HOST" "$PWD"
+    }
+    __iris_preexec() { printf '\033]133;C\007' }
+    autoload -Uz add-zsh-hook
+    add-zsh-hook preexec __iris_preexec
+    # Runs before any other precmd hook, while $? is still the command's.
+    precmd_functions=(__iris_precmd ${precmd_functions:#__iris_precmd})
+    PS1="$PS1%{"$'\e]133;B\a'"%}"
+fi
+'''
+
+SCRIPTS = {"bash": BASH_SCRIPT, "zsh": ZSH_SCRIPT}
+
+_OSC = re.compile(b"\x1b\\]")
+# An unterminated OSC longer than this is not one of ours; it is passed
+# through as output instead of being buffered.
+MAX_MARKER_BYTES = 4096
+
+
+def init_script(shell=None):
+    """Integration script for a shell name or path (default: $SHELL)."""
+    name = os.path.basename(shell or os.environ.get("SHELL", "bash"))
+    if name not in SCRIPTS:
+        raise ValueError(f"no shell integration for {name!r} (supported: {', '.join(SCRIPTS)})")
+    return SCRIPTS[name].lstrip("\n")
+
+
+def _find_osc(data, pos):
+    """Index of the next ESC ] at or after pos, or -1.
+
+    Most chunks hold no ESC at all, which a one-byte find (memchr) settles
+    at once; otherwise the regex engine finds the two-byte introducer
+    faster than bytes.find does.
+    """
+    if data.find(b"\x1b", pos) == -1:
+        return -1
+    match = _OSC.search(data, pos)
+    return match.start() if match else -1
+
+
+def _marker(body):
+    """(kind, value) for an OSC body we understand, else None."""
+    if body.startswith(b"133;") and len(body) >= 5:
+        kind = chr(body[4])
+        if kind == "D":
+            try:
+                return "D", int(body[6:])
+            except ValueError:
+                return "D", None
+        if kind in "ABC":
+            return kind, None
+    elif body.startswith(b"7;file://"):
+        rest = body[len(b"7;file://"):]
+        slash = rest.find(b"/")
+        if slash != -1:
+            return "cwd", rest[slash:].decode("utf-8", errors="replace")
+    return None
+
+
+class MarkerParser:
+    """Splits terminal output into plain output and shell-integration markers.
+
+    feed() takes each chunk read from the PTY and returns a list of
+    ("output", bytes) and (kind, value) items in order: kind is "A", "B",
+    "C" or "D" (value is the exit code) or "cwd" (value is the path). A
+    marker split across reads is held back until it is complete. Chunks
+    without an escape character cost one memchr-speed scan.
+    """
+
+    def __init__(self):
+        self.pending = b""
+        self.seen = False
+
+    def feed(self, data):
+        data = self.pending + bytes(data) if self.pending else bytes(data)
+        self.pending = b""
+        items = []
+        pos = 0
+        while True:
+            start = _find_osc(data, pos)
+            if start == -1:
+                # A trailing ESC may begin the next chunk's marker.
+                end = len(data) - 1 if data.endswith(b"\x1b") else len(data)
+                if end > pos:
+                    items.append(("output", data[pos:end]))
+                self.pending = data[end:]
+                return items
+            limit = start + MAX_MARKER_BYTES
+            bel = data.find(b"\x07", start + 2, limit)
+            st = data.find(b"\x1b\\", start + 2, limit)
+            if bel == -1 and st == -1:
+                if len(data) >= limit:
+                    items.append(("output", data[pos:start + 2]))
+                    pos = start + 2
+                    continue
+                if start > pos:
+                    items.append(("output", data[pos:start]))
+                self.pending = data[start:]
+                return items
+            end, term = (bel, 1) if st == -1 or (bel != -1 and bel < st) else (st, 2)
+            interrupted = data.find(b"\x1b", start + 2, end)
+            if interrupted != -1:
+                # Another escape sequence began before this one ended.
+                items.append(("output", data[pos:interrupted]))
+                pos = interrupted
+                continue
+            marker = _marker(data[start + 2:end])
+            if marker is None:
+                # Someone else's OSC (a window title, a hyperlink): leave it in the output.
+                items.append(("output", data[pos:end + term]))
+            else:
+                self.seen = True
+                if start > pos:
+                    items.append(("output", data[pos:start]))
+                items.append(marker)
+            pos = end + term
@@ -1,24 +1,763 @@
+import io
 import json
 import os
 import sys
-import socket
+import time
+import zlib
+import datetime
+import struct
+import metrics
 
-def load_session(trace_file):
+# Streamed traces are JSON lines: a header record, one line per event, and a
+# footer record written when the session ends cleanly.
+STREAM_FORMAT = "iris-stream"
+STREAM_VERSION = 1
+
+# Compressed traces: a preamble (magic, codec id, newline), then frames of
+# one type byte, a 4-byte big-endian length and a compressed payload. The
+# first frame is the header record, then blocks of JSON-lines events, then
+# an index of block offsets with id/timestamp ranges and the footer. The
+# file ends with the index offset and TRAILER_MAGIC.
+COMPRESSED_MAGIC = b"IRISZ1"
+TRAILER_MAGIC = b"IRISZEND"
+BLOCK_EVENTS = 256
+BLOCK_BYTES = 1024 * 1024
+
+# Longest first line that is tried as a stream header, and the read size
+# for parsing legacy single-document traces incrementally.
+HEADER_LINE_LIMIT = 64 * 1024
+READ_CHUNK = 1024 * 1024
+
+# How hard to push streamed events to disk: "never" only flushes to the OS
+# (survives a crash or kill -9 of iris), "always" fsyncs after every event
+# (survives power loss), and a number fsyncs at most every N seconds.
+FSYNC_POLICY = os.environ.get("IRIS_FSYNC", "never")
+
+# Whether writers delta-encode repeated outputs by default (see delta.py).
+DELTA_DEFAULT = os.environ.get("IRIS_DELTA", "") not in ("", "0")
+
+# Where new sessions are saved: "trace" writes a .trace file per session in
+# the current directory, "sqlite" writes every session into one database
+# (see database.py).
+STORAGE_BACKEND = os.environ.get("IRIS_STORAGE", "trace").strip().lower()
+DATABASE_PATH = os.environ.get("IRIS_DB", os.path.join(os.path.expanduser("~"), ".iris", "iris.db"))
+SQLITE_MAGIC = b"SQLite format 3\x00"
+DATABASE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+def _delta_encoder(delta):
+    """Encoder for a writer's delta option (None follows IRIS_DELTA), or None when off."""
+    if not (DELTA_DEFAULT if delta is None else delta):
+        return None
+    from delta import DeltaEncoder
+    return DeltaEncoder()
+
+
+def _hostname():
+    # socket is only needed for this; importing it lazily keeps 'iris run' quick to start.
+    import socket
+    return socket.gethostname()
+
+
+def _fsync_interval(policy):
+    """Translate an fsync policy into seconds between fsyncs (None = never)."""
+    policy = str(policy).strip().lower()
+    if policy in ("", "never", "off", "no"):
+        return None
+    if policy in ("always", "on", "yes"):
+        return 0.0
+    try:
+        return max(0.0, float(policy))
+    except ValueError:
+        return None
+
+
+class TraceWriter:
+    """Append-only writer for the streaming trace format.
+
+    Every event is written and flushed as soon as it is appended, so an
+    interrupted session can be recovered up to its last complete event.
+    The writer also behaves like the plain events list passed to
+    build_event, which only needs len() to number the next event.
+    """
+
+    def __init__(self, trace_file, session_id, start_dt, hostname=None, fsync=None, buffered=False, extra=None,
+                 delta=None):
+        self.trace_file = trace_file
+        self.count = 0
+        self._delta = _delta_encoder(delta)
+        self._buffered = buffered
+        self._fsync_every = _fsync_interval(FSYNC_POLICY if fsync is None else fsync)
+        self._last_fsync = time.monotonic()
+        self._f = open(trace_file, 'w')
+        header = {
+            "type": "header",
+            "format": STREAM_FORMAT,
+            "version": STREAM_VERSION,
+            "session_id": session_id,
+            "start_time": start_dt.isoformat(),
+            "hostname": hostname or _hostname(),
+        }
+        if self._delta is not None:
+            header["delta"] = True
+        header.update(extra or {})
+        self._write(header)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, event):
+        started = metrics.clock()
+        self._write(event if self._delta is None else self._delta.encode(event))
+        self.count += 1
+        metrics.elapsed("serialize", started)
+        metrics.count("events_written")
+
+    def sync(self):
+        """Flush buffered events and fsync them, whatever the fsync policy."""
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_fsync = time.monotonic()
+
+    def close(self, end_dt):
+        if self._f is None:
+            return
+        self._write({
+            "type": "footer",
+            "end_time": end_dt.isoformat(),
+            "event_count": self.count,
+        }, force_sync=True)
+        self._f.close()
+        self._f = None
+
+    def _write(self, record, force_sync=False):
+        self._f.write(json.dumps(record) + "\n")
+        if self._buffered and not force_sync:
+            return
+        self._f.flush()
+        if self._fsync_every is None:
+            return
+        now = time.monotonic()
+        if force_sync or now - self._last_fsync >= self._fsync_every:
+            os.fsync(self._f.fileno())
+            self._last_fsync = now
+
+
+def _lzma_compress(data):
+    import lzma
+    return lzma.compress(data)
+
+
+def _lzma_decompress(data):
+    import lzma
+    return lzma.decompress(data)
+
+
+CODECS = {
+    "zlib": (b"z", lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (b"x", _lzma_compress, _lzma_decompress),
+}
+
+
+def _codec_by_id(codec_id):
+    for codec in CODECS.values():
+        if codec[0] == codec_id:
+            return codec
+    raise ValueError(f"unknown trace codec {codec_id!r}")
+
+
+def _read_frame(f):
+    head = f.read(5)
+    if len(head) < 5:
+        return None, None
+    length = struct.unpack(">I", head[1:])[0]
+    payload = f.read(length)
+    if len(payload) < length:
+        return None, None
+    return head[:1], payload
+
+
+class CompressedTraceWriter:
+    """Writes the block-compressed trace format.
+
+    Events are buffered into blocks that are compressed independently, so
+    readers can decompress only the blocks holding the events they need.
+    A crash loses at most the block still being filled.
+    """
+
+    def __init__(self, trace_file, session_id, start_dt, hostname=None, codec="zlib",
+                 block_events=BLOCK_EVENTS, block_bytes=BLOCK_BYTES, delta=None, extra=None):
+        self.trace_file = trace_file
+        self.count = 0
+        self._delta = _delta_encoder(delta)
+        self.codec = CODECS[codec]
+        self.block_events = block_events
+        self.block_bytes = block_bytes
+        self.blocks = []
+        self._lines = []
+        self._size = 0
+        self._ids = []
+        self._times = []
+        self._f = open(trace_file, 'wb')
+        self._f.write(COMPRESSED_MAGIC + self.codec[0] + b"\n")
+        header = {
+            "type": "header",
+            "format": STREAM_FORMAT,
+            "version": STREAM_VERSION,
+            "session_id": session_id,
+            "start_time": start_dt.isoformat(),
+            "hostname": hostname or _hostname(),
+        }
+        if self._delta is not None:
+            header["delta"] = True
+        header.update(extra or {})
+        self._frame(b"H", header)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, event):
+        started = metrics.clock()
+        line = json.dumps(event if self._delta is None else self._delta.encode(event))
+        self._lines.append(line)
+        self._size += len(line)
+        if event.get("id") is not None:
+            self._ids.append(event["id"])
+        if event.get("timestamp"):
+            self._times.append(event["timestamp"])
+        self.count += 1
+        if len(self._lines) >= self.block_events or self._size >= self.block_bytes:
+            self._flush_block()
+        metrics.elapsed("serialize", started)
+        metrics.count("events_written")
+
+    def close(self, end_dt):
+        if self._f is None:
+            return
+        self._flush_block()
+        index_offset = self._f.tell()
+        self._frame(b"I", {
+            "blocks": self.blocks,
+            "footer": {"type": "footer", "end_time": end_dt.isoformat(), "event_count": self.count},
+        })
+        self._f.write(struct.pack(">Q", index_offset) + TRAILER_MAGIC)
+        self._f.close()
+        self._f = None
+
+    def _flush_block(self):
+        if not self._lines:
+            return
+        offset = self._f.tell()
+        self._write_frame(b"E", "\n".join(self._lines).encode('utf-8'))
+        self.blocks.append([
+            offset,
+            min(self._ids) if self._ids else None,
+            max(self._ids) if self._ids else None,
+            min(self._times) if self._times else None,
+            max(self._times) if self._times else None,
+            len(self._lines),
+        ])
+        self._f.flush()
+        self._lines, self._size, self._ids, self._times = [], 0, [], []
+
+    def _frame(self, kind, record):
+        self._write_frame(kind, json.dumps(record).encode('utf-8'))
+
+    def _write_frame(self, kind, data):
+        payload = self.codec[1](data)
+        self._f.write(kind + struct.pack(">I", len(payload)) + payload)
+
+
+def open_trace_writer(trace_file, session_id, start_dt, hostname=None, compressed=False, codec="zlib", delta=None,
+                      extra=None):
+    """Create a writer for the streamed or the compressed trace format."""
+    if compressed:
+        return CompressedTraceWriter(trace_file, session_id, start_dt, hostname=hostname, codec=codec, delta=delta,
+                                     extra=extra)
+    return TraceWriter(trace_file, session_id, start_dt, hostname=hostname, buffered=True, delta=delta, extra=extra)
+
+
+def session_path(trace_file):
+    """Where a new session that would be saved as trace_file actually goes."""
+    if STORAGE_BACKEND == "sqlite":
+        return DATABASE_PATH
+    return trace_file
+
+
+def session_writer(trace_file, session_id, start_dt, hostname=None, buffered=False, extra=None):
+    """Writer for a new session: a TraceWriter, or the database with IRIS_STORAGE=sqlite."""
+    if STORAGE_BACKEND == "sqlite":
+        from database import DatabaseWriter
+        os.makedirs(os.path.dirname(DATABASE_PATH) or ".", exist_ok=True)
+        return DatabaseWriter(DATABASE_PATH, session_id, start_dt, hostname=hostname, buffered=buffered, extra=extra)
+    return TraceWriter(trace_file, session_id, start_dt, hostname=hostname, buffered=buffered, extra=extra)
+
+
+def is_database(path):
+    """Whether path is a session database rather than a trace (by extension if it does not exist yet)."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    except FileNotFoundError:
+        return path.lower().endswith(DATABASE_EXTENSIONS)
+    except OSError:
+        return False
+
+
+def write_json(path, data):
+    """Write data as compact JSON to path atomically, through a temporary file."""
+    tmp = path + ".tmp"
+    # json.dumps uses the C encoder; json.dump to a file does not.
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(data, separators=(',', ':')))
+    os.replace(tmp, path)
+
+
+def blob_dir(trace_file):
+    """Directory holding the spilled command outputs of a trace."""
+    return os.path.splitext(trace_file)[0] + ".blobs"
+
+
+def blob_path(trace_file, event):
+    ref = event.get("output_blob")
+    if not ref:
+        return None
+    return os.path.join(blob_dir(trace_file), ref["sha256"])
+
+
+def copy_blob(src_trace, dst_trace, event):
+    """Copy the output blob event references, if any, from next to src_trace to next to dst_trace."""
+    src = blob_path(src_trace, event)
+    if not src or not os.path.exists(src):
+        return
+    dst = blob_path(dst_trace, event)
+    if not os.path.exists(dst):
+        import shutil
+        os.makedirs(blob_dir(dst_trace), exist_ok=True)
+        shutil.copyfile(src, dst)
+
+
+def open_event_output(trace_file, event):
+    """Open an event's full output for reading, from its blob when it has one."""
+    path = blob_path(trace_file, event)
+    if path and os.path.exists(path):
+        return open(path, encoding='utf-8')
+    return io.StringIO(event.get('output', ''))
+
+
+def _parse_stream_header(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(record, dict) and record.get("format") == STREAM_FORMAT:
+        return record
+    return None
+
+
+def _legacy_records(trace_file, chunk_size=READ_CHUNK):
+    """Incrementally parse a single-document JSON trace.
+
+    Yields ("field", key, value) for top-level keys and ("event", None,
+    event) for each entry of "events", holding one event in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open(trace_file) as f:
+        buf = f.read(chunk_size)
+        pos = 0
+        eof = not buf
+
+        def fill(want_more):
+            # Drop consumed text; when a value did not fit, read at least as
+            # much again so a huge value is parsed in a logarithmic number of tries.
+            nonlocal buf, pos, eof
+            buf = buf[pos:]
+            pos = 0
+            if eof:
+                return False
+            data = f.read(max(chunk_size, len(buf)) if want_more else chunk_size)
+            if not data:
+                eof = True
+                return False
+            buf += data
+            return True
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buf) or not fill(False):
+                    return buf[pos:pos + 1]
+
+        def value():
+            nonlocal pos
+            skip_ws()
+            while True:
+                try:
+                    result, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if fill(True):
+                        continue
+                    raise
+                # A number may continue in the next chunk.
+                if end == len(buf) and fill(True):
+                    continue
+                pos = end
+                return result
+
+        def expect(chars):
+            nonlocal pos
+            c = skip_ws()
+            if not c or c not in chars:
+                raise ValueError(f"{trace_file}: expected one of {chars!r} at offset {pos}")
+            pos += 1
+            return c
+
+        expect('{')
+        if skip_ws() == '}':
+            return
+        while True:
+            key = value()
+            expect(':')
+            if key == "events" and skip_ws() == '[':
+                pos += 1
+                if skip_ws() == ']':
+                    pos += 1
+                else:
+                    while True:
+                        yield "event", None, value()
+                        if expect(',]') == ']':
+                            break
+            else:
+                yield "field", key, value()
+            if expect(',}') == '}':
+                return
+
+
+_OUTPUT_KEY = '"output": "'
+
+
+def _without_output(line):
+    """Cut the output string out of an event line before decoding it.
+
+    Decoding dominates reading a trace, and most of each line is output.
+    Inside a JSON string every quote is escaped, so the key cannot occur
+    within a value; the string ends at the first quote not preceded by an
+    odd number of backslashes. Anything unexpected returns the line as is.
+    """
+    start = line.find(_OUTPUT_KEY)
+    if start == -1:
+        return line
+    pos = start + len(_OUTPUT_KEY)
+    while True:
+        pos = line.find('"', pos)
+        if pos == -1:
+            return line
+        slashes = 0
+        while line[pos - 1 - slashes] == '\\':
+            slashes += 1
+        if slashes % 2 == 0:
+            return line[:start] + '"output": ""' + line[pos + 1:]
+        pos += 1
+
+
+def _in_range(event, first_id, last_id, since, until):
+    if first_id is not None or last_id is not None:
+        eid = event.get("id")
+        if eid is None or (first_id is not None and eid < first_id) or (last_id is not None and eid > last_id):
+            return False
+    if since is not None or until is not None:
+        ts = event.get("timestamp") or ""
+        if (since is not None and ts < since) or (until is not None and ts > until):
+            return False
+    return True
+
+
+class SessionReader:
+    """Read-side view of a trace in any supported format.
+
+    header holds the session fields (session_id, start_time, hostname).
+    events() yields events one at a time, optionally limited to an id or
+    timestamp range and projected onto a subset of fields, so memory stays
+    flat however large the trace is; compressed traces only decompress the
+    blocks that can hold matching events. end_time is known once events()
+    has been read to the end (or from the index of a compressed trace, or
+    the fields of a legacy JSON trace).
+    """
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.end_time = None
+        self.recovered = False
+        self._index = None
+        self._session = None
+        with open(trace_file, 'rb') as f:
+            magic = f.read(len(COMPRESSED_MAGIC))
+        if magic == COMPRESSED_MAGIC:
+            self.format = "compressed"
+            self._open_compressed()
+            return
+        with open(trace_file) as f:
+            # Header records are short; a legacy file may be one huge line.
+            header = _parse_stream_header(f.readline(HEADER_LINE_LIMIT))
+        if header is not None:
+            self.format = "stream"
+            self.header = header
+        else:
+            self.format = "json"
+            self.header = {}
+            for kind, key, value in _legacy_records(trace_file):
+                if kind == "event":
+                    break
+                self.header[key] = value
+            self.end_time = self.header.get("end_time")
+
+    def events(self, first_id=None, last_id=None, since=None, until=None, fields=None):
+        """Yield events in order; fields limits each event to those keys (e.g. to skip "output")."""
+        skip_output = fields is not None and "output" not in fields
+        source = self._raw_events(first_id, last_id, since, until, skip_output)
+        decoder = None
+        if self.header.get("delta") and not skip_output:
+            from delta import DeltaDecoder
+            decoder = DeltaDecoder(self._delta_base)
+        for event in source:
+            if decoder is not None:
+                event = decoder.decode(event)
+            elif skip_output:
+                event.pop("output_delta", None)
+            if _in_range(event, first_id, last_id, since, until):
+                if fields is not None:
+                    event = {k: event[k] for k in fields if k in event}
+                yield event
+
+    def _raw_events(self, first_id, last_id, since, until, skip_output):
+        if self.format == "compressed":
+            return self._compressed_events(first_id, last_id, since, until, skip_output)
+        if self.format == "stream":
+            return self._stream_events(last_id, skip_output)
+        return self._legacy_events()
+
+    def _delta_base(self, keyframe_id, base_id):
+        """Output lines of event base_id, decoded afresh from its chain's keyframe."""
+        from delta import DeltaDecoder, delta_key
+
+        def missing(*ids):
+            raise ValueError(f"{self.trace_file}: delta base event #{base_id} is missing")
+
+        # Only the chain itself is decoded: the keyframe and the later events of its command.
+        decoder = DeltaDecoder(missing)
+        key = None
+        for event in self._raw_events(keyframe_id, base_id, None, None, False):
+            event_id = event.get("id")
+            if event_id is None or event_id < keyframe_id:
+                continue
+            if key is None:
+                key = delta_key(event.get("command", ""))
+            elif delta_key(event.get("command", "")) != key:
+                continue
+            event = decoder.decode(event)
+            if event_id == base_id:
+                return event["output"].split("\n")
+        missing()
+
+    def _legacy_events(self):
+        for kind, key, value in _legacy_records(self.trace_file):
+            if kind == "event":
+                yield value
+            else:
+                self.header[key] = value
+                if key == "end_time":
+                    self.end_time = value
+
+    def _recovered(self, count, last_event):
+        self.recovered = True
+        if self.end_time is None:
+            self.end_time = last_event.get("timestamp") if last_event else self.header.get("start_time")
+        print(f"Warning: {self.trace_file} was not closed cleanly; recovered {count} events.",
+              file=sys.stderr)
+
+    def _stream_events(self, last_id, skip_output=False):
+        count = 0
+        event = None
+        with open(self.trace_file) as f:
+            f.readline()
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(_without_output(line) if skip_output else line)
+                except ValueError:
+                    # A torn final line from a crash; keep everything before it.
+                    break
+                if record.get("type") == "footer":
+                    self.end_time = record.get("end_time")
+                    return
+                event = record
+                count += 1
+                yield event
+                # Ids only grow within a stream, so nothing later can match.
+                if last_id is not None and (event.get("id") or 0) >= last_id:
+                    return
+        self._recovered(count, event)
+
+    def _open_compressed(self):
+        with open(self.trace_file, 'rb') as f:
+            preamble = f.read(len(COMPRESSED_MAGIC) + 2)
+            self.codec = _codec_by_id(preamble[len(COMPRESSED_MAGIC):len(COMPRESSED_MAGIC) + 1])
+            kind, payload = _read_frame(f)
+            self.header = json.loads(self.codec[2](payload)) if kind == b"H" else {}
+            self._blocks_start = f.tell()
+
+            # A clean file ends with the index offset and a trailer magic.
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size >= self._blocks_start + 8 + len(TRAILER_MAGIC):
+                f.seek(size - 8 - len(TRAILER_MAGIC))
+                tail = f.read()
+                if tail[8:] == TRAILER_MAGIC:
+                    f.seek(struct.unpack(">Q", tail[:8])[0])
+                    kind, payload = _read_frame(f)
+                    if kind == b"I":
+                        self._index = json.loads(self.codec[2](payload))
+                        self.end_time = self._index.get("footer", {}).get("end_time")
+
+    def _compressed_events(self, first_id, last_id, since, until, skip_output=False):
+        decompress = self.codec[2]
+        parse = (lambda line: json.loads(_without_output(line))) if skip_output else json.loads
+        with open(self.trace_file, 'rb') as f:
+            if self._index is not None:
+                for offset, block_first, block_last, block_since, block_until, count in self._index["blocks"]:
+                    if first_id is not None and block_last is not None and block_last < first_id:
+                        continue
+                    if last_id is not None and block_first is not None and block_first > last_id:
+                        continue
+                    if since is not None and block_until is not None and block_until < since:
+                        continue
+                    if until is not None and block_since is not None and block_since > until:
+                        continue
+                    f.seek(offset)
+                    kind, payload = _read_frame(f)
+                    for line in decompress(payload).decode('utf-8').split('\n'):
+                        yield parse(line)
+                return
+
+            # No index: walk the blocks until the first torn one.
+            count = 0
+            event = None
+            f.seek(self._blocks_start)
+            while True:
+                kind, payload = _read_frame(f)
+                if kind != b"E":
+                    break
+                try:
+                    lines = decompress(payload).decode('utf-8').split('\n')
+                except Exception:
+                    break
+                for line in lines:
+                    event = parse(line)
+                    count += 1
+                    yield event
+            self._recovered(count, event)
+
+
+def event_range(start=None, end=None):
+    """Turn --from/--to values into events() bounds.
+
+    A plain number is an event id; anything else is an ISO timestamp and
+    is compared against event timestamps as text.
+    """
+    bounds = {}
+    for value, id_key, time_key in ((start, "first_id", "since"), (end, "last_id", "until")):
+        if value is None:
+            continue
+        if value.isdigit():
+            bounds[id_key] = int(value)
+        else:
+            bounds[time_key] = value
+    return bounds
+
+
+def open_session(trace_file, session=None):
+    """Reader for a trace, or for a session database (all sessions, or one by session_id or row)."""
     if not os.path.exists(trace_file):
         print(f"Error: File {trace_file} not found.")
         sys.exit(1)
-        
-    with open(trace_file) as f:
-        return json.load(f)
+    if is_database(trace_file):
+        from database import DatabaseSession
+        try:
+            return DatabaseSession(trace_file, session)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    if session is not None:
+        print(f"Error: --session only applies to a session database, not {trace_file}.")
+        sys.exit(1)
+    return SessionReader(trace_file)
 
-def save_session(trace_file, session_id, start_dt, end_dt, events):
-    hostname = socket.gethostname()
-    session = {
-        "session_id": session_id,
-        "start_time": start_dt.isoformat(),
-        "end_time": end_dt.isoformat(),
-        "hostname": hostname,
-        "events": events
+
+def load_session(trace_file, session=None):
+    reader = open_session(trace_file, session)
+    events = list(reader.events())
+    return {
+        "session_id": reader.header.get("session_id"),
+        "start_time": reader.header.get("start_time"),
+        "end_time": reader.end_time,
+        "hostname": reader.header.get("hostname"),
+        "events": events,
     }
-    with open(trace_file, 'w') as f:
-        json.dump(session, f, indent=2)
+
+def save_session(trace_file, session_id, start_dt, end_dt, events):
+    """Write a finished session to trace_file, or to the database with IRIS_STORAGE=sqlite."""
+    hostname = _hostname()
+    writer = session_writer(trace_file, session_id, start_dt, hostname=hostname, buffered=True)
+    try:
+        for event in events:
+            writer.append(event)
+    finally:
+        writer.close(end_dt)
+
+
+def convert_session(src, dst, fmt="stream", codec="zlib", delta=None):
+    """Rewrite a trace as "stream", "compressed", legacy "json" or into a "sqlite" database.
+
+    Output blobs are copied along. delta=True delta-encodes repeated
+    outputs, False writes every output in full; None keeps the source
+    trace's choice. Legacy JSON and databases always keep outputs in full.
+    """
+    reader = open_session(src)
+    header = reader.header
+    if fmt == "sqlite":
+        from database import DatabaseWriter
+        extra = {k: v for k, v in header.items() if k not in ("type", "format", "version", "session_id",
+                                                              "start_time", "hostname", "delta")}
+        writer = DatabaseWriter(dst, header.get("session_id"), datetime.datetime.fromisoformat(header.get("start_time")),
+                                hostname=header.get("hostname"), buffered=True, extra=extra)
+        try:
+            for event in reader.events():
+                writer.append(event)
+        finally:
+            writer.close(datetime.datetime.fromisoformat(reader.end_time or header.get("start_time")))
+        count = len(writer)
+    elif fmt == "json":
+        session = load_session(src)
+        with open(dst, 'w') as f:
+            f.write(json.dumps(session, indent=2))
+        count = len(session["events"])
+    else:
+        start_dt = datetime.datetime.fromisoformat(header.get("start_time"))
+        if delta is None:
+            delta = bool(header.get("delta"))
+        writer = open_trace_writer(dst, header.get("session_id"), start_dt, hostname=header.get("hostname"),
+                                   compressed=fmt == "compressed", codec=codec, delta=delta)
+        try:
+            for event in reader.events():
+                writer.append(event)
+        finally:
+            end_time = reader.end_time or header.get("start_time")
+            writer.close(datetime.datetime.fromisoformat(end_time))
+        count = len(writer)
+    if os.path.isdir(blob_dir(src)) and os.path.abspath(blob_dir(src)) != os.path.abspath(blob_dir(dst)):
+        import shutil
+        shutil.copytree(blob_dir(src), blob_dir(dst), dirs_exist_ok=True)
+    return count
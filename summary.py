@@ -1,21 +1,342 @@
+import os
+import json
+import math
+import heapq
 import datetime
-from storage import load_session
-
-def summarize_session(trace_file):
-    session = load_session(trace_file)
-        
-    events = session.get('events', [])
-    err_count = sum(1 for e in events if e.get('exit_code', 0) != 0)
-    
+from storage import open_session, is_database, write_json
+
+# Rows shown per section, and how many slowest commands each trace keeps in
+# the directory cache (the most --top can show across a directory).
+TOP_N = 10
+CACHED_TOP = 50
+
+# Durations go into a histogram with buckets HIST_RATIO apart, so merged
+# percentiles stay within 2% without keeping every duration.
+HIST_RATIO = 1.02
+
+# Wrappers skipped when normalizing, and tools whose first argument names
+# the actual work (git commit, docker build).
+COMMAND_PREFIXES = {"sudo", "time", "env", "nohup", "nice", "exec", "command", "iris"}
+SUBCOMMAND_TOOLS = {
+    "git", "docker", "docker-compose", "kubectl", "helm", "npm", "pnpm", "yarn", "cargo",
+    "go", "make", "poetry", "pip", "pip3", "uv", "terraform", "gh", "systemctl", "brew",
+    "apt", "apt-get", "dotnet", "mvn", "gradle", "bundle", "rails", "conda",
+}
+
+SUMMARY_CACHE = "summary.json"
+SUMMARY_CACHE_VERSION = 1
+
+
+def normalize_command(command):
+    """Group key for a command: the program plus a subcommand where it matters.
+
+    'pytest -x tests/' and 'pytest' both become 'pytest'; 'git commit -m x'
+    becomes 'git commit'; 'FOO=1 sudo python -m pytest' becomes
+    'python -m pytest'.
+    """
+    words = command.split()
+    while words and (words[0] in COMMAND_PREFIXES or ('=' in words[0] and not words[0].startswith('='))):
+        words = words[1:]
+    if not words:
+        return command.strip()
+    program = os.path.basename(words[0])
+    rest = words[1:]
+    if program.startswith("python") and len(rest) >= 2 and rest[0] == "-m":
+        return f"{program} -m {rest[1]}"
+    if program in SUBCOMMAND_TOOLS and rest and rest[0].replace('-', '').isalpha():
+        return f"{program} {rest[0]}"
+    return program
+
+
+def duration_bucket(ms):
+    """Histogram bucket of a duration: 0 for none, then one per HIST_RATIO step."""
+    return 0 if ms <= 0 else int(math.log(ms) / math.log(HIST_RATIO)) + 1
+
+
+def _bucket_ms(bucket):
+    # Geometric middle of the bucket's range.
+    return 0 if bucket == 0 else int(round(HIST_RATIO ** (bucket - 0.5)))
+
+
+def _fmt_ms(ms):
+    if ms < 1000:
+        return f"{int(ms)}ms"
+    sec = ms / 1000
+    if sec < 60:
+        return f"{sec:.1f}s"
+    minutes, sec = divmod(int(sec), 60)
+    if minutes < 60:
+        return f"{minutes}m {sec:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+
+class SessionStats:
+    """Mergeable aggregates over the events of one or more traces.
+
+    Everything kept is a count, a sum, a histogram or a bounded top list,
+    so the stats of thousands of traces combine in little memory and each
+    trace's stats can be cached as JSON.
+    """
+
+    def __init__(self):
+        self.sessions = 0
+        self.commands = 0
+        self.errors = 0
+        self.total_ms = 0
+        self.max_ms = 0
+        self.wall_sec = 0
+        self.hist = {}
+        self.top = []
+        self.groups = {}
+        self.hosts = {}
+        self.terminals = {}
+        # Resource totals for events recorded by 'iris run'.
+        self.measured = 0
+        self.cpu = [0, 0]
+        self.blocks = [0, 0]
+        self.peak_rss = None
+        self.first_output = [0, 0, 0]
+
+    def add_session(self, header, end_time):
+        self.sessions += 1
+        try:
+            start = datetime.datetime.fromisoformat(header['start_time'])
+            end = datetime.datetime.fromisoformat(end_time)
+            self.wall_sec += max(0, int((end - start).total_seconds()))
+        except Exception:
+            self.wall_sec += self.total_ms // 1000
+
+    def add(self, event, host, terminal, source):
+        ms = event.get('duration_ms') or 0
+        command = event.get('command', '')
+        failed = event.get('exit_code', 0) != 0
+        self.commands += 1
+        self.errors += failed
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        bucket = str(duration_bucket(ms))
+        self.hist[bucket] = self.hist.get(bucket, 0) + 1
+
+        entry = [ms, command, event.get('timestamp'), source, event.get('id')]
+        if len(self.top) < CACHED_TOP:
+            heapq.heappush(self.top, entry)
+        elif ms > self.top[0][0]:
+            heapq.heapreplace(self.top, entry)
+
+        name = normalize_command(command)
+        group = self.groups.get(name)
+        if group is None:
+            group = self.groups[name] = [0, 0, 0, 0]
+        group[0] += 1
+        group[1] += ms
+        group[2] = max(group[2], ms)
+        group[3] += failed
+
+        host = event.get('host') or host or "unknown"
+        terminal = f"{host} {event.get('terminal') or terminal}"
+        self.hosts[host] = self.hosts.get(host, 0) + ms
+        self.terminals[terminal] = self.terminals.get(terminal, 0) + ms
+
+        res = event.get('resources')
+        if res:
+            if res.get('first_output_ms') is not None:
+                self.first_output[0] += res['first_output_ms']
+                self.first_output[1] += 1
+                self.first_output[2] = max(self.first_output[2], res['first_output_ms'])
+            if 'user_ms' in res:
+                self.measured += 1
+                self.cpu[0] += res['user_ms']
+                self.cpu[1] += res['sys_ms']
+                self.blocks[0] += res['in_blocks']
+                self.blocks[1] += res['out_blocks']
+                # Left out when it could not be told apart from iris's own.
+                if 'max_rss_kb' in res and (self.peak_rss is None or res['max_rss_kb'] > self.peak_rss[0]):
+                    self.peak_rss = [res['max_rss_kb'], command]
+
+    def merge(self, other):
+        self.sessions += other.sessions
+        self.commands += other.commands
+        self.errors += other.errors
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.wall_sec += other.wall_sec
+        for bucket, count in other.hist.items():
+            self.hist[bucket] = self.hist.get(bucket, 0) + count
+        self.top = heapq.nlargest(CACHED_TOP, self.top + other.top, key=lambda e: e[0])
+        heapq.heapify(self.top)
+        for name, (count, total, longest, errors) in other.groups.items():
+            group = self.groups.setdefault(name, [0, 0, 0, 0])
+            group[0] += count
+            group[1] += total
+            group[2] = max(group[2], longest)
+            group[3] += errors
+        for mine, theirs in ((self.hosts, other.hosts), (self.terminals, other.terminals)):
+            for key, ms in theirs.items():
+                mine[key] = mine.get(key, 0) + ms
+        self.measured += other.measured
+        self.cpu = [a + b for a, b in zip(self.cpu, other.cpu)]
+        self.blocks = [a + b for a, b in zip(self.blocks, other.blocks)]
+        if other.peak_rss and (self.peak_rss is None or other.peak_rss[0] > self.peak_rss[0]):
+            self.peak_rss = other.peak_rss
+        self.first_output = [self.first_output[0] + other.first_output[0],
+                             self.first_output[1] + other.first_output[1],
+                             max(self.first_output[2], other.first_output[2])]
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.__dict__.update(data)
+        return stats
+
+    def percentile(self, pct):
+        if not self.commands:
+            return 0
+        rank = max(1, int(math.ceil(pct / 100.0 * self.commands)))
+        seen = 0
+        for bucket in sorted(self.hist, key=int):
+            seen += self.hist[bucket]
+            if seen >= rank:
+                return min(_bucket_ms(int(bucket)), self.max_ms)
+        return self.max_ms
+
+
+def trace_stats(trace_file, source=None):
+    session = open_session(trace_file)
+    stats = SessionStats()
+    host = session.header.get('hostname')
+    # A standalone trace is one terminal; daemon traces tag each event.
+    terminal = session.header.get('session_id') or os.path.basename(trace_file)
+    fields = ('id', 'timestamp', 'command', 'exit_code', 'duration_ms', 'resources', 'host', 'terminal')
+    for event in session.events(fields=fields):
+        stats.add(event, host, terminal, source)
+    stats.add_session(session.header, session.end_time)
+    return stats, session
+
+
+def _load_cache(path):
     try:
-        start = datetime.datetime.fromisoformat(session['start_time'])
-        end = datetime.datetime.fromisoformat(session['end_time'])
-        dur_sec = int((end - start).total_seconds())
-    except Exception:
-        dur_sec = sum(e.get('duration_ms', 0) for e in events) // 1000
-        
-    print(f"Session: {session.get('session_id')}")
-    print(f"Host: {session.get('hostname')}")
-    print(f"Duration: {dur_sec} seconds")
-    print(f"Total commands: {len(events)}")
-    print(f"Errors detected: {err_count}")
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != SUMMARY_CACHE_VERSION:
+        return {}
+    return cache.get("files", {})
+
+
+def _save_cache(path, files):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json(path, {"version": SUMMARY_CACHE_VERSION, "files": files})
+
+
+def directory_stats(directory):
+    """Aggregate every trace under directory, reusing cached per-trace stats.
+
+    The cache lives next to the search index and is keyed by each trace's
+    mtime and size, so only new or changed traces are read again.
+    """
+    from index import find_traces, INDEX_DIRNAME
+
+    cache_path = os.path.join(directory, INDEX_DIRNAME, SUMMARY_CACHE)
+    cached = _load_cache(cache_path)
+    files = {}
+    total = SessionStats()
+    dirty = False
+    for rel, (mtime, size) in sorted(find_traces(directory).items()):
+        entry = cached.get(rel)
+        if entry and entry["mtime"] == mtime and entry["size"] == size:
+            stats = SessionStats.from_dict(entry["stats"])
+        else:
+            try:
+                stats, _ = trace_stats(os.path.join(directory, rel), source=rel)
+            except (OSError, ValueError) as e:
+                print(f"Warning: skipping {rel}: {e}")
+                continue
+            dirty = True
+        files[rel] = {"mtime": mtime, "size": size, "stats": stats.to_dict()}
+        total.merge(stats)
+    if dirty or len(files) != len(cached):
+        _save_cache(cache_path, files)
+    return total
+
+
+def _print_shares(title, totals, total_ms, top):
+    if not totals:
+        return
+    print(f"\n{title}:")
+    for name, ms in sorted(totals.items(), key=lambda kv: -kv[1])[:top]:
+        share = 100.0 * ms / total_ms if total_ms else 0.0
+        print(f"  {_fmt_ms(ms):>9}  {share:5.1f}%  {name}")
+
+
+def print_stats(stats, top=TOP_N, show_source=False):
+    if stats.measured:
+        print(f"CPU time: {stats.cpu[0] / 1000:.2f}s user, {stats.cpu[1] / 1000:.2f}s system ({stats.measured} measured commands)")
+        if stats.peak_rss:
+            print(f"Peak memory: {stats.peak_rss[0] / 1024:.1f} MB ($ {stats.peak_rss[1]})")
+        print(f"Block I/O: {stats.blocks[0]} in, {stats.blocks[1]} out")
+    if stats.first_output[1]:
+        print(f"Time to first output: {stats.first_output[0] // stats.first_output[1]} ms avg, {stats.first_output[2]} ms max")
+    if not stats.commands:
+        return
+
+    print(f"\nCommand time: {_fmt_ms(stats.total_ms)} total")
+    print("Duration percentiles: " + "  ".join(
+        f"p{p} {_fmt_ms(stats.percentile(p))}" for p in (50, 90, 95, 99)) + f"  max {_fmt_ms(stats.max_ms)}")
+
+    print("\nSlowest commands:")
+    for ms, command, timestamp, source, event_id in sorted(stats.top, key=lambda e: -e[0])[:top]:
+        where = f"{source} #{event_id}" if show_source else f"#{event_id}"
+        print(f"  {_fmt_ms(ms):>9}  $ {command}  [{timestamp}, {where}]")
+
+    print("\nSlowest command groups (by total time):")
+    groups = sorted(stats.groups.items(), key=lambda kv: -kv[1][1])[:top]
+    for name, (count, total, longest, errors) in groups:
+        print(f"  {_fmt_ms(total):>9}  {count:>5} runs  avg {_fmt_ms(total / count):>7}  "
+              f"max {_fmt_ms(longest):>7}  {errors:>4} errors  {name}")
+
+    _print_shares("Time by host", stats.hosts, stats.total_ms, top)
+    _print_shares("Time by terminal", stats.terminals, stats.total_ms, top)
+
+
+def summarize_session(trace_file, top=TOP_N, session_id=None):
+    if session_id is not None or is_database(trace_file):
+        summarize_database(open_session(trace_file, session_id), top)
+        return
+    stats, session = trace_stats(trace_file)
+
+    print(f"Session: {session.header.get('session_id')}")
+    print(f"Host: {session.header.get('hostname')}")
+    print(f"Duration: {stats.wall_sec} seconds")
+    print(f"Total commands: {stats.commands}")
+    print(f"Errors detected: {stats.errors}")
+    print_stats(stats, top)
+
+
+def summarize_directory(directory, top=TOP_N):
+    stats = directory_stats(directory)
+
+    print(f"Traces: {stats.sessions} in {directory}")
+    print(f"Recorded time: {_fmt_ms(stats.wall_sec * 1000)}")
+    print(f"Total commands: {stats.commands}")
+    print(f"Errors detected: {stats.errors}")
+    print_stats(stats, min(top, CACHED_TOP), show_source=True)
+
+
+def summarize_database(db, top=TOP_N):
+    """Summarize the sessions of a database with aggregate queries (see DatabaseSession.stats)."""
+    stats = db.stats()
+
+    if db.session_id is not None:
+        print(f"Session: {db.session_id}")
+        print(f"Host: {db.header.get('hostname')}")
+    else:
+        print(f"Sessions: {stats.sessions} in {db.trace_file}")
+    print(f"Recorded time: {_fmt_ms(stats.wall_sec * 1000)}")
+    print(f"Total commands: {stats.commands}")
+    print(f"Errors detected: {stats.errors}")
+    print_stats(stats, min(top, CACHED_TOP), show_source=db.session_id is None)